@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""
+Benchmark runner for mainBrokers.py
+Times parsing, merging, valuation and holdings writing (CSV, columnar, JSON lines) on synthetic exports, and the
+serial and asyncio pipelines on a simulated slow network share, and stores the results as JSON so they can be
+compared across revisions
+"""
+
+import os
+import sys
+import csv
+import json
+import time
+import logging
+import platform
+import argparse
+import tempfile
+import functools
+import subprocess
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARKS_DIR))
+
+import mainBrokers
+from portfolioValuation import value_portfolio, has_numpy
+from holdingsWriters import write_holdings, write_holdings_csv
+from scenarios import aScenario, value_scenarios
+from asyncPipeline import aPipelineJob, merge_async, read_export, parse_export
+from brokerAdapters import ACCOUNT_BROKERS
+from synthetic_exports import generate_exports
+
+def git_revision():
+    try:
+        result = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BENCHMARKS_DIR,
+                                capture_output=True, text=True, timeout=10)
+        return result.stdout.strip() or 'unknown'
+    except (OSError, subprocess.TimeoutExpired):
+        return 'unknown'
+
+def best_time(func, repeat):
+    """Run func repeat times and return (best wall time in seconds, last result)"""
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+def parse_legacy_cs(filename):
+    """Parse a legacy layout CS file with the classifyLineCs fast path (no loader uses this layout)"""
+    shares = []
+    with open(filename, newline='') as csvfile:
+        for row in csv.reader(csvfile, delimiter=',', quotechar='"'):
+            status, share = mainBrokers.classifyLineCs(row)
+            if status == mainBrokers.ROW_POSITION:
+                shares.append(share)
+    return shares
+
+def read_slow_share(filename, latency):
+    """Read a file as from a network share, waiting latency seconds first"""
+    time.sleep(latency)
+    return read_export(filename)
+
+def merge_serial(jobs, targets_file, fund_info_file, read_file):
+    """Run pipeline jobs one stage after the other, the baseline of merge_async"""
+    merger = mainBrokers.PortfolioMerger(reference=(mainBrokers.compile_targets(targets_file),
+                                                    mainBrokers.load_fund_info(fund_info_file)))
+    results = []
+    for job in jobs:
+        sources = []
+        for account, filename in job.sources:
+            file_type, aShares, _, _ = parse_export(read_file(filename), ACCOUNT_BROKERS.get(account), filename)
+            sources.append((account or file_type, aShares))
+        holdings = merger.build_holdings(mainBrokers.consolidate_positions(sources), {}, merger.metrics)
+        write_holdings(holdings, job.output_file, job.output_format)
+        results.append(holdings)
+    return results
+
+def run_benchmarks(paths, repeat, work_dir, read_latency=0.05, nb_jobs=4):
+    """
+    Time every stage on the generated files.
+
+    Returns:
+        Dictionary mapping stage name to {'seconds', 'rows'}
+    """
+    results = {}
+    def record(stage, func, rows_of):
+        seconds, result = best_time(func, repeat)
+        results[stage] = {'seconds': seconds, 'rows': rows_of(result)}
+        print(f"   {stage:<22} {seconds * 1000:10.2f} ms  ({results[stage]['rows']} rows)")
+        return result
+
+    cs_shares = record('parse_cs', lambda: list(mainBrokers.iterSharesCs(paths['cs'])), len)
+    record('parse_cs_legacy', lambda: parse_legacy_cs(paths['cs_legacy']), len)
+    ibkr_shares = record('parse_ibkr', lambda: list(mainBrokers.iterSharesIBKR(paths['ibkr'])), len)
+    record('detect', lambda: [mainBrokers.detect_file_type(path) for path in paths.values()], len)
+
+    portfolio = record('merge', lambda: mainBrokers.consolidate_positions(
+        [('ibkr', ibkr_shares), ('cs', cs_shares)]), len)
+    valuation = record('valuation', lambda: value_portfolio(portfolio, {}), lambda v: len(v.columns.symbols))
+    shocks = [aScenario(f"shock_{k}", {'*': (k - 50) / 500}) for k in range(100)]
+    record('scenarios_100', lambda: value_scenarios(valuation, shocks), lambda b: len(b) * len(b.columns.symbols))
+
+    output_file = os.path.join(work_dir, 'holdings.csv')
+    def write():
+        holdings = mainBrokers.aHoldings(mainBrokers.build_holdings_rows(portfolio, valuation, {}, {}),
+                                         portfolio, valuation, 'target_global', {})
+        write_holdings_csv(holdings, output_file)
+        return holdings
+    holdings = record('write_csv', write, lambda h: len(h.rows))
+    for output_format in ('columnar', 'jsonl'):
+        output_file = os.path.join(work_dir, f'holdings.{output_format}')
+        record(f'write_{output_format}', lambda: write_holdings(holdings, output_file, output_format) or holdings,
+               lambda h: len(h.rows))
+
+    # Several portfolios read from a share answering each read after read_latency seconds
+    targets_file = os.path.join(work_dir, 'targets.json')
+    fund_info_file = os.path.join(work_dir, 'fund_info.json')
+    for filename in (targets_file, fund_info_file):
+        with open(filename, 'w') as f:
+            f.write('{}')
+    jobs = [aPipelineJob(f"job_{k}", [('ibkr', paths['ibkr']), ('cs', paths['cs'])],
+                         os.path.join(work_dir, f'holdings_{k}.csv')) for k in range(nb_jobs)]
+    read_file = functools.partial(read_slow_share, latency=read_latency)
+    record(f'serial_share_{nb_jobs}', lambda: merge_serial(jobs, targets_file, fund_info_file, read_file),
+           lambda r: sum(len(h.rows) for h in r))
+    record(f'async_share_{nb_jobs}', lambda: merge_async(jobs, targets_file=targets_file, fund_info_file=fund_info_file,
+                                                          read_file=read_file),
+           lambda r: sum(len(h.rows) for h in r))
+    return results
+
+def compare(results, previous_file):
+    """Print the relative change of every stage against a previous results file"""
+    with open(previous_file, 'r') as f:
+        previous = json.load(f)
+    print(f"\nComparison with {previous_file} (revision {previous.get('revision', 'unknown')}):")
+    for stage, current in results.items():
+        before = previous.get('results', {}).get(stage)
+        if not before or not before['seconds']:
+            print(f"   {stage:<22} (no previous result)")
+            continue
+        change = (current['seconds'] - before['seconds']) / before['seconds'] * 100
+        print(f"   {stage:<22} {before['seconds'] * 1000:10.2f} ms -> {current['seconds'] * 1000:10.2f} ms  ({change:+.1f}%)")
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark mainBrokers.py stages on synthetic exports.')
+    parser.add_argument('--rows', type=int, default=100000, help='Data rows per file (default: 100000)')
+    parser.add_argument('--option-ratio', type=float, default=0.2, help='Fraction of option rows (default: 0.2)')
+    parser.add_argument('--overlap', type=float, default=0.5, help='Fraction of positions shared by all files (default: 0.5)')
+    parser.add_argument('--seed', type=int, default=42, help='Random seed (default: 42)')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per stage, the best time is kept (default: 3)')
+    parser.add_argument('--read-latency', type=float, default=0.05,
+                        help='Seconds added to each file read of the simulated network share (default: 0.05)')
+    parser.add_argument('--output', default=None, help='Results JSON file (default: benchmark_<revision>.json)')
+    parser.add_argument('--compare', default=None, help='Previous results JSON file to compare with')
+    args = parser.parse_args()
+
+    # Only time the code, not the console output of the expected header row errors
+    logging.basicConfig(level=logging.CRITICAL)
+
+    revision = git_revision()
+    print("=" * 70)
+    print(f"PortfolioMerger benchmarks - revision {revision}")
+    print("=" * 70)
+    print(f"\nRows per file: {args.rows}, option ratio: {args.option_ratio}, overlap: {args.overlap}, repeat: {args.repeat}")
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        start = time.perf_counter()
+        paths = generate_exports(work_dir, args.rows, args.option_ratio, args.overlap, args.seed)
+        print(f"Generated synthetic exports in {time.perf_counter() - start:.2f} s\n")
+        results = run_benchmarks(paths, args.repeat, work_dir, args.read_latency)
+
+    report = {
+        'revision': revision,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'numpy': has_numpy(),
+        'params': {'rows': args.rows, 'option_ratio': args.option_ratio, 'overlap': args.overlap,
+                   'seed': args.seed, 'repeat': args.repeat, 'read_latency': args.read_latency},
+        'results': results,
+    }
+    output_file = args.output or f"benchmark_{revision}.json"
+    with open(output_file, 'w') as f:
+        json.dump(report, f, indent=4)
+    print(f"\nResults written to {output_file}")
+
+    if args.compare:
+        compare(results, args.compare)
+
+if __name__ == "__main__":
+    main()
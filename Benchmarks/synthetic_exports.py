@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Synthetic broker export generator for PortfolioMerger benchmarks
+Writes Charles Schwab (legacy and 2026 layouts) and IBKR position files
+"""
+
+import os
+import csv
+import random
+import string
+import argparse
+
+# Tickers are generated from an index so every run with the same seed gives the same files
+TICKER_LETTERS = string.ascii_uppercase
+
+def make_ticker(index):
+    """Return a deterministic 4 or 5 letter ticker for an index"""
+    letters = []
+    index += 26 ** 3  # Start at 4 letters, there are not enough 2 and 3 letter tickers for large files
+    while index:
+        index, rest = divmod(index, 26)
+        letters.append(TICKER_LETTERS[rest])
+    return ''.join(reversed(letters))
+
+def make_option(ticker, rng):
+    return f"{ticker[:4]} {rng.randint(1, 12)}/{rng.randint(1, 28)}/2026 {rng.randint(10, 900)}.00 {rng.choice('PC')}"
+
+def plan_positions(nb_files, rows, option_ratio, overlap, seed=42):
+    """
+    Choose the rows of each file.
+
+    Args:
+        nb_files: Number of files to generate
+        rows: Number of data rows per file
+        option_ratio: Fraction of rows that are options
+        overlap: Fraction of the positions of each file shared by all files
+        seed: Random seed
+
+    Returns:
+        List (one entry per file) of lists of (ticker, nbShares, price, is_option)
+    """
+    rng = random.Random(seed)
+    nb_options = int(rows * option_ratio)
+    nb_positions = rows - nb_options
+    nb_shared = int(nb_positions * overlap)
+    nb_own = nb_positions - nb_shared
+
+    # Shared symbols keep a common base price so the merge price check passes
+    base_prices = {}
+    def price_of(ticker):
+        if ticker not in base_prices:
+            base_prices[ticker] = round(rng.uniform(5, 500), 2)
+        return round(base_prices[ticker] * rng.uniform(0.99, 1.01), 2)
+
+    shared = [make_ticker(i) for i in range(nb_shared)]
+    files = []
+    next_index = nb_shared
+    for _ in range(nb_files):
+        tickers = shared + [make_ticker(next_index + i) for i in range(nb_own)]
+        next_index += nb_own
+        file_rows = [(ticker, rng.randint(1, 2000), price_of(ticker), False) for ticker in tickers]
+        file_rows += [(make_option(rng.choice(tickers or ['SPY']), rng), rng.randint(1, 10),
+                       round(rng.uniform(0.5, 50), 2), True) for _ in range(nb_options)]
+        rng.shuffle(file_rows)
+        files.append(file_rows)
+    return files
+
+def write_cs_export(path, file_rows, legacy=False):
+    """Write a Charles Schwab positions export (2026 layout, or legacy layout with legacy=True)"""
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f, quoting=csv.QUOTE_ALL)
+        writer.writerow(["Positions for account Brokerage ...000 as of 10:00 AM ET, 2026/01/05"])
+        if legacy:
+            writer.writerow(["Symbol", "Description", "Security Type", "Quantity", "Price", "Market Value"])
+        else:
+            writer.writerow(["Symbol", "Description", "Qty (Quantity)", "Price", "Price Chng %", "Mkt Val (Market Value)"])
+        for ticker, nb, price, _ in file_rows:
+            if legacy:
+                writer.writerow([ticker, "SYNTHETIC", "ETF", nb, f"${price}", f"${nb * price:.2f}"])
+            else:
+                writer.writerow([ticker, "SYNTHETIC", nb, price, "0.10%", f"${nb * price:,.2f}"])
+        writer.writerow([])
+        writer.writerow(["Positions Total", "", "", "", "", ""])
+
+def write_ibkr_export(path, file_rows):
+    """Write an Interactive Brokers positions export"""
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f, quoting=csv.QUOTE_ALL)
+        writer.writerow(["Symbol", "Position", "Last"])
+        for ticker, nb, price, _ in file_rows:
+            writer.writerow([ticker, nb, price])
+
+def generate_exports(out_dir, rows=1000, option_ratio=0.2, overlap=0.5, seed=42):
+    """
+    Generate one export of each layout (CS 2026, CS legacy, IBKR) in out_dir.
+
+    Returns:
+        Dictionary mapping 'cs', 'cs_legacy' and 'ibkr' to the generated file paths
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    cs_rows, legacy_rows, ibkr_rows = plan_positions(3, rows, option_ratio, overlap, seed)
+    paths = {
+        'cs': os.path.join(out_dir, 'cs.csv'),
+        'cs_legacy': os.path.join(out_dir, 'cs_legacy.csv'),
+        'ibkr': os.path.join(out_dir, 'ibkr.csv'),
+    }
+    write_cs_export(paths['cs'], cs_rows)
+    write_cs_export(paths['cs_legacy'], legacy_rows, legacy=True)
+    write_ibkr_export(paths['ibkr'], ibkr_rows)
+    return paths
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate synthetic CS and IBKR position exports.')
+    parser.add_argument('--out-dir', default='./synthetic', help='Output directory (default: ./synthetic)')
+    parser.add_argument('--rows', type=int, default=1000, help='Data rows per file (default: 1000)')
+    parser.add_argument('--option-ratio', type=float, default=0.2, help='Fraction of option rows (default: 0.2)')
+    parser.add_argument('--overlap', type=float, default=0.5, help='Fraction of positions shared by all files (default: 0.5)')
+    parser.add_argument('--seed', type=int, default=42, help='Random seed (default: 42)')
+    args = parser.parse_args()
+
+    paths = generate_exports(args.out_dir, args.rows, args.option_ratio, args.overlap, args.seed)
+    for layout, path in paths.items():
+        print(f"{layout:<10} {path}")
+
+if __name__ == "__main__":
+    main()
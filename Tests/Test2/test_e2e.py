@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+End-to-end test for mainBrokers.py
+Tests the consolidation of ibkr.csv, cs.csv and ira.csv against the reference holdings.csv
+"""
+
+import subprocess
+import os
+import csv
+import sys
+
+def run_test():
+    """Run the end-to-end test"""
+    print("=" * 70)
+    print("Running End-to-End Test for mainBrokers.py (named accounts)")
+    print("=" * 70)
+
+    output_file = './test_output.csv'
+    reference_file = './holdings.csv'
+
+    # Run the main script with the named account parameters
+    cmd = ['python3', '../../mainBrokers.py',
+           '--ibkr', './ibkr.csv', '--cs', './cs.csv', '--ira', './ira.csv',
+           '--target', './targets.json', '--fund-info', '../../fund_info.json',
+           '--output', output_file]
+    print(f"\n1. Running: {' '.join(cmd)}")
+
+    try:
+        result = subprocess.run(cmd, capture_output=True, text=True, timeout=30)
+    except subprocess.TimeoutExpired:
+        print("\n   ✗ Script timeout after 30 seconds")
+        return False
+
+    print(f"   Exit code: {result.returncode}")
+    if result.returncode != 0:
+        print(result.stderr)
+        print(f"   ✗ Script failed with exit code {result.returncode}")
+        return False
+
+    # Compare with reference file
+    print(f"\n2. Comparing output with reference file: {reference_file}")
+    with open(output_file, 'r') as f:
+        generated_rows = list(csv.reader(f))
+    with open(reference_file, 'r') as f:
+        reference_rows = list(csv.reader(f))
+
+    if generated_rows[0] != reference_rows[0]:
+        print(f"   ✗ Header mismatch:")
+        print(f"      Generated: {generated_rows[0]}")
+        print(f"      Reference: {reference_rows[0]}")
+        return False
+    print(f"   ✓ Headers match")
+
+    gen_dict = {row[0]: row for row in generated_rows[1:]}
+    ref_dict = {row[0]: row for row in reference_rows[1:]}
+    if gen_dict != ref_dict:
+        for ticker in sorted(set(gen_dict) | set(ref_dict)):
+            if gen_dict.get(ticker) != ref_dict.get(ticker):
+                print(f"   ✗ {ticker}:")
+                print(f"         Generated: {gen_dict.get(ticker)}")
+                print(f"         Reference: {ref_dict.get(ticker)}")
+        return False
+    print(f"   ✓ All {len(ref_dict)} data rows match the reference file")
+
+    # Clean up
+    os.remove(output_file)
+    return True
+
+
+if __name__ == "__main__":
+    print()
+    success = run_test()
+
+    print("\n" + "=" * 70)
+    if success:
+        print("✓ END-TO-END TEST PASSED")
+        print("=" * 70)
+        sys.exit(0)
+    else:
+        print("✗ END-TO-END TEST FAILED")
+        print("=" * 70)
+        sys.exit(1)
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+End-to-end test for mainTrades.py
+Tests the merge of ibkr_trades.csv (oldest first) and cs_trades.csv (newest first) against
+the reference all_trades.csv and trades_summary.csv
+"""
+
+import subprocess
+import os
+import csv
+import sys
+
+def compare_files(output_file, reference_file):
+    """Compare a generated CSV file with its reference, row by row"""
+    with open(output_file, 'r') as f:
+        generated_rows = list(csv.reader(f))
+    with open(reference_file, 'r') as f:
+        reference_rows = list(csv.reader(f))
+
+    if generated_rows == reference_rows:
+        print(f"   ✓ All {len(reference_rows) - 1} data rows of {reference_file} match")
+        return True
+    for i in range(max(len(generated_rows), len(reference_rows))):
+        generated = generated_rows[i] if i < len(generated_rows) else None
+        reference = reference_rows[i] if i < len(reference_rows) else None
+        if generated != reference:
+            print(f"   ✗ Row {i}:")
+            print(f"         Generated: {generated}")
+            print(f"         Reference: {reference}")
+    return False
+
+def run_test():
+    """Run the end-to-end test"""
+    print("=" * 70)
+    print("Running End-to-End Test for mainTrades.py")
+    print("=" * 70)
+
+    output_file = './test_all_trades.csv'
+    summary_file = './test_trades_summary.csv'
+
+    # Run the script on both broker files
+    cmd = ['python3', '../../mainTrades.py',
+           '--ibkr-file', './ibkr_trades.csv', '--cs-file', './cs_trades.csv',
+           '--single-stocks', '../../single_stocks.json',
+           '--output', output_file, '--summary', summary_file]
+    print(f"\n1. Running: {' '.join(cmd)}")
+
+    try:
+        result = subprocess.run(cmd, capture_output=True, text=True, timeout=30)
+    except subprocess.TimeoutExpired:
+        print("\n   ✗ Script timeout after 30 seconds")
+        return False
+
+    print(f"   Exit code: {result.returncode}")
+    if result.returncode != 0:
+        print(result.stderr)
+        print(f"   ✗ Script failed with exit code {result.returncode}")
+        return False
+
+    # Compare with reference files
+    print("\n2. Comparing outputs with reference files")
+    if not compare_files(output_file, './all_trades.csv'):
+        return False
+    if not compare_files(summary_file, './trades_summary.csv'):
+        return False
+
+    # Clean up
+    os.remove(output_file)
+    os.remove(summary_file)
+    return True
+
+
+if __name__ == "__main__":
+    print()
+    success = run_test()
+
+    print("\n" + "=" * 70)
+    if success:
+        print("✓ END-TO-END TEST PASSED")
+        print("=" * 70)
+        sys.exit(0)
+    else:
+        print("✗ END-TO-END TEST FAILED")
+        print("=" * 70)
+        sys.exit(1)
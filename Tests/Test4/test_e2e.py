@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+End-to-end test of the price conflict policies of mainBrokers.py
+Tests ibkr.csv, cs.csv and ira.csv, whose SHV and VTI quotes differ by more than 10% between
+accounts, under the abort, median and prefer policies against the reference holdings and
+validation reports
+"""
+
+import subprocess
+import os
+import csv
+import sys
+
+# Price policy, expected exit code, reference holdings (None: no holdings written), reference report
+POLICIES = [
+    ('abort', 1, None, './validation_abort.csv'),
+    ('median', 0, './holdings_median.csv', './validation_median.csv'),
+    ('prefer:ibkr,ira', 0, './holdings_prefer.csv', './validation_prefer.csv'),
+]
+
+def compare_files(output_file, reference_file):
+    """Compare a generated CSV file with its reference, row by row"""
+    with open(output_file, 'r') as f:
+        generated_rows = list(csv.reader(f))
+    with open(reference_file, 'r') as f:
+        reference_rows = list(csv.reader(f))
+
+    if generated_rows == reference_rows:
+        print(f"   ✓ All {len(reference_rows) - 1} data rows of {reference_file} match")
+        return True
+    for i in range(max(len(generated_rows), len(reference_rows))):
+        generated = generated_rows[i] if i < len(generated_rows) else None
+        reference = reference_rows[i] if i < len(reference_rows) else None
+        if generated != reference:
+            print(f"   ✗ Row {i}:")
+            print(f"         Generated: {generated}")
+            print(f"         Reference: {reference}")
+    return False
+
+def run_policy(policy, expected_code, holdings_reference, report_reference):
+    """Merge the accounts under one price policy and check its exit code, holdings and report"""
+    output_file = './test_output.csv'
+    report_file = './test_validation.csv'
+    for aFile in (output_file, report_file):
+        if os.path.exists(aFile):
+            os.remove(aFile)
+
+    cmd = ['python3', '../../mainBrokers.py',
+           '--ibkr', 'ibkr.csv', '--cs', 'cs.csv', '--ira', 'ira.csv',
+           '--target', './targets.json', '--fund-info', '../../fund_info.json',
+           '--price-policy', policy, '--output', output_file, '--validation-report', report_file]
+    print(f"\n   Running: {' '.join(cmd)}")
+
+    try:
+        result = subprocess.run(cmd, capture_output=True, text=True, timeout=30)
+    except subprocess.TimeoutExpired:
+        print("\n   ✗ Script timeout after 30 seconds")
+        return False
+
+    print(f"   Exit code: {result.returncode}")
+    if result.returncode != expected_code:
+        print(result.stderr)
+        print(f"   ✗ Expected exit code {expected_code}")
+        return False
+
+    if holdings_reference is None:
+        if os.path.exists(output_file):
+            print(f"   ✗ Holdings were written although the merge aborted")
+            return False
+        print(f"   ✓ No holdings written")
+    elif not compare_files(output_file, holdings_reference):
+        return False
+    if not compare_files(report_file, report_reference):
+        return False
+
+    # Clean up
+    for aFile in (output_file, report_file):
+        if os.path.exists(aFile):
+            os.remove(aFile)
+    return True
+
+def run_test():
+    """Run the end-to-end test"""
+    print("=" * 70)
+    print("Running End-to-End Test for mainBrokers.py (price conflict policies)")
+    print("=" * 70)
+
+    for i, (policy, expected_code, holdings_reference, report_reference) in enumerate(POLICIES, 1):
+        print(f"\n{i}. Price policy: {policy}")
+        if not run_policy(policy, expected_code, holdings_reference, report_reference):
+            return False
+    return True
+
+
+if __name__ == "__main__":
+    print()
+    success = run_test()
+
+    print("\n" + "=" * 70)
+    if success:
+        print("✓ END-TO-END TEST PASSED")
+        print("=" * 70)
+        sys.exit(0)
+    else:
+        print("✗ END-TO-END TEST FAILED")
+        print("=" * 70)
+        sys.exit(1)
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+End-to-end test of the tax impact of mainBrokers.py (--tax-lots)
+Tests the sales to target of ibkr.csv, cs.csv and ira.csv against the lots of lots.csv with the
+FIFO, HIFO and specific selections (specific_lots.json), checking the long/short-term split
+against the reference tax_*.csv files
+"""
+
+import subprocess
+import os
+import csv
+import sys
+
+# Lot method, extra arguments, reference tax impact
+METHODS = [
+    ('fifo', [], './tax_fifo.csv'),
+    ('hifo', [], './tax_hifo.csv'),
+    ('specific', ['--specific-lots', './specific_lots.json'], './tax_specific.csv'),
+]
+
+def compare_files(output_file, reference_file):
+    """Compare a generated CSV file with its reference, row by row"""
+    with open(output_file, 'r') as f:
+        generated_rows = list(csv.reader(f))
+    with open(reference_file, 'r') as f:
+        reference_rows = list(csv.reader(f))
+
+    if generated_rows == reference_rows:
+        print(f"   ✓ All {len(reference_rows) - 1} data rows of {reference_file} match")
+        return True
+    for i in range(max(len(generated_rows), len(reference_rows))):
+        generated = generated_rows[i] if i < len(generated_rows) else None
+        reference = reference_rows[i] if i < len(reference_rows) else None
+        if generated != reference:
+            print(f"   ✗ Row {i}:")
+            print(f"         Generated: {generated}")
+            print(f"         Reference: {reference}")
+    return False
+
+def run_merge(extra_args, timeout=30):
+    cmd = ['python3', '../../mainBrokers.py',
+           '--ibkr', './ibkr.csv', '--cs', './cs.csv', '--ira', './ira.csv',
+           '--target', './targets.json', '--fund-info', '../../fund_info.json',
+           '--output', './test_output.csv', '--tax-lots', './lots.csv'] + extra_args
+    print(f"\n   Running: {' '.join(cmd)}")
+    return subprocess.run(cmd, capture_output=True, text=True, timeout=timeout)
+
+def run_test():
+    """Run the end-to-end test"""
+    print("=" * 70)
+    print("Running End-to-End Test for mainBrokers.py (tax lots)")
+    print("=" * 70)
+
+    tax_file = './test_tax_impact.csv'
+    try:
+        for i, (method, extra_args, reference_file) in enumerate(METHODS, 1):
+            print(f"\n{i}. Lot method: {method}")
+            result = run_merge(['--tax-date', '2026-06-30', '--lot-method', method, '--tax-output', tax_file]
+                               + extra_args)
+            print(f"   Exit code: {result.returncode}")
+            if result.returncode != 0:
+                print(result.stderr)
+                print(f"   ✗ Script failed with exit code {result.returncode}")
+                return False
+            if not compare_files(tax_file, reference_file):
+                return False
+
+        # A date that is not ISO is rejected before any merge
+        print(f"\n{len(METHODS) + 1}. Invalid sale date")
+        result = run_merge(['--tax-date', '05/01/2026', '--tax-output', tax_file])
+        print(f"   Exit code: {result.returncode}")
+        if result.returncode == 0 or 'Traceback' in result.stderr or 'invalid ISO date' not in result.stderr:
+            print(result.stderr)
+            print(f"   ✗ Expected an argument error")
+            return False
+        print(f"   ✓ Rejected with an argument error")
+    except subprocess.TimeoutExpired:
+        print("\n   ✗ Script timeout after 30 seconds")
+        return False
+
+    # Clean up
+    os.remove('./test_output.csv')
+    os.remove(tax_file)
+    return True
+
+
+if __name__ == "__main__":
+    print()
+    success = run_test()
+
+    print("\n" + "=" * 70)
+    if success:
+        print("✓ END-TO-END TEST PASSED")
+        print("=" * 70)
+        sys.exit(0)
+    else:
+        print("✗ END-TO-END TEST FAILED")
+        print("=" * 70)
+        sys.exit(1)
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+End-to-end test for reconcile.py
+Tests the replay of ibkr_trades.csv and cs_trades.csv on the prior holdings_snapshot.csv against
+the new ibkr.csv and cs.csv positions: trades of the snapshot day (2026-01-05) are part of the
+snapshot, the missing CS SHV shares are the only break and the exit code is 1
+"""
+
+import subprocess
+import os
+import csv
+import sys
+
+def run_test():
+    """Run the end-to-end test"""
+    print("=" * 70)
+    print("Running End-to-End Test for reconcile.py")
+    print("=" * 70)
+
+    output_file = './test_reconciliation.csv'
+    reference_file = './reconciliation.csv'
+
+    cmd = ['python3', '../../reconcile.py',
+           '--holdings', './holdings_snapshot.csv', '--since', '2026-01-05',
+           '--ibkr', './ibkr.csv', '--ibkr-trades', './ibkr_trades.csv',
+           '--cs', './cs.csv', '--cs-trades', './cs_trades.csv',
+           '--single-stocks', '../../single_stocks.json', '--output', output_file]
+    print(f"\n1. Running: {' '.join(cmd)}")
+
+    try:
+        result = subprocess.run(cmd, capture_output=True, text=True, timeout=30)
+    except subprocess.TimeoutExpired:
+        print("\n   ✗ Script timeout after 30 seconds")
+        return False
+
+    # Exit code 1 signals breaks, 2 a reconciliation that could not run
+    print(f"   Exit code: {result.returncode}")
+    if result.returncode != 1:
+        print(result.stderr)
+        print(f"   ✗ Expected exit code 1 (breaks found)")
+        return False
+
+    # The two trades of the snapshot day are not replayed
+    print("\n2. Checking the trades replayed after the snapshot day")
+    if "Replayed 3 trades, 4 positions checked, 1 break(s)" not in result.stdout:
+        print(result.stdout)
+        print(f"   ✗ Unexpected replay summary")
+        return False
+    print(f"   ✓ 3 trades replayed, 2 trades of the snapshot day excluded")
+
+    print(f"\n3. Comparing output with reference file: {reference_file}")
+    with open(output_file, 'r') as f:
+        generated_rows = list(csv.reader(f))
+    with open(reference_file, 'r') as f:
+        reference_rows = list(csv.reader(f))
+    if generated_rows != reference_rows:
+        for i in range(max(len(generated_rows), len(reference_rows))):
+            generated = generated_rows[i] if i < len(generated_rows) else None
+            reference = reference_rows[i] if i < len(reference_rows) else None
+            if generated != reference:
+                print(f"   ✗ Row {i}:")
+                print(f"         Generated: {generated}")
+                print(f"         Reference: {reference}")
+        return False
+    print(f"   ✓ All {len(reference_rows) - 1} data rows match the reference file")
+
+    breaks = [row for row in generated_rows[1:] if row[-1] == 'break']
+    if [row[:2] for row in breaks] != [['cs', 'SHV']]:
+        print(f"   ✗ Expected a single break on cs SHV, got {breaks}")
+        return False
+    print(f"   ✓ Single break: cs SHV")
+
+    # Clean up
+    os.remove(output_file)
+    return True
+
+
+if __name__ == "__main__":
+    print()
+    success = run_test()
+
+    print("\n" + "=" * 70)
+    if success:
+        print("✓ END-TO-END TEST PASSED")
+        print("=" * 70)
+        sys.exit(0)
+    else:
+        print("✗ END-TO-END TEST FAILED")
+        print("=" * 70)
+        sys.exit(1)
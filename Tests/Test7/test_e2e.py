@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+End-to-end test of the household manifest mode of mainBrokers.py (--manifest)
+Tests manifest.json, whose smith household merges like Test2 and whose jones household has an
+unreadable IBKR file: smith is written and matches holdings.csv, jones fails without stopping
+it, the summary lists both and the exit code is 1
+"""
+
+import subprocess
+import os
+import csv
+import sys
+import shutil
+
+OUTPUT_DIR = './output'
+
+# Expected summary rows, without the output column (absolute path of the holdings file)
+EXPECTED_SUMMARY = [
+    ['household', 'status', 'totalValue', 'value_ibkr', 'value_cs', 'value_ira', 'nbPositions', 'nbFiles', 'issues'],
+    ['smith', 'ok', '36492.50', '7307.00', '26030.00', '3150.50', '4', '3', 'no issue'],
+    ['jones', 'failed', '', '', '', '', '', '2', '1 invalid_file'],
+    ['TOTAL', '1/2 ok', '36492.50', '7307.00', '26030.00', '3150.50', '', '5', ''],
+]
+
+def run_test():
+    """Run the end-to-end test"""
+    print("=" * 70)
+    print("Running End-to-End Test for mainBrokers.py (household manifest)")
+    print("=" * 70)
+
+    if os.path.exists(OUTPUT_DIR):
+        shutil.rmtree(OUTPUT_DIR)
+
+    cmd = ['python3', '../../mainBrokers.py', '--manifest', './manifest.json',
+           '--single-stocks', '../../single_stocks.json']
+    print(f"\n1. Running: {' '.join(cmd)}")
+
+    try:
+        result = subprocess.run(cmd, capture_output=True, text=True, timeout=30)
+    except subprocess.TimeoutExpired:
+        print("\n   ✗ Script timeout after 30 seconds")
+        return False
+
+    # A failed household makes the run fail once the others are written
+    print(f"   Exit code: {result.returncode}")
+    if result.returncode != 1:
+        print(result.stderr)
+        print(f"   ✗ Expected exit code 1 (one household failed)")
+        return False
+
+    print("\n2. Checking the household summary")
+    with open(os.path.join(OUTPUT_DIR, 'households_summary.csv'), 'r') as f:
+        summary_rows = list(csv.reader(f))
+    if [row[:-1] for row in summary_rows] != EXPECTED_SUMMARY:
+        for generated, expected in zip([row[:-1] for row in summary_rows], EXPECTED_SUMMARY):
+            if generated != expected:
+                print(f"   ✗ Generated: {generated}")
+                print(f"     Expected:  {expected}")
+        if len(summary_rows) != len(EXPECTED_SUMMARY):
+            print(f"   ✗ {len(summary_rows)} rows instead of {len(EXPECTED_SUMMARY)}")
+        return False
+    if os.path.basename(summary_rows[1][-1]) != 'smith_holdings.csv' or summary_rows[2][-1]:
+        print(f"   ✗ Unexpected output files: {summary_rows[1][-1]!r}, {summary_rows[2][-1]!r}")
+        return False
+    print(f"   ✓ All {len(EXPECTED_SUMMARY) - 1} summary rows match")
+
+    print("\n3. Comparing the smith holdings with the reference file: ./holdings.csv")
+    with open(os.path.join(OUTPUT_DIR, 'smith_holdings.csv'), 'r') as f:
+        generated_rows = list(csv.reader(f))
+    with open('./holdings.csv', 'r') as f:
+        reference_rows = list(csv.reader(f))
+    if generated_rows != reference_rows:
+        print(f"   ✗ smith_holdings.csv differs from holdings.csv")
+        return False
+    print(f"   ✓ All {len(reference_rows) - 1} data rows match the reference file")
+    if os.path.exists(os.path.join(OUTPUT_DIR, 'jones_holdings.csv')):
+        print(f"   ✗ Holdings were written for the failed jones household")
+        return False
+    print(f"   ✓ No holdings written for jones")
+
+    # Clean up
+    shutil.rmtree(OUTPUT_DIR)
+    return True
+
+
+if __name__ == "__main__":
+    print()
+    success = run_test()
+
+    print("\n" + "=" * 70)
+    if success:
+        print("✓ END-TO-END TEST PASSED")
+        print("=" * 70)
+        sys.exit(0)
+    else:
+        print("✗ END-TO-END TEST FAILED")
+        print("=" * 70)
+        sys.exit(1)
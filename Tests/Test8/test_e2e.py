@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+End-to-end test of the currencies of mainBrokers.py (--fx-rates)
+Tests ibkr.csv, whose JNK position is priced in EUR and held by no other account: without
+--fx-rates the merge is rejected and no holdings are written, with fx_rates.csv the EUR price
+is converted and the holdings match holdings_fx.csv
+"""
+
+import subprocess
+import os
+import csv
+import sys
+
+def run_merge(output_file, extra_args):
+    cmd = ['python3', '../../mainBrokers.py', '--ibkr', './ibkr.csv',
+           '--target', './targets.json', '--fund-info', '../../fund_info.json',
+           '--output', output_file] + extra_args
+    print(f"\n   Running: {' '.join(cmd)}")
+    return subprocess.run(cmd, capture_output=True, text=True, timeout=30)
+
+def run_test():
+    """Run the end-to-end test"""
+    print("=" * 70)
+    print("Running End-to-End Test for mainBrokers.py (currencies)")
+    print("=" * 70)
+
+    output_file = './test_output.csv'
+    reference_file = './holdings_fx.csv'
+    if os.path.exists(output_file):
+        os.remove(output_file)
+
+    try:
+        # A price in another currency is never added to the USD totals as is
+        print("\n1. EUR position without --fx-rates")
+        result = run_merge(output_file, [])
+        print(f"   Exit code: {result.returncode}")
+        if result.returncode != 1 or 'Use --fx-rates' not in result.stderr:
+            print(result.stderr)
+            print(f"   ✗ Expected the merge to be rejected with exit code 1")
+            return False
+        if os.path.exists(output_file):
+            print(f"   ✗ Holdings were written although the merge was rejected")
+            return False
+        print(f"   ✓ Rejected, no holdings written")
+
+        print("\n2. EUR position with --fx-rates ./fx_rates.csv")
+        result = run_merge(output_file, ['--fx-rates', './fx_rates.csv', '--fx-date', '2026-01-05'])
+        print(f"   Exit code: {result.returncode}")
+        if result.returncode != 0:
+            print(result.stderr)
+            print(f"   ✗ Script failed with exit code {result.returncode}")
+            return False
+    except subprocess.TimeoutExpired:
+        print("\n   ✗ Script timeout after 30 seconds")
+        return False
+
+    print(f"\n3. Comparing output with reference file: {reference_file}")
+    with open(output_file, 'r') as f:
+        generated_rows = list(csv.reader(f))
+    with open(reference_file, 'r') as f:
+        reference_rows = list(csv.reader(f))
+    if generated_rows != reference_rows:
+        for i in range(max(len(generated_rows), len(reference_rows))):
+            generated = generated_rows[i] if i < len(generated_rows) else None
+            reference = reference_rows[i] if i < len(reference_rows) else None
+            if generated != reference:
+                print(f"   ✗ Row {i}:")
+                print(f"         Generated: {generated}")
+                print(f"         Reference: {reference}")
+        return False
+    print(f"   ✓ All {len(reference_rows) - 1} data rows match the reference file")
+
+    # Clean up
+    os.remove(output_file)
+    return True
+
+
+if __name__ == "__main__":
+    print()
+    success = run_test()
+
+    print("\n" + "=" * 70)
+    if success:
+        print("✓ END-TO-END TEST PASSED")
+        print("=" * 70)
+        sys.exit(0)
+    else:
+        print("✗ END-TO-END TEST FAILED")
+        print("=" * 70)
+        sys.exit(1)
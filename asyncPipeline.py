@@ -0,0 +1,245 @@
+import os
+import time
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from mainBrokers import (
+    PortfolioMerger, consolidate_positions, compile_targets, load_fund_info, sniff_file_type, iter_mapped_shares,
+    HEADER_SNIFF_BYTES, BROKER_ADAPTERS, get_single_stocks, init_worker
+)
+from brokerAdapters import ACCOUNT_BROKERS
+from diskCache import aReferenceCache
+from instrumentation import aMetrics
+from holdingsWriters import write_holdings
+from validation import aValidationReport
+
+# Files read but not yet parsed; readers wait when the parsers fall behind
+DEFAULT_QUEUE_SIZE = 4
+DEFAULT_IO_WORKERS = 8
+
+class aPipelineJob:
+    """
+    One portfolio to merge: its sources, its holdings output and optionally its own targets.
+
+    sources is a list of (account, filename) pairs; account None merges the file under the
+    account of its detected broker format, like --batch files. targets_file None uses the
+    targets file of the pipeline. Once run, holdings is the merged aHoldings
+    (None if the job failed), merger the PortfolioMerger holding the shared reference data and
+    report the validation.aValidationReport of the merge (also set when the job failed).
+    """
+    def __init__(self, name, sources, output_file=None, output_format='csv', targets_file=None):
+        self.name = name
+        self.sources = list(sources)
+        self.output_file = output_file
+        self.output_format = output_format
+        self.targets_file = targets_file
+        self.holdings = None
+        self.merger = None
+        self.report = aValidationReport()
+
+def read_export(filename):
+    """Read a whole export (runs in the I/O executor)"""
+    with open(filename, 'rb') as f:
+        return f.read()
+
+def parse_export(aData, file_type, filename):
+    """
+    Parse the bytes of an export (runs in the CPU executor).
+
+    Returns:
+        Tuple (file_type, list of aShare, row counts by status name, invalid rows); file_type
+        is None when the format could not be detected
+    """
+    aRowCounts = {}
+    aRowErrors = []
+    if file_type is None:
+        file_type = sniff_file_type(aData[:HEADER_SNIFF_BYTES])
+        if file_type is None:
+            logging.error(f"Unable to detect file type for {filename}")
+            return None, [], aRowCounts, aRowErrors
+    aShares = list(iter_mapped_shares(aData, file_type, filename, aRowCounts, aRowErrors))
+    return file_type, aShares, aRowCounts, aRowErrors
+
+def _load_reference(kind, loader, filename, cache_dir):
+    """Load a targets or fund info file, through the reference cache when enabled"""
+    if cache_dir:
+        return aReferenceCache(cache_dir).load(filename, kind, loader)
+    return loader(filename)
+
+async def _timed(metrics, name, rows, awaitable):
+    start = time.perf_counter()
+    aResult = await awaitable
+    metrics.add(name, time.perf_counter() - start, rows=rows(aResult) if callable(rows) else rows)
+    return aResult
+
+async def run_pipeline(jobs, targets_file='targets.json', fund_info_file='fund_info.json', cache_dir=None,
+                       cpu_workers=None, io_workers=DEFAULT_IO_WORKERS, queue_size=DEFAULT_QUEUE_SIZE,
+                       read_file=read_export, metrics=None, fx=None, price_policy=None):
+    """
+    Merge portfolios with file reads, reference loading, parsing and writing overlapped.
+
+    Files are read by io_workers concurrent readers into a queue bounded by queue_size and
+    parsed in a process pool of cpu_workers; a full queue makes the readers wait
+    (back-pressure). The fund info and each distinct targets file load once in the I/O
+    executor meanwhile, and are shared by all the jobs using them. Each job
+    is merged (in source order, so the result does not depend on completion order), valued and
+    written in the I/O executor as soon as its last file is parsed, while the files of the
+    next jobs are still being read and parsed.
+
+    Args:
+        jobs: List of aPipelineJob
+        targets_file, fund_info_file: Reference files shared by all jobs (a job can have its own targets_file)
+        cache_dir: Optional reference cache directory
+        cpu_workers: Parser processes (default: number of CPUs, 1 parses in a thread of this process)
+        io_workers: Concurrent file reads and writes
+        queue_size: Maximum number of read files waiting to be parsed
+        read_file: Function reading a whole file as bytes
+        metrics: Optional aMetrics recording the read, parse, merge and write stages
+        fx: Optional fxRates.aFxConverter converting the positions to the base currency
+        price_policy: Optional validation.aPricePolicy of the price conflicts (default: abort)
+
+    Returns:
+        List of aHoldings, one per job (None for a job with an unreadable file or a failed merge)
+    """
+    if metrics is None:
+        metrics = aMetrics()
+    loop = asyncio.get_running_loop()
+    io_executor = ThreadPoolExecutor(max_workers=io_workers)
+    if cpu_workers is None:
+        cpu_workers = os.cpu_count() or 1
+    if cpu_workers <= 1:
+        # A single worker process would only add the cost of sending the shares back
+        cpu_workers = 1
+        cpu_executor = ThreadPoolExecutor(max_workers=1)
+    else:
+        # Workers get the single stocks and custom adapters in use explicitly since they may not inherit the parent state
+        cpu_executor = ProcessPoolExecutor(max_workers=cpu_workers, initializer=init_worker,
+                                           initargs=(get_single_stocks(), BROKER_ADAPTERS.custom_specs))
+    start = time.perf_counter()
+    try:
+        fund_info_task = asyncio.ensure_future(_timed(
+            metrics, 'reference_load', len,
+            loop.run_in_executor(io_executor, _load_reference, 'fund_info', load_fund_info, fund_info_file, cache_dir)))
+        targets_tasks = {}
+        for job in jobs:
+            aTargetsFile = job.targets_file or targets_file
+            if aTargetsFile not in targets_tasks:
+                targets_tasks[aTargetsFile] = asyncio.ensure_future(_timed(
+                    metrics, 'reference_load', lambda aResult: len(aResult.get('targets', {})),
+                    loop.run_in_executor(io_executor, _load_reference, 'targets', compile_targets, aTargetsFile,
+                                         cache_dir)))
+
+        pending_reads = asyncio.Queue()
+        for j, job in enumerate(jobs):
+            for s, (account, filename) in enumerate(job.sources):
+                pending_reads.put_nowait((j, s, account, filename))
+        parse_queue = asyncio.Queue(maxsize=queue_size)
+        parsed = [[None] * len(job.sources) for job in jobs]
+        # Why a source could not be read or parsed, recorded in the report of its job
+        failures = [[None] * len(job.sources) for job in jobs]
+        remaining = [len(job.sources) for job in jobs]
+        results = [None] * len(jobs)
+        finish_tasks = []
+
+        async def reader():
+            while not pending_reads.empty():
+                j, s, account, filename = pending_reads.get_nowait()
+                try:
+                    aData = await _timed(metrics, 'read', 1, loop.run_in_executor(io_executor, read_file, filename))
+                except OSError as e:
+                    logging.error(f"[{jobs[j].name}] Unable to read {filename}: {e}")
+                    failures[j][s] = f"file could not be read: {e}"
+                    aData = None
+                await parse_queue.put((j, s, account, filename, aData))
+
+        async def finish(j):
+            job = jobs[j]
+            failed = [(filename, aFailure) for (_, filename), aParsed, aFailure in zip(job.sources, parsed[j], failures[j])
+                      if aParsed is None]
+            if failed:
+                # A partial portfolio would be silently wrong
+                for filename, aFailure in failed:
+                    job.report.add('invalid_file', source=filename, detail=aFailure or "file could not be read or parsed")
+                logging.error(f"[{job.name}] Merge failed: some files could not be read or parsed")
+                return
+            row_counts = {}
+            sources = []
+            for (account, filename), aParsed in zip(job.sources, parsed[j]):
+                file_type, aShares, aRowCounts, aRowErrors = aParsed
+                if file_type is None:
+                    job.report.add('invalid_file', source=filename, detail="unknown format, file skipped")
+                    continue
+                metrics.record_file(filename, aRowCounts)
+                for status, count in aRowCounts.items():
+                    row_counts[status] = row_counts.get(status, 0) + count
+                account = account or BROKER_ADAPTERS.get(file_type).account
+                job.report.add_row_errors(filename, account, aRowErrors)
+                sources.append((account, aShares))
+            try:
+                # Reference data that cannot be loaded fails the jobs using it, not the whole pipeline
+                reference = (await targets_tasks[job.targets_file or targets_file], await fund_info_task)
+                merger = PortfolioMerger(reference=reference, price_policy=price_policy)
+                merger.metrics = metrics
+                merger.fx = fx
+                job.merger = merger
+                sources = merger.convert_sources(sources, metrics)
+                with metrics.stage('merge') as aStage:
+                    aPortfolioShares = consolidate_positions(sources, merger.price_policy, job.report,
+                                                             merger.base_currency)
+                    aStage.rows += len(aPortfolioShares)
+                holdings = merger.build_holdings(aPortfolioShares, row_counts, metrics)
+                if job.output_file:
+                    await _timed(metrics, 'write', len(holdings.rows), loop.run_in_executor(
+                        io_executor, write_holdings, holdings, job.output_file, job.output_format))
+            except (ValueError, OSError) as e:
+                logging.error(f"[{job.name}] Merge failed: {e}")
+                return
+            except Exception as e:
+                # Other jobs of the pipeline go on
+                logging.exception(f"[{job.name}] Merge failed: {e}")
+                return
+            job.holdings = results[j] = holdings
+
+        async def parser():
+            while True:
+                j, s, account, filename, aData = await parse_queue.get()
+                try:
+                    if aData is not None:
+                        parsed[j][s] = await _timed(metrics, 'parse', lambda aResult: len(aResult[1]),
+                                                    loop.run_in_executor(cpu_executor, parse_export, aData,
+                                                                         ACCOUNT_BROKERS.get(account), filename))
+                except ValueError as e:
+                    logging.error(f"[{jobs[j].name}] Unable to parse {filename}: {e}")
+                    failures[j][s] = f"file could not be parsed: {e}"
+                except Exception as e:
+                    # The parser goes on with the files of the other jobs
+                    logging.exception(f"[{jobs[j].name}] Unable to parse {filename}: {e}")
+                    failures[j][s] = f"file could not be parsed: {e}"
+                finally:
+                    # The job is finished once all its files are parsed, whether they failed or not
+                    remaining[j] -= 1
+                    if remaining[j] == 0:
+                        finish_tasks.append(asyncio.ensure_future(finish(j)))
+                    parse_queue.task_done()
+
+        parsers = [asyncio.ensure_future(parser()) for _ in range(cpu_workers)]
+        await asyncio.gather(*(reader() for _ in range(min(io_workers, pending_reads.qsize()) or 1)))
+        await parse_queue.join()
+        for aParser in parsers:
+            aParser.cancel()
+        # Jobs without any source are finished once the reference data is there
+        for j, job in enumerate(jobs):
+            if not job.sources:
+                finish_tasks.append(asyncio.ensure_future(finish(j)))
+        # Reference data that failed to load is reported by the jobs using it
+        await asyncio.gather(fund_info_task, *targets_tasks.values(), return_exceptions=True)
+        await asyncio.gather(*finish_tasks)
+    finally:
+        io_executor.shutdown(wait=True)
+        cpu_executor.shutdown(wait=True)
+    metrics.add('pipeline', time.perf_counter() - start, rows=len(jobs))
+    return results
+
+def merge_async(jobs, **kwargs):
+    """Run run_pipeline in a new event loop (see run_pipeline for the arguments)"""
+    return asyncio.run(run_pipeline(jobs, **kwargs))
@@ -0,0 +1,404 @@
+import json
+import hashlib
+import logging
+from fxRates import is_currency_code
+from portfolioValuation import ACCOUNTS
+from symbolClassifier import classify_symbol, SYMBOL_PROPER, SYMBOL_OPTION, SYMBOL_SINGLE_STOCK, SYMBOL_INVALID
+
+# Row classification status codes, returned by the adapter classifiers instead of raising
+ROW_POSITION = SYMBOL_PROPER
+ROW_OPTION = SYMBOL_OPTION
+ROW_SINGLE_STOCK = SYMBOL_SINGLE_STOCK
+ROW_EMPTY = 3
+ROW_INVALID = SYMBOL_INVALID
+# Title, header and total rows of an export (see the layout_rows of the adapters), counted but not reported
+ROW_LAYOUT = 5
+ROW_STATUS_NAMES = ('position', 'option', 'single_stock', 'empty', 'invalid', 'layout')
+
+# Broker format of the position and trade exports of each named account
+ACCOUNT_BROKERS = {'ibkr': 'ibkr', 'cs': 'cs', 'ira': 'cs'}
+
+ADAPTER_FIELDS = ('symbol', 'quantity', 'price', 'currency')
+REQUIRED_FIELDS = ('symbol', 'quantity', 'price')
+
+# Built-in export formats; a column is given by its index or by its header name
+BUILTIN_ADAPTERS = [
+    {
+        'name': 'cs',
+        'description': 'Charles Schwab positions (2026 layout)',
+        'signatures': ['Positions for account', '"Positions for account'],
+        'columns': {'symbol': 0, 'quantity': 2, 'price': 3},
+        'layout_rows': ['Positions for account', 'Symbol', 'Cash & Cash Investments', 'Positions Total',
+                        'Account Total'],
+    },
+    {
+        'name': 'ibkr',
+        'description': 'Interactive Brokers positions, optional currency column',
+        'signatures': ['Symbol', '"Symbol"'],
+        'columns': {'symbol': 0, 'quantity': 1, 'price': 2, 'currency': 3},
+        'quotechar': '|',
+        'strip': '"',
+        'layout_rows': ['Symbol'],
+    },
+    {
+        # Same first line as the 2026 layout, so it is never detected and is only used explicitly
+        'name': 'cs_legacy',
+        'description': 'Charles Schwab positions (legacy layout, "$" prices)',
+        'signatures': [],
+        'columns': {'symbol': 0, 'quantity': 3, 'price': 4},
+        'price_prefix': '$',
+        'account': 'cs',
+        'layout_rows': ['Positions for account', 'Symbol', 'Cash & Cash Investments', 'Positions Total',
+                        'Account Total'],
+    },
+]
+
+def isItEmptyLine(aLine):
+    return not aLine or all(not cell.strip() for cell in aLine)
+
+def _clean_number(aText):
+    """Remove the currency sign and thousands separators of a formatted number ('$1,234.50')"""
+    return aText.replace('$', '').replace(',', '').strip()
+
+def number_error(aQuantity, aPrice):
+    """Reason why the quantity or the price of a row cannot be read, None if both can"""
+    try:
+        int(aQuantity)
+    except ValueError:
+        return f"invalid quantity {aQuantity!r}"
+    try:
+        float(aPrice)
+    except ValueError:
+        return f"invalid price {aPrice!r}"
+    return None
+
+class aBrokerAdapter:
+    """
+    Declaration of one export format: the header signatures identifying it, the columns of
+    the ticker, quantity, price and optional currency, how cells are cleaned, and the
+    beginnings of the ticker cell of its title, header and total rows (layout_rows).
+
+    The row classifier is compiled once with the column indexes bound, so parsing a row does
+    no lookup. Columns given by header name are resolved on the header row of each file.
+    """
+    def __init__(self, name, signatures, columns, account=None, description='', delimiter=',', quotechar='"',
+                 strip='', price_prefix='', clean_numbers=False, layout_rows=()):
+        self.name = name
+        self.label = name.upper()
+        self.description = description
+        self.signatures = list(signatures)
+        self.columns = dict(columns)
+        # Account the positions are merged under when the file is loaded by detection (--batch)
+        self.account = account or name
+        self.delimiter = delimiter
+        self.quotechar = quotechar
+        self.strip = strip
+        self.price_prefix = price_prefix
+        self.clean_numbers = clean_numbers
+        self.layout_rows = tuple(layout_rows)
+        self.share_factory = None
+        # Classifier of the rows, None until registered or when columns are given by header name
+        self.classify = None
+
+    @property
+    def by_header(self):
+        return any(isinstance(aColumn, str) for aColumn in self.columns.values())
+
+    def fingerprint(self):
+        """Short hash of the declaration, so cached parse results of a changed format are not reused"""
+        aSettings = {'signatures': self.signatures, 'columns': self.columns, 'delimiter': self.delimiter,
+                     'quotechar': self.quotechar, 'strip': self.strip, 'price_prefix': self.price_prefix,
+                     'clean_numbers': self.clean_numbers, 'layout_rows': list(self.layout_rows)}
+        return hashlib.sha1(json.dumps(aSettings, sort_keys=True).encode('utf-8')).hexdigest()[:12]
+
+    def compile(self, share_factory):
+        self.share_factory = share_factory
+        if not self.by_header:
+            self.classify = self.make_classifier(self.columns)
+
+    def bind_header(self, rows):
+        """
+        Consume rows up to the header row naming all the columns given by name.
+
+        Returns:
+            The row classifier of the file, None when no header row was found
+        """
+        names = {field: aColumn for field, aColumn in self.columns.items() if isinstance(aColumn, str)}
+        for row in rows:
+            cells = [cell.strip().strip(self.strip) if self.strip else cell.strip() for cell in row]
+            if all(name in cells for name in names.values()):
+                indexes = dict(self.columns)
+                indexes.update({field: cells.index(name) for field, name in names.items()})
+                return self.make_classifier(indexes)
+        return None
+
+    def clean_cell(self, aText, is_price=False):
+        """Clean a quantity or price cell like the row classifier does"""
+        if self.strip:
+            aText = aText.strip(self.strip)
+        if is_price and self.price_prefix:
+            aText = aText.removeprefix(self.price_prefix)
+        if self.clean_numbers:
+            aText = _clean_number(aText)
+        return aText
+
+    def is_layout_cell(self, aText):
+        """True if the ticker cell of a row starts like one of the layout rows of the format"""
+        return bool(self.layout_rows) and aText.strip().strip(self.strip).strip().startswith(self.layout_rows)
+
+    def is_layout_row(self, aLine, indexes=None):
+        """
+        True for a title, header or total row of the format (slow path, only run for invalid rows).
+
+        Rows too short to have a ticker column (e.g. a one-cell title) are matched on their first cell.
+        """
+        if not aLine:
+            return False
+        iSymbol = (indexes or self.columns)['symbol']
+        return self.is_layout_cell(aLine[iSymbol] if iSymbol < len(aLine) else aLine[0])
+
+    def explain(self, aLine, indexes=None):
+        """
+        Reason why a row was classified as invalid (slow path, only run for such rows).
+
+        Args:
+            aLine: Row cells
+            indexes: Column indexes of the classifier (classify.indexes), default the declared columns
+        """
+        indexes = indexes or self.columns
+        for field in REQUIRED_FIELDS:
+            if indexes[field] >= len(aLine):
+                return f"no {field} column (index {indexes[field]})"
+        aTicker = aLine[indexes['symbol']]
+        if self.strip:
+            aTicker = aTicker.strip(self.strip)
+        if classify_symbol(aTicker) == ROW_INVALID:
+            return f"invalid symbol {aTicker!r}"
+        return number_error(self.clean_cell(aLine[indexes['quantity']]),
+                            self.clean_cell(aLine[indexes['price']], is_price=True)) or "unreadable row"
+
+    def make_classifier(self, indexes):
+        """
+        Build the row classifier for column indexes.
+
+        The classifier returns (status, share or None), status being one of the ROW_* codes.
+        Formats whose cells are used as they are get a classifier without the cleaning steps.
+        The indexes are kept in the indexes attribute of the classifier.
+        """
+        iSymbol, iQuantity, iPrice = indexes['symbol'], indexes['quantity'], indexes['price']
+        iCurrency = indexes.get('currency')
+        aStrip = self.strip
+        aPricePrefix = self.price_prefix
+        clean_numbers = self.clean_numbers
+        share_factory = self.share_factory
+
+        def set_currency(aNewShare, aLine):
+            if len(aLine) > iCurrency:
+                aCurrency = aLine[iCurrency].strip('" ')
+                if is_currency_code(aCurrency):
+                    aNewShare.currency = aCurrency
+
+        if not (aStrip or aPricePrefix or clean_numbers or iCurrency is not None):
+            def classify_plain(aLine):
+                if isItEmptyLine(aLine):
+                    return ROW_EMPTY, None
+                try:
+                    aTicker = aLine[iSymbol]
+                except IndexError:
+                    return ROW_INVALID, None
+                aStatus = classify_symbol(aTicker)
+                if aStatus != ROW_POSITION:
+                    return aStatus, None
+                try:
+                    aNewShare = share_factory(aTicker)
+                    aNewShare.nbShares = int(aLine[iQuantity])
+                    aNewShare.sharePrice = float(aLine[iPrice])
+                except (IndexError, ValueError):
+                    return ROW_INVALID, None
+                return ROW_POSITION, aNewShare
+            classify_plain.indexes = indexes
+            return classify_plain
+
+        def classify(aLine):
+            if isItEmptyLine(aLine):
+                return ROW_EMPTY, None
+            try:
+                aTicker = aLine[iSymbol]
+            except IndexError:
+                return ROW_INVALID, None
+            if aStrip:
+                aTicker = aTicker.strip(aStrip)
+            aStatus = classify_symbol(aTicker)
+            if aStatus != ROW_POSITION:
+                return aStatus, None
+            try:
+                aQuantity = aLine[iQuantity]
+                aPrice = aLine[iPrice]
+                if aStrip:
+                    aQuantity = aQuantity.strip(aStrip)
+                    aPrice = aPrice.strip(aStrip)
+                if aPricePrefix:
+                    aPrice = aPrice.removeprefix(aPricePrefix)
+                if clean_numbers:
+                    aQuantity = _clean_number(aQuantity)
+                    aPrice = _clean_number(aPrice)
+                aNewShare = share_factory(aTicker)
+                aNewShare.nbShares = int(aQuantity)
+                aNewShare.sharePrice = float(aPrice)
+            except (IndexError, ValueError):
+                return ROW_INVALID, None
+            if iCurrency is not None:
+                set_currency(aNewShare, aLine)
+            return ROW_POSITION, aNewShare
+        classify.indexes = indexes
+        return classify
+
+def adapter_from_spec(aSpec):
+    """
+    Build an adapter from its JSON declaration (same keys as the aBrokerAdapter arguments).
+
+    Raises:
+        ValueError: If the declaration is incomplete or invalid
+    """
+    if not isinstance(aSpec, dict) or not aSpec.get('name'):
+        raise ValueError(f"Broker adapter without a name: {aSpec}")
+    name = aSpec['name']
+    columns = aSpec.get('columns') or {}
+    missing = [field for field in REQUIRED_FIELDS if field not in columns]
+    if missing:
+        raise ValueError(f"Broker adapter '{name}' has no column for {', '.join(missing)}")
+    for field, aColumn in columns.items():
+        if field not in ADAPTER_FIELDS or not isinstance(aColumn, (int, str)) or isinstance(aColumn, bool):
+            raise ValueError(f"Broker adapter '{name}' has an invalid column {field}: {aColumn!r}")
+    signatures = aSpec.get('signatures')
+    if not signatures or not all(isinstance(aSignature, str) and aSignature for aSignature in signatures):
+        raise ValueError(f"Broker adapter '{name}' needs a list of header signatures")
+    # Holdings have a column per account, positions of another account would only count in the total
+    if aSpec.get('account', name) not in ACCOUNTS:
+        raise ValueError(f"Broker adapter '{name}' needs an account among {', '.join(ACCOUNTS)}, "
+                         f"got {aSpec.get('account')!r}")
+    layout_rows = aSpec.get('layout_rows', [])
+    if not isinstance(layout_rows, list) or not all(isinstance(aRow, str) and aRow for aRow in layout_rows):
+        raise ValueError(f"Broker adapter '{name}' needs a list of texts as layout_rows")
+    unknown = set(aSpec) - {'name', 'signatures', 'columns', 'account', 'description', 'delimiter', 'quotechar',
+                            'strip', 'price_prefix', 'clean_numbers', 'layout_rows'}
+    if unknown:
+        raise ValueError(f"Broker adapter '{name}' has unknown settings: {', '.join(sorted(unknown))}")
+    return aBrokerAdapter(**aSpec)
+
+class aAdapterRegistry:
+    """
+    Registered export formats, detected from the first bytes of a file.
+
+    All header signatures are stored in a byte trie, so detection walks the first line once,
+    at most as far as the longest signature, whatever the number of formats. The longest
+    matching signature wins (e.g. a custodian header starting with 'Symbol,Description'
+    over the IBKR 'Symbol').
+    """
+    def __init__(self, share_factory, builtins=True):
+        self.share_factory = share_factory
+        self.adapters = {}
+        self.builtin_names = set()
+        # JSON declarations of the adapters loaded from files, to register them again in worker processes
+        self.custom_specs = []
+        self._trie = {}
+        self._depth = 0
+        if builtins:
+            for aSpec in BUILTIN_ADAPTERS:
+                self.register(aBrokerAdapter(**aSpec))
+                self.builtin_names.add(aSpec['name'])
+
+    def __contains__(self, name):
+        return name in self.adapters
+
+    def register(self, adapter, replace=False):
+        """
+        Add an adapter and index its signatures.
+
+        Raises:
+            ValueError: If the name is already registered (unless replace) or reserved by a
+                built-in format, or if a signature belongs to another adapter
+        """
+        if adapter.name in self.builtin_names:
+            raise ValueError(f"Broker adapter name '{adapter.name}' is reserved by a built-in format")
+        if adapter.name in self.adapters and not replace:
+            raise ValueError(f"Broker adapter '{adapter.name}' is already registered")
+        for other in self.adapters.values():
+            if other.name != adapter.name and set(other.signatures) & set(adapter.signatures):
+                raise ValueError(f"Broker adapters '{other.name}' and '{adapter.name}' have the same signature")
+        adapter.compile(self.share_factory)
+        self.adapters[adapter.name] = adapter
+        self._build_trie()
+        return adapter
+
+    def _build_trie(self):
+        self._trie = {}
+        self._depth = 0
+        for adapter in self.adapters.values():
+            for aSignature in adapter.signatures:
+                aBytes = aSignature.encode('utf-8')
+                node = self._trie
+                for aByte in aBytes:
+                    node = node.setdefault(aByte, {})
+                # Terminal entries are stored under the None key
+                node[None] = adapter
+                self._depth = max(self._depth, len(aBytes))
+
+    def register_spec(self, aSpec, replace=False):
+        adapter = self.register(adapter_from_spec(aSpec), replace)
+        self.custom_specs = [spec for spec in self.custom_specs if spec['name'] != adapter.name] + [aSpec]
+        return adapter
+
+    def load_file(self, adapters_file):
+        """
+        Register the adapters declared in a JSON file ({"adapters": [...]} or a list).
+
+        Returns:
+            List of the registered adapters
+        """
+        with open(adapters_file, 'r') as f:
+            aSpecs = json.load(f)
+        if isinstance(aSpecs, dict):
+            aSpecs = aSpecs.get('adapters', [])
+        adapters = [self.register_spec(aSpec) for aSpec in aSpecs]
+        logging.info(f"Loaded {len(adapters)} broker adapter(s) from {adapters_file}: "
+                     + ", ".join(adapter.name for adapter in adapters))
+        return adapters
+
+    def get(self, name):
+        adapter = self.adapters.get(name)
+        if adapter is None:
+            raise ValueError(f"Unknown broker format '{name}'")
+        return adapter
+
+    def detect(self, aHeader):
+        """
+        Find the adapter of an export from its first bytes.
+
+        Args:
+            aHeader: Beginning of the file (bytes), e.g. its first 256 bytes
+
+        Returns:
+            aBrokerAdapter or None
+        """
+        if aHeader.startswith(b'\xef\xbb\xbf'):
+            aHeader = aHeader[3:]
+        aHeader = aHeader.lstrip()
+        node = self._trie
+        found = None
+        for aByte in aHeader[:self._depth]:
+            node = node.get(aByte)
+            if node is None:
+                break
+            found = node.get(None, found)
+        return found
+
+# Registry shared by every importer, including mainBrokers.py run as a script (imported again as a module)
+_registry = None
+
+def shared_registry(share_factory):
+    """Return the process-wide registry, created with share_factory on the first call"""
+    global _registry
+    if _registry is None:
+        _registry = aAdapterRegistry(share_factory)
+    return _registry
@@ -0,0 +1,161 @@
+import os
+import pickle
+import hashlib
+import logging
+
+# Bump when the layout of cached entries changes so old entries are ignored
+CACHE_VERSION = 3
+
+def file_sha256(filename, chunk_size=1 << 20):
+    aHash = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for aChunk in iter(lambda: f.read(chunk_size), b''):
+            aHash.update(aChunk)
+    return aHash.hexdigest()
+
+class aParseCache:
+    """
+    On-disk cache of parsed position files.
+
+    Entries are keyed by absolute file path and a variant string (parser and
+    configuration used), and validated against the file size, mtime and content hash.
+    An unchanged file (same size and mtime) is served without being read; a touched file
+    with the same content is served after hashing it.
+    """
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _entry_path(self, filename, variant):
+        aKey = f"{os.path.abspath(filename)}\0{variant}".encode('utf-8')
+        return os.path.join(self.cache_dir, hashlib.sha256(aKey).hexdigest() + '.pickle')
+
+    def lookup(self, filename, variant):
+        """
+        Return the cached payload of a file, or None if it is missing or stale.
+
+        Args:
+            filename: Path to the source file
+            variant: Parser/configuration identifier the payload was stored with
+        """
+        aEntryPath = self._entry_path(filename, variant)
+        try:
+            with open(aEntryPath, 'rb') as f:
+                aEntry = pickle.load(f)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        except (pickle.UnpicklingError, EOFError, AttributeError, ValueError) as e:
+            logging.warning(f"Ignoring corrupted cache entry {aEntryPath}: {e}")
+            self.misses += 1
+            return None
+
+        aStat = os.stat(filename)
+        if aEntry.get('version') != CACHE_VERSION or aEntry.get('size') != aStat.st_size:
+            self.misses += 1
+            return None
+        if aEntry.get('mtime_ns') != aStat.st_mtime_ns:
+            # Touched but maybe not modified: compare the content hash
+            if aEntry.get('sha256') != file_sha256(filename):
+                self.misses += 1
+                return None
+            aEntry['mtime_ns'] = aStat.st_mtime_ns
+            self._write(aEntryPath, aEntry)
+        self.hits += 1
+        logging.debug(f"Parse cache hit for {filename}")
+        return aEntry['payload']
+
+    @staticmethod
+    def file_key(filename):
+        """
+        Size, mtime and content hash of a file, taken before parsing it and given to store.
+
+        Returns:
+            Tuple (size, mtime_ns, sha256)
+        """
+        aStat = os.stat(filename)
+        return aStat.st_size, aStat.st_mtime_ns, file_sha256(filename)
+
+    def store(self, filename, variant, payload, key):
+        """
+        Store the parsed payload of a file, unless the file changed since its key was taken.
+
+        Args:
+            filename: Path to the source file
+            variant: Parser/configuration identifier
+            payload: Picklable parsed content
+            key: file_key of the file taken before parsing it
+
+        Returns:
+            True if the payload was stored
+        """
+        aSize, aMtime, aHash = key
+        aStat = os.stat(filename)
+        if (aStat.st_size, aStat.st_mtime_ns) != (aSize, aMtime):
+            # The payload may come from a partly written file, it must not be served for the new content
+            logging.warning(f"{filename} changed while it was parsed, its parse result is not cached")
+            return False
+        aEntry = {
+            'version': CACHE_VERSION,
+            'size': aSize,
+            'mtime_ns': aMtime,
+            'sha256': aHash,
+            'payload': payload,
+        }
+        self._write(self._entry_path(filename, variant), aEntry)
+        return True
+
+    def _write(self, aEntryPath, aEntry):
+        # Write then rename so a concurrent reader never sees a partial entry
+        aTempPath = f"{aEntryPath}.{os.getpid()}.tmp"
+        with open(aTempPath, 'wb') as f:
+            pickle.dump(aEntry, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(aTempPath, aEntryPath)
+
+class aReferenceCache:
+    """
+    On-disk cache of compiled reference data (targets, fund info).
+
+    Entries are keyed by the content hash of the source file, so every run (and every
+    copy of the same file) reuses the compiled data until the source changes.
+    """
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def load(self, filename, kind, compile_func):
+        """
+        Return the compiled data of a reference file, compiling and storing it on a miss.
+
+        Args:
+            filename: Path to the source file
+            kind: Kind of compiled data (part of the key, e.g. 'targets')
+            compile_func: Function compiling the file, called with filename on a miss;
+                empty results (missing or invalid file) are not stored
+
+        Returns:
+            The compiled data
+        """
+        try:
+            aHash = file_sha256(filename)
+        except FileNotFoundError:
+            return compile_func(filename)
+        aEntryPath = os.path.join(self.cache_dir, f"{kind}-v{CACHE_VERSION}-{aHash}.pickle")
+        try:
+            with open(aEntryPath, 'rb') as f:
+                aCompiled = pickle.load(f)
+            logging.info(f"Loaded compiled {kind} for {filename} from cache")
+            return aCompiled
+        except FileNotFoundError:
+            pass
+        except (pickle.UnpicklingError, EOFError, AttributeError, ValueError) as e:
+            logging.warning(f"Ignoring corrupted cache entry {aEntryPath}: {e}")
+        aCompiled = compile_func(filename)
+        if aCompiled:
+            aTempPath = f"{aEntryPath}.{os.getpid()}.tmp"
+            with open(aTempPath, 'wb') as f:
+                pickle.dump(aCompiled, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(aTempPath, aEntryPath)
+        return aCompiled
@@ -0,0 +1,196 @@
+import csv
+import logging
+from bisect import bisect_right
+from datetime import date
+from portfolioValuation import np
+
+DEFAULT_BASE_CURRENCY = 'USD'
+
+# Rates published more than this many days before the valuation date are used with a warning
+STALE_RATE_DAYS = 7
+
+def is_currency_code(aValue):
+    """True for an ISO 4217 style code (three upper case letters)"""
+    return len(aValue) == 3 and aValue.isalpha() and aValue.isupper()
+
+def compile_rate_table(rates_file):
+    """
+    Load a rate table CSV file into date-sorted columns per currency.
+
+    The file has a date,currency,rate header; rate is the value of one unit of currency in
+    the base currency on that date (ISO date). Rows with a missing or non-numeric rate
+    are skipped (e.g. 'N/A' on bank holidays).
+
+    Returns:
+        Dictionary mapping each currency to a tuple (sorted list of ISO dates, list of rates)
+    """
+    aRatesByCurrency = {}
+    try:
+        with open(rates_file, 'r', newline='') as f:
+            for row in csv.DictReader(f):
+                try:
+                    aDate = date.fromisoformat(row['date'].strip()[:10]).isoformat()
+                    aCurrency = row['currency'].strip().upper()
+                    aRate = float(row['rate'])
+                except (KeyError, AttributeError, ValueError):
+                    continue
+                if aRate > 0 and is_currency_code(aCurrency):
+                    aRatesByCurrency.setdefault(aCurrency, {})[aDate] = aRate
+    except FileNotFoundError:
+        logging.warning(f"FX rates file '{rates_file}' not found. No rates loaded.")
+        return {}
+    aTable = {}
+    for aCurrency, aRates in aRatesByCurrency.items():
+        aDates = sorted(aRates)
+        aTable[aCurrency] = (aDates, [aRates[aDate] for aDate in aDates])
+    logging.info(f"Loaded FX rates of {len(aTable)} currencies from {rates_file}")
+    return aTable
+
+class aRateTable:
+    """
+    Date-indexed FX rates to a base currency.
+
+    Each currency keeps its dates sorted, so the rate in force on a date (the last one
+    published on or before it) is found by bisection. Lookups are memoized per
+    (currency, date) since a merge converts many positions at the same date.
+    """
+    def __init__(self, ratesByCurrency, base_currency=DEFAULT_BASE_CURRENCY):
+        self.ratesByCurrency = ratesByCurrency
+        self.base_currency = base_currency
+        self._lookups = {}
+
+    @classmethod
+    def from_file(cls, rates_file, base_currency=DEFAULT_BASE_CURRENCY, reference_cache=None):
+        """Load a rate table file, through an optional diskCache.aReferenceCache"""
+        if reference_cache:
+            return cls(reference_cache.load(rates_file, 'fx_rates', compile_rate_table), base_currency)
+        return cls(compile_rate_table(rates_file), base_currency)
+
+    def currencies(self):
+        return sorted(self.ratesByCurrency)
+
+    def last_date(self):
+        """Most recent date of the table, None when it is empty"""
+        return max((aDates[-1] for aDates, _ in self.ratesByCurrency.values()), default=None)
+
+    def lookup(self, currency, on_date=None):
+        """
+        Rate of a currency in force on a date.
+
+        Args:
+            currency: Currency code
+            on_date: ISO date (default: the last date of the table)
+
+        Returns:
+            Tuple (rate, date of the rate); the base currency is (1.0, on_date)
+
+        Raises:
+            ValueError: If the table has no rate for the currency on or before the date
+        """
+        if currency == self.base_currency:
+            return 1.0, on_date
+        on_date = str(on_date or self.last_date() or '')[:10]
+        aKey = (currency, on_date)
+        aResult = self._lookups.get(aKey)
+        if aResult is None:
+            aDates, aRates = self.ratesByCurrency.get(currency, ((), ()))
+            i = bisect_right(aDates, on_date)
+            if i == 0:
+                raise ValueError(f"No {currency}/{self.base_currency} rate on or before {on_date or 'any date'}")
+            aResult = (aRates[i - 1], aDates[i - 1])
+            if (date.fromisoformat(on_date) - date.fromisoformat(aResult[1])).days > STALE_RATE_DAYS:
+                logging.warning(f"Using a stale {currency}/{self.base_currency} rate of {aResult[1]} for {on_date}")
+            self._lookups[aKey] = aResult
+        return aResult
+
+    def rate(self, currency, on_date=None):
+        return self.lookup(currency, on_date)[0]
+
+    def convert(self, prices, currencies, on_date=None):
+        """
+        Convert prices to the base currency in one pass.
+
+        Each distinct currency is looked up once, then the prices are multiplied by their
+        rate column (a single vectorized multiplication when NumPy is installed).
+
+        Args:
+            prices: Sequence of prices
+            currencies: Currency code of each price (None for the base currency)
+            on_date: ISO date of the rates (default: the last date of the table)
+
+        Returns:
+            List of prices in the base currency
+        """
+        aRateByCurrency = {None: 1.0}
+        for aCurrency in set(currencies):
+            if aCurrency not in aRateByCurrency:
+                aRateByCurrency[aCurrency] = self.rate(aCurrency, on_date)
+        aRates = [aRateByCurrency[aCurrency] for aCurrency in currencies]
+        if np is not None:
+            return (np.asarray(prices, dtype=np.float64) * np.asarray(aRates, dtype=np.float64)).tolist()
+        return [price * aRate for price, aRate in zip(prices, aRates)]
+
+class aFxConverter:
+    """
+    Converts the positions of each account source to the base currency before consolidation.
+
+    A position keeps the currency read from its export when there is one (aShare.currency),
+    otherwise it is in the currency of its account (account_currencies, base currency by
+    default).
+    """
+    def __init__(self, rate_table, account_currencies=None, on_date=None):
+        self.rate_table = rate_table
+        self.base_currency = rate_table.base_currency
+        self.account_currencies = {account: currency.upper() for account, currency in (account_currencies or {}).items()}
+        self.on_date = on_date
+
+    def convert_shares(self, account, iShares):
+        """
+        Convert the prices of the shares of one account in place.
+
+        Args:
+            account: Account label
+            iShares: Iterable of aShare objects
+
+        Returns:
+            List of the aShare objects, priced in the base currency (their currency is set
+            to the base currency)
+        """
+        aShares = list(iShares)
+        default_currency = self.account_currencies.get(account, self.base_currency)
+        currencies = [iShare.currency or default_currency for iShare in aShares]
+        if all(aCurrency == self.base_currency for aCurrency in currencies):
+            for iShare in aShares:
+                iShare.currency = self.base_currency
+            return aShares
+        prices = self.rate_table.convert([iShare.sharePrice for iShare in aShares],
+                                         [None if aCurrency == self.base_currency else aCurrency
+                                          for aCurrency in currencies], self.on_date)
+        for iShare, price, aCurrency in zip(aShares, prices, currencies):
+            if aCurrency != self.base_currency:
+                logging.debug(f"[{account.upper()}] {iShare.symbol}: {iShare.sharePrice} {aCurrency} -> "
+                              f"{price:.4f} {self.base_currency}")
+            iShare.sharePrice = price
+            iShare.currency = self.base_currency
+        return aShares
+
+def parse_account_currencies(aSpec):
+    """
+    Parse an account currency list such as 'ibkr=EUR,cs=USD'.
+
+    Returns:
+        Dictionary mapping account to currency code
+
+    Raises:
+        ValueError: On a malformed entry or an invalid currency code
+    """
+    aCurrencies = {}
+    for aEntry in (aSpec or '').split(','):
+        if not aEntry.strip():
+            continue
+        account, sep, currency = aEntry.partition('=')
+        currency = currency.strip().upper()
+        if not sep or not account.strip() or not is_currency_code(currency):
+            raise ValueError(f"Invalid account currency '{aEntry}', expected account=CUR (e.g. ibkr=EUR)")
+        aCurrencies[account.strip().lower()] = currency
+    return aCurrencies
@@ -0,0 +1,164 @@
+import io
+import sys
+import csv
+import json
+import math
+import struct
+import logging
+from array import array
+
+# Columnar file layout: magic, uint32 header length, JSON header (padded to 8 bytes), then
+# one data block per column at the offsets listed in the header:
+#   float64 / int64 columns: little-endian values
+#   string columns: int64 end offsets (one per row) followed by the UTF-8 bytes of all values
+COLUMNAR_MAGIC = b'PMCOLS1\n'
+COLUMNAR_ALIGN = 8
+
+# Storage type of each holdings column in the columnar format (string when not listed);
+# missing values (no target, no yield) are stored as NaN
+HOLDINGS_COLUMN_TYPES = {
+    "sec_yield_30d": 'float64', "ttm_yield": 'float64',
+    "nbShares": 'int64', "nbShares_ibkr": 'int64', "nbShares_cs": 'int64', "nbShares_ira": 'int64',
+    "price": 'float64',
+    "currentAllocation": 'float64', "currentAllocation_ibkr": 'float64',
+    "currentAllocation_cs": 'float64', "currentAllocation_ira": 'float64',
+    "target_global": 'float64', "target_ibkr": 'float64', "target_cs": 'float64', "target_ira": 'float64',
+    "sharesToTarget_ibkr": 'float64', "sharesToTarget_cs": 'float64', "sharesToTarget_ira": 'float64',
+}
+
+def _to_float(value):
+    if value is None or value == '':
+        return math.nan
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        logging.debug("Storing non numeric value %r as NaN", value)
+        return math.nan
+
+def _little_endian(aArray):
+    if sys.byteorder != 'little':
+        aArray.byteswap()
+    return aArray
+
+def _pad(length):
+    return -length % COLUMNAR_ALIGN
+
+def write_holdings_csv(holdings, output_file):
+    """Write a holdings table to a CSV file, rendered in memory and written in one call"""
+    aBuffer = io.StringIO(newline='')
+    writer = csv.writer(aBuffer)
+    writer.writerow(holdings.fields)
+    writer.writerows(holdings.rows)
+    with open(output_file, 'w', newline='') as f:
+        f.write(aBuffer.getvalue())
+
+def write_holdings_jsonl(holdings, output_file):
+    """Write a holdings table as JSON lines, one object per symbol keyed by column name"""
+    fields = holdings.fields
+    lines = [json.dumps(dict(zip(fields, row))) for row in holdings.rows]
+    with open(output_file, 'w') as f:
+        f.write('\n'.join(lines))
+        if lines:
+            f.write('\n')
+
+def _encode_column(values, column_type):
+    if column_type == 'int64':
+        return _little_endian(array('q', (int(value) for value in values))).tobytes()
+    if column_type == 'float64':
+        return _little_endian(array('d', (_to_float(value) for value in values))).tobytes()
+    encoded = [str(value).encode('utf-8') for value in values]
+    ends = array('q')
+    end = 0
+    for aValue in encoded:
+        end += len(aValue)
+        ends.append(end)
+    return _little_endian(ends).tobytes() + b''.join(encoded)
+
+def write_holdings_columnar(holdings, output_file, column_types=HOLDINGS_COLUMN_TYPES):
+    """
+    Write a holdings table in the compact binary columnar format (see COLUMNAR_MAGIC).
+
+    Numeric columns are stored as typed 8-byte aligned blocks, so readers can load them
+    without parsing text (e.g. numpy.frombuffer on the block).
+
+    Args:
+        holdings: aHoldings (or any object with fields and rows)
+        output_file: Path to the output file
+        column_types: Storage type by column name, string when not listed
+    """
+    blocks = []
+    columns = []
+    offset = 0
+    for i, name in enumerate(holdings.fields):
+        column_type = column_types.get(name, 'string')
+        aBlock = _encode_column([row[i] for row in holdings.rows], column_type)
+        columns.append({'name': name, 'type': column_type, 'offset': offset, 'length': len(aBlock)})
+        aBlock += b'\0' * _pad(len(aBlock))
+        blocks.append(aBlock)
+        offset += len(aBlock)
+
+    header = json.dumps({'rows': len(holdings.rows), 'columns': columns}).encode('utf-8')
+    header += b' ' * _pad(len(COLUMNAR_MAGIC) + 4 + len(header))
+    with open(output_file, 'wb') as f:
+        f.write(COLUMNAR_MAGIC)
+        f.write(struct.pack('<I', len(header)))
+        f.write(header)
+        f.write(b''.join(blocks))
+
+def read_holdings_columnar(input_file, columns=None):
+    """
+    Read a file written by write_holdings_columnar.
+
+    Args:
+        input_file: Path to the columnar file
+        columns: Optional column names to load (all columns when not given)
+
+    Returns:
+        Dictionary mapping column name to array('d'), array('q') or list of str
+    """
+    with open(input_file, 'rb') as f:
+        aData = f.read()
+    if not aData.startswith(COLUMNAR_MAGIC):
+        raise ValueError(f"{input_file} is not a holdings columnar file")
+    header_start = len(COLUMNAR_MAGIC) + 4
+    (header_length,) = struct.unpack_from('<I', aData, len(COLUMNAR_MAGIC))
+    header = json.loads(aData[header_start:header_start + header_length])
+    data_start = header_start + header_length
+    nb_rows = header['rows']
+
+    result = {}
+    for aColumn in header['columns']:
+        if columns is not None and aColumn['name'] not in columns:
+            continue
+        aBlock = memoryview(aData)[data_start + aColumn['offset']:data_start + aColumn['offset'] + aColumn['length']]
+        if aColumn['type'] in ('int64', 'float64'):
+            values = array('q' if aColumn['type'] == 'int64' else 'd')
+            values.frombytes(aBlock)
+            result[aColumn['name']] = _little_endian(values)
+        else:
+            ends = array('q')
+            ends.frombytes(aBlock[:8 * nb_rows])
+            _little_endian(ends)
+            aText = aBlock[8 * nb_rows:]
+            start = 0
+            values = []
+            for end in ends:
+                values.append(bytes(aText[start:end]).decode('utf-8'))
+                start = end
+            result[aColumn['name']] = values
+    return result
+
+# Holdings writers by --output-format name
+OUTPUT_FORMATS = {
+    'csv': write_holdings_csv,
+    'columnar': write_holdings_columnar,
+    'jsonl': write_holdings_jsonl,
+}
+
+def write_holdings(holdings, output_file, output_format='csv'):
+    """Write a holdings table with the writer registered for output_format in OUTPUT_FORMATS"""
+    try:
+        writer = OUTPUT_FORMATS[output_format]
+    except KeyError:
+        raise ValueError(f"Unknown output format: {output_format}") from None
+    writer(holdings, output_file)
@@ -0,0 +1,171 @@
+import os
+import csv
+import json
+import logging
+from asyncPipeline import aPipelineJob, merge_async
+from mainBrokers import expand_batch_inputs
+from portfolioValuation import ACCOUNTS
+
+try:
+    import yaml
+except ImportError:  # PyYAML is optional, JSON manifests are always supported
+    yaml = None
+
+DEFAULT_SUMMARY_FILE = 'households_summary.csv'
+
+# Extension of the holdings files written in the manifest output directory
+OUTPUT_EXTENSIONS = {'csv': 'csv', 'jsonl': 'jsonl', 'columnar': 'bin'}
+
+MANIFEST_FIELDS = {'fund_info', 'targets', 'output_dir', 'output_format', 'summary', 'households'}
+HOUSEHOLD_FIELDS = set(ACCOUNTS) | {'name', 'batch', 'targets', 'output'}
+
+SUMMARY_FIELDS = ["household", "status", "totalValue"] + [f"value_{account}" for account in ACCOUNTS] + [
+    "nbPositions", "nbFiles", "issues", "output"]
+
+class aHousehold:
+    """One household of a manifest: its account files, its targets and its holdings output"""
+    def __init__(self, name, accounts, batch_files=(), targets_file=None, output_file=None):
+        self.name = name
+        # Account label to positions file
+        self.accounts = dict(accounts)
+        self.batch_files = list(batch_files)
+        # None uses the common targets of the manifest
+        self.targets_file = targets_file
+        self.output_file = output_file
+
+    def sources(self):
+        """Sources of the household as (account, filename) pairs (account None for batch files)"""
+        return [(account, filename) for account, filename in self.accounts.items()] + [
+            (None, filename) for filename in self.batch_files]
+
+class aManifest:
+    """Households merged in one run, with the reference data they share"""
+    def __init__(self, households, fund_info_file='fund_info.json', targets_file='targets.json',
+                 output_format='csv', summary_file=DEFAULT_SUMMARY_FILE):
+        self.households = households
+        self.fund_info_file = fund_info_file
+        self.targets_file = targets_file
+        self.output_format = output_format
+        self.summary_file = summary_file
+
+def _read_manifest(manifest_file):
+    with open(manifest_file, 'r') as f:
+        if manifest_file.endswith(('.yaml', '.yml')):
+            if yaml is None:
+                raise ValueError(f"Reading {manifest_file} requires PyYAML (pip install pyyaml), or use a JSON manifest")
+            return yaml.safe_load(f)
+        return json.load(f)
+
+def load_manifest(manifest_file, output_format='csv'):
+    """
+    Load a household manifest (JSON, or YAML when PyYAML is installed).
+
+    Relative paths are relative to the directory of the manifest. A household without an
+    output file writes <output_dir>/<name>_holdings.<ext>.
+
+    Args:
+        manifest_file: Path to the manifest
+        output_format: Holdings output format when the manifest does not give one
+
+    Returns:
+        aManifest
+
+    Raises:
+        ValueError: If the manifest is invalid
+    """
+    aData = _read_manifest(manifest_file)
+    if not isinstance(aData, dict) or not isinstance(aData.get('households'), list) or not aData['households']:
+        raise ValueError(f"Manifest {manifest_file} has no households list")
+    unknown = set(aData) - MANIFEST_FIELDS
+    if unknown:
+        raise ValueError(f"Manifest {manifest_file} has unknown settings: {', '.join(sorted(unknown))}")
+    base_dir = os.path.dirname(os.path.abspath(manifest_file))
+
+    def resolve(aPath):
+        return aPath if aPath is None else os.path.join(base_dir, aPath)
+
+    output_format = aData.get('output_format', output_format)
+    if output_format not in OUTPUT_EXTENSIONS:
+        raise ValueError(f"Unknown output format in {manifest_file}: {output_format}")
+    output_dir = resolve(aData.get('output_dir', '.'))
+    households = []
+    names = set()
+    for aEntry in aData['households']:
+        name = aEntry.get('name') if isinstance(aEntry, dict) else None
+        # Names are used in the output file names
+        if not name or not isinstance(name, str) or os.sep in name or name in ('.', '..'):
+            raise ValueError(f"Household without a valid name in {manifest_file}: {aEntry}")
+        if name in names:
+            raise ValueError(f"Household '{name}' appears twice in {manifest_file}")
+        names.add(name)
+        unknown = set(aEntry) - HOUSEHOLD_FIELDS
+        if unknown:
+            raise ValueError(f"Household '{name}' has unknown settings: {', '.join(sorted(unknown))}")
+        accounts = {account: resolve(aEntry[account]) for account in ACCOUNTS if aEntry.get(account)}
+        batch_inputs = aEntry.get('batch') or []
+        if isinstance(batch_inputs, str):
+            batch_inputs = [batch_inputs]
+        batch_files = [filename for aInput in batch_inputs for filename in expand_batch_inputs(resolve(aInput))]
+        if not accounts and not batch_files:
+            raise ValueError(f"Household '{name}' has no position files")
+        output_file = resolve(aEntry.get('output')) or os.path.join(
+            output_dir, f"{name}_holdings.{OUTPUT_EXTENSIONS[output_format]}")
+        households.append(aHousehold(name, accounts, batch_files, resolve(aEntry.get('targets')), output_file))
+    logging.info(f"Loaded {len(households)} household(s) from {manifest_file}")
+    return aManifest(households, resolve(aData.get('fund_info', 'fund_info.json')),
+                     resolve(aData.get('targets', 'targets.json')), output_format,
+                     resolve(aData.get('summary', DEFAULT_SUMMARY_FILE)))
+
+def run_households(manifest, **kwargs):
+    """
+    Merge all the households of a manifest in one asyncPipeline run.
+
+    The fund info and every distinct targets file are loaded once for all households, and
+    the files of all households are parsed by the same worker pool.
+
+    Args:
+        manifest: aManifest
+        kwargs: Options of asyncPipeline.run_pipeline (cache_dir, cpu_workers, io_workers, metrics, fx, price_policy)
+
+    Returns:
+        List of the aPipelineJob of each household, in manifest order
+    """
+    jobs = [aPipelineJob(household.name, household.sources(), household.output_file, manifest.output_format,
+                         household.targets_file) for household in manifest.households]
+    for aOutputDir in {os.path.dirname(job.output_file) for job in jobs}:
+        if aOutputDir:
+            os.makedirs(aOutputDir, exist_ok=True)
+    merge_async(jobs, targets_file=manifest.targets_file, fund_info_file=manifest.fund_info_file, **kwargs)
+    nbFailed = sum(1 for job in jobs if job.holdings is None)
+    logging.info(f"Merged {len(jobs) - nbFailed} of {len(jobs)} household(s)")
+    for job in jobs:
+        if job.holdings is None:
+            logging.error(f"[{job.name}] Household merge failed, no holdings written")
+    return jobs
+
+def summary_rows(jobs):
+    """
+    One summary row per household (SUMMARY_FIELDS), plus a TOTAL row over the merged households.
+    """
+    rows = []
+    totals = [0.0] * (1 + len(ACCOUNTS))
+    for job in jobs:
+        holdings = job.holdings
+        if holdings is None:
+            rows.append([job.name, 'failed', '', *([''] * len(ACCOUNTS)), '', len(job.sources), job.report.summary(), ''])
+            continue
+        values = [holdings.totalValue] + [holdings.valueByAccount.get(account, 0.0) for account in ACCOUNTS]
+        totals = [aTotal + aValue for aTotal, aValue in zip(totals, values)]
+        rows.append([job.name, 'ok', *(f"{aValue:.2f}" for aValue in values), len(holdings.rows), len(job.sources),
+                     job.report.summary(), job.output_file or ''])
+    nbMerged = sum(1 for job in jobs if job.holdings is not None)
+    rows.append(['TOTAL', f"{nbMerged}/{len(jobs)} ok", *(f"{aValue:.2f}" for aValue in totals), '',
+                 sum(len(job.sources) for job in jobs), '', ''])
+    return rows
+
+def write_summary_csv(jobs, summary_file):
+    """Write the combined summary of a household run to a CSV file"""
+    with open(summary_file, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(SUMMARY_FIELDS)
+        writer.writerows(summary_rows(jobs))
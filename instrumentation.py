@@ -0,0 +1,134 @@
+import json
+import time
+import logging
+from contextlib import contextmanager
+
+class aStageMetrics:
+    """Accumulated wall time, row count and number of runs of one pipeline stage"""
+    __slots__ = ('seconds', 'rows', 'calls')
+
+    def __init__(self):
+        self.seconds = 0.0
+        self.rows = 0
+        self.calls = 0
+
+    def as_dict(self):
+        return {'seconds': self.seconds, 'rows': self.rows, 'calls': self.calls}
+
+class aMetrics:
+    """
+    Per-stage timings and counters of a merge run.
+
+    Stages (detect, parse, merge, target_load, valuation, write, ...) accumulate wall time
+    and row counts; files record their row counts by status (position or skip reason).
+    """
+    def __init__(self):
+        self.stages = {}
+        self.files = {}
+
+    def _stage(self, name):
+        aStage = self.stages.get(name)
+        if aStage is None:
+            aStage = aStageMetrics()
+            self.stages[name] = aStage
+        return aStage
+
+    def add(self, name, seconds, rows=0, calls=1):
+        aStage = self._stage(name)
+        aStage.seconds += seconds
+        aStage.rows += rows
+        aStage.calls += calls
+
+    @contextmanager
+    def stage(self, name, exclude=()):
+        """
+        Time a block as one run of a stage.
+
+        Args:
+            name: Stage name
+            exclude: Stages whose time spent inside the block is not counted (e.g. the
+                parse time of readers streamed into the merge)
+
+        Yields:
+            The aStageMetrics of the stage, whose rows can be incremented by the block
+        """
+        aStage = self._stage(name)
+        excluded_before = sum(self._stage(other).seconds for other in exclude)
+        start = time.perf_counter()
+        try:
+            yield aStage
+        finally:
+            elapsed = time.perf_counter() - start
+            excluded = sum(self._stage(other).seconds for other in exclude) - excluded_before
+            aStage.seconds += elapsed - excluded
+            aStage.calls += 1
+
+    def timed_iter(self, iterable, name):
+        """
+        Yield the items of an iterable, counting the time spent producing them as stage name.
+
+        Only the time spent inside the iterable is counted, not the time of the consumer.
+        """
+        iterator = iter(iterable)
+        seconds = 0.0
+        rows = 0
+        try:
+            while True:
+                start = time.perf_counter()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    break
+                finally:
+                    seconds += time.perf_counter() - start
+                rows += 1
+                yield item
+        finally:
+            self.add(name, seconds, rows)
+
+    def record_file(self, filename, row_counts):
+        """Record the row counts by status of a parsed file"""
+        aCounts = self.files.setdefault(str(filename), {})
+        for status, count in row_counts.items():
+            aCounts[status] = aCounts.get(status, 0) + count
+
+    def as_dict(self):
+        return {
+            'stages': {name: aStage.as_dict() for name, aStage in self.stages.items()},
+            'files': self.files,
+        }
+
+    def log_summary(self):
+        for name, aStage in self.stages.items():
+            logging.info("Stage %s: %.3f s, %d rows, %d run(s)", name, aStage.seconds, aStage.rows, aStage.calls)
+
+    def write_json(self, output_file):
+        with open(output_file, 'w') as f:
+            json.dump(self.as_dict(), f, indent=4)
+
+    def write_prometheus(self, output_file, prefix='portfolio_merger'):
+        """Write the metrics in the Prometheus text exposition format (e.g. for the node exporter textfile collector)"""
+        lines = [
+            f"# HELP {prefix}_stage_seconds Wall time spent in each stage",
+            f"# TYPE {prefix}_stage_seconds gauge",
+        ]
+        lines += [f'{prefix}_stage_seconds{{stage="{_escape(name)}"}} {aStage.seconds:.6f}'
+                  for name, aStage in self.stages.items()]
+        lines += [
+            f"# HELP {prefix}_stage_rows Rows processed by each stage",
+            f"# TYPE {prefix}_stage_rows gauge",
+        ]
+        lines += [f'{prefix}_stage_rows{{stage="{_escape(name)}"}} {aStage.rows}'
+                  for name, aStage in self.stages.items()]
+        lines += [
+            f"# HELP {prefix}_file_rows Rows of each input file by status",
+            f"# TYPE {prefix}_file_rows gauge",
+        ]
+        for filename, counts in self.files.items():
+            lines += [f'{prefix}_file_rows{{file="{_escape(filename)}",status="{_escape(status)}"}} {count}'
+                      for status, count in counts.items()]
+        with open(output_file, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+
+def _escape(label_value):
+    return str(label_value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
@@ -1,9 +1,34 @@
-import re
 import csv
+import io
+import re
+import mmap
 import os
 import argparse
 import logging
 import json
+import glob
+import time
+from contextlib import contextmanager
+from datetime import date
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from diskCache import aParseCache, aReferenceCache
+from instrumentation import aMetrics
+from holdingsWriters import OUTPUT_FORMATS, write_holdings
+from rebalancer import REBALANCE_MODES, rebalance, parse_cash, write_rebalance_csv
+from scenarios import load_scenarios, value_scenarios, write_scenarios_csv
+from portfolioValuation import value_portfolio
+from fxRates import DEFAULT_BASE_CURRENCY, aRateTable, aFxConverter, is_currency_code, parse_account_currencies
+from brokerAdapters import (
+    shared_registry, number_error, isItEmptyLine, ROW_POSITION, ROW_OPTION, ROW_SINGLE_STOCK, ROW_EMPTY, ROW_INVALID,
+    ROW_LAYOUT, ROW_STATUS_NAMES
+)
+from validation import aValidationReport, aPricePolicy, PriceConflictException, parse_price_policy, report_validation
+from symbolClassifier import (
+    isItProperSymbol, isItOption, isItASingleStock, classify_symbol, load_single_stocks, classify_cache_stats,
+    get_single_stocks, set_single_stocks, single_stocks_fingerprint,
+    SYMBOL_PROPER, SYMBOL_OPTION, SYMBOL_SINGLE_STOCK, SYMBOL_INVALID
+)
 
 # Custom exception for options
 class OptionDetectedException(Exception):
@@ -39,25 +64,41 @@ def setup_logging(log_file='trades.log', debug=False):
     )
 
 class aShare:
+    __slots__ = ('symbol', 'nbShares', 'sharePrice', 'value', 'nbSharesByAccount', 'currency')
+
     def __init__(self, aSymbol):
         self.symbol = aSymbol
         self.nbShares = 0
         self.sharePrice = 0
         self.value = 0
+        # Currency of sharePrice when the export gives one, None means the currency of the account
+        self.currency = None
+        # Only consolidated shares (see aPortfolio) carry their per-account share counts
+        self.nbSharesByAccount = None
 
     def __str__(self):
         return f"{self.symbol}({self.nbShares};{self.sharePrice})"
 
-def isItProperSymbol(aSymbol):
-    return bool(re.fullmatch(r"[A-Za-z]{2,5}|\w+\/\w+", aSymbol))
+# Export formats known to the parsers (built-in ones plus those loaded with --adapters)
+BROKER_ADAPTERS = shared_registry(aShare)
 
-def isItOption(aSymbol):
-    # Matches option format: "SPY 12/19/2025 550.00 P"
-    return bool(re.fullmatch(r"[A-Z]+\s+\d{1,2}/\d{1,2}/\d{4}\s+\d+\.\d{2}\s+[PC]", aSymbol))
+def raise_for_row_status(aStatus, aTicker):
+    """Raise the exception matching a non-position row status (compatibility with the parseLine* API)"""
+    if aStatus == ROW_EMPTY:
+        raise EmptyLineException("Empty line")
+    if aStatus == ROW_OPTION:
+        raise OptionDetectedException(f"Option detected: {aTicker}")
+    if aStatus == ROW_SINGLE_STOCK:
+        raise SingleStockDetectedException(f"Single stock detected: {aTicker}")
+    raise ValueError(f"Invalid row for symbol: {aTicker}")
 
-def isItASingleStock(aSymbol):
-    single_stocks = ['MSFT', 'SBIT', 'IBM', 'BILI', 'VEOEY', 'VEEV', 'NOW', 'AMZN', 'AMC', 'SPIP', 'BRK/B', 'GOOGL', 'CLSK','GOOG','DOCS','ADSK','WDAY','CRM']
-    return aSymbol.upper() in single_stocks
+def iso_date(aText):
+    """Argument type of the date options: checks an ISO date and keeps it as YYYY-MM-DD text"""
+    try:
+        # Dates are compared as text, so the compact form (YYYYMMDD) is written out
+        return date.fromisoformat(aText).isoformat()
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid ISO date {aText!r}, expected YYYY-MM-DD")
 
 def parse_arguments():
     parser = argparse.ArgumentParser(description='Process shares data from CS and IBKR.')
@@ -67,216 +108,731 @@ def parse_arguments():
                       help='Charles Schwab brokerage account positions CSV file')
     parser.add_argument('--ira', type=str, default=None,
                       help='IRA (Charles Schwab) account positions CSV file')
+    parser.add_argument('--batch', type=str, default=None,
+                      help='Directory or glob pattern of position CSV files to load in parallel (format auto-detected)')
+    parser.add_argument('--workers', type=int, default=None,
+                      help='Number of worker processes used by --batch (default: number of CPUs)')
+    parser.add_argument('--adapters', type=str, default=None,
+                      help='JSON file of additional broker formats (header signatures and column mappings), see brokerAdapters.py')
+    parser.add_argument('--mmap', action='store_true',
+                      help='Read position files through memory mappings, tokenizing only the used columns')
+    parser.add_argument('--cache-dir', type=str, default=None,
+                      help='Directory of the parsed positions cache; unchanged files are not parsed again')
+    parser.add_argument('--async-pipeline', action='store_true',
+                      help='Overlap file reads, reference loading, parsing and output writing (see asyncPipeline.py)')
+    parser.add_argument('--io-workers', type=int, default=8,
+                      help='Concurrent file reads and writes of --async-pipeline and --manifest (default: 8)')
+    parser.add_argument('--manifest', type=str, default=None,
+                      help='JSON (or YAML) manifest of client households to merge in one run (see households.py)')
+    parser.add_argument('--summary', type=str, default=None,
+                      help='Combined summary CSV of a --manifest run (default: the summary file of the manifest)')
+    parser.add_argument('--fx-rates', type=str, default=None,
+                      help='FX rate table CSV (date,currency,rate) converting positions to the base currency')
+    parser.add_argument('--base-currency', type=str, default=DEFAULT_BASE_CURRENCY,
+                      help=f'Currency of the merged holdings with --fx-rates (default: {DEFAULT_BASE_CURRENCY})')
+    parser.add_argument('--account-currency', type=str, default=None,
+                      help='Currency of accounts whose export does not give one, e.g. ibkr=EUR (default: base currency)')
+    parser.add_argument('--fx-date', type=iso_date, default=None,
+                      help='Date of the FX rates, ISO format (default: the last date of the table)')
+    parser.add_argument('--price-policy', type=str, default='abort',
+                      help='Handling of prices that differ between accounts: abort (after reporting all of them), '
+                           'median, or prefer:ACCOUNT[,ACCOUNT...] (default: abort)')
+    parser.add_argument('--validation-report', type=str, default=None,
+                      help='CSV report of the price conflicts, invalid files and rows, and missing targets (optional)')
     parser.add_argument('--output', default='holdings.csv',
                       help='Output file path (default: holdings.csv)')
+    parser.add_argument('--output-format', choices=sorted(OUTPUT_FORMATS), default='csv',
+                      help='Holdings output format: csv, columnar (binary, typed columns) or jsonl (default: csv)')
+    parser.add_argument('--snapshot-db', type=str, default=None,
+                      help='Append the merged portfolio to this snapshot history database (see snapshotStore.py)')
+    parser.add_argument('--snapshot-date', type=iso_date, default=None,
+                      help='Date of the recorded snapshot, ISO format (default: today)')
+    parser.add_argument('--snapshot-label', type=str, default='',
+                      help='Label of the recorded snapshot, e.g. a household name (default: none)')
+    parser.add_argument('--scenarios', type=str, default=None,
+                      help='JSON scenarios or CSV price shock matrix evaluated in one batch against the merged positions')
+    parser.add_argument('--scenarios-output', default='scenarios.csv',
+                      help='Output file of --scenarios (default: scenarios.csv)')
+    parser.add_argument('--tax-lots', type=str, default=None,
+                      help='Lots CSV file (see taxLots.py); computes the realized gains of the sharesToTarget sales')
+    parser.add_argument('--lot-method', choices=('fifo', 'hifo', 'specific'), default='fifo',
+                      help='Lot selection of --tax-lots: fifo, hifo (highest cost first) or specific (default: fifo)')
+    parser.add_argument('--specific-lots', type=str, default=None,
+                      help='JSON lot ids to sell first by account and symbol, for --lot-method specific')
+    parser.add_argument('--tax-date', type=iso_date, default=None,
+                      help='Sale date of --tax-lots for the holding periods, ISO format (default: today)')
+    parser.add_argument('--tax-output', default='tax_impact.csv',
+                      help='Output file of --tax-lots (default: tax_impact.csv)')
+    parser.add_argument('--rebalance', choices=REBALANCE_MODES, default=None,
+                      help='Compute a whole-share trade list to reach the targets: greedy (fast) or exact')
+    parser.add_argument('--cash', type=str, default=None, metavar='ACCOUNT=AMOUNT,...',
+                      help='Cash available to each account for --rebalance (e.g. ibkr=1000,cs=250)')
+    parser.add_argument('--min-trade', type=float, default=0.0,
+                      help='Smallest trade value proposed by --rebalance (default: 0)')
+    parser.add_argument('--rebalance-output', default='rebalance.csv',
+                      help='Trade list output file of --rebalance (default: rebalance.csv)')
     parser.add_argument('--target', type=str, default='targets.json',
                       help='Target JSON file path (default: targets.json)')
     parser.add_argument('--fund-info', type=str, default='fund_info.json',
                       help='Fund info JSON file path for descriptions (default: fund_info.json)')
+    parser.add_argument('--serve', type=str, default=None, metavar='[HOST:]PORT',
+                      help='Run as a local HTTP merge server instead of merging once (e.g. 127.0.0.1:8765)')
+    parser.add_argument('--serve-unix', type=str, default=None, metavar='SOCKET_PATH',
+                      help='Run as a merge server listening on a Unix socket')
+    parser.add_argument('--single-stocks', type=str, default='single_stocks.json',
+                      help='JSON list of single stocks excluded from the merge (default: single_stocks.json)')
+    parser.add_argument('--metrics', type=str, default=None,
+                      help='Write per-stage timings and per-file row counts to this file')
+    parser.add_argument('--metrics-format', choices=['json', 'prometheus'], default='json',
+                      help='Format of the --metrics file (default: json)')
     parser.add_argument('--debug', action='store_true',
                       help='Enable debug logging level')
     return parser.parse_args()
 
+def classifyLineCs(aLine):
+    """
+    Classify and parse a CS row (legacy format, shares at index 3 and "$" price at index 4) without raising.
+
+    Returns:
+        Tuple (status, aShare or None) where status is one of the ROW_* codes
+    """
+    return BROKER_ADAPTERS.get('cs_legacy').classify(aLine)
+
 def parseLineCs(aLine):
-    # Ignore empty lines
-    if not aLine or all(not cell.strip() for cell in aLine):
-        raise EmptyLineException("Empty line")
-    
-    try:
-        aTicker = aLine[0]
-        logging.debug(f"Processing CS ticker: {aTicker}")
-        if isItOption(aTicker):
-            logging.debug(f"Skipping option: {aTicker}")
-            raise OptionDetectedException(f"Option detected: {aTicker}")
-        if isItASingleStock(aTicker):
-            logging.debug(f"Skipping single stock: {aTicker}")
-            raise SingleStockDetectedException(f"Single stock detected: {aTicker}")
-        if not isItProperSymbol(aTicker):
-            logging.debug(f"Invalid symbol: {aTicker}")
-            raise ValueError(f"Invalid symbol: {aTicker}")
-        aNewShare = aShare(aTicker)
-        aNewShare.nbShares = int(aLine[3])
-        logging.debug(f"aNewShare.nbShares: {aNewShare.nbShares}")
-        aNewShare.sharePrice = float(aLine[4][1:])
-        return aNewShare
-    except OptionDetectedException as e:
-        raise e
-    except Exception as e:
-        raise e
+    aStatus, aNewShare = classifyLineCs(aLine)
+    if aStatus != ROW_POSITION:
+        raise_for_row_status(aStatus, aLine[0] if aLine else '')
+    return aNewShare
+
+def classifyLineCs2(aLine):
+    """
+    Classify and parse a CS row (new format 2026+, shares at index 2 and price at index 3) without raising.
+
+    Returns:
+        Tuple (status, aShare or None) where status is one of the ROW_* codes
+    """
+    return BROKER_ADAPTERS.get('cs').classify(aLine)
 
 def parseLineCs2(aLine):
     """Parse CS file with new format (2026+) where shares are at index 2 and price at index 3"""
-    # Ignore empty lines
-    if not aLine or all(not cell.strip() for cell in aLine):
-        raise EmptyLineException("Empty line")
-    
+    aStatus, aNewShare = classifyLineCs2(aLine)
+    if aStatus != ROW_POSITION:
+        raise_for_row_status(aStatus, aLine[0] if aLine else '')
+    return aNewShare
+
+@contextmanager
+def open_positions_source(source):
+    """Open a positions source: a file path, or an already open text buffer (e.g. io.StringIO) left open"""
+    if hasattr(source, 'read'):
+        yield source
+    else:
+        with open(source, newline='') as csvfile:
+            yield csvfile
+
+def source_label(source):
+    """Return a printable name for a file path or an in-memory buffer"""
+    if hasattr(source, 'read'):
+        return getattr(source, 'name', '<buffer>')
+    return source
+
+def report_row_counts(aLabel, filename, iCounts, ioRowCounts=None):
+    """
+    Log the per-status row counts of a parsed file and add them to ioRowCounts.
+
+    Args:
+        aLabel: Broker label used in the log message (e.g. 'CS', 'IBKR')
+        filename: Path of the parsed file
+        iCounts: List of counts indexed by ROW_* status
+        ioRowCounts: Optional dictionary of status name to count to accumulate into
+    """
+    if ioRowCounts is not None:
+        for aStatus, aCount in enumerate(iCounts):
+            aName = ROW_STATUS_NAMES[aStatus]
+            ioRowCounts[aName] = ioRowCounts.get(aName, 0) + aCount
+    if logging.getLogger().isEnabledFor(logging.INFO):
+        logging.info("%s file %s: %s", aLabel, source_label(filename), ", ".join(
+            f"{aCount} {ROW_STATUS_NAMES[aStatus]}" for aStatus, aCount in enumerate(iCounts)))
+
+def iter_adapter_shares(adapter, filename, ioRowCounts=None, ioRowErrors=None):
+    """
+    Lazily yield the shares of a positions file in the format of a broker adapter.
+
+    Args:
+        adapter: brokerAdapters.aBrokerAdapter of the file (or its registered name)
+        filename: Path to the CSV file, or an open text buffer
+        ioRowCounts: Optional dictionary accumulating the number of rows per status name
+        ioRowErrors: Optional list accumulating the invalid rows as (line number, reason, row text);
+            the title, header and total rows of the format are counted as layout, not as invalid
+
+    Yields:
+        aShare objects
+    """
+    if isinstance(adapter, str):
+        adapter = BROKER_ADAPTERS.get(adapter)
+    aCounts = [0] * len(ROW_STATUS_NAMES)
     try:
-        aTicker = aLine[0]
-        logging.debug(f"Processing CS ticker (new format): {aTicker}")
-        if isItOption(aTicker):
-            logging.debug(f"Skipping option: {aTicker}")
-            raise OptionDetectedException(f"Option detected: {aTicker}")
-        if isItASingleStock(aTicker):
-            logging.debug(f"Skipping single stock: {aTicker}")
-            raise SingleStockDetectedException(f"Single stock detected: {aTicker}")
-        if not isItProperSymbol(aTicker):
-            logging.debug(f"Invalid symbol: {aTicker}")
-            raise ValueError(f"Invalid symbol: {aTicker}")
-        aNewShare = aShare(aTicker)
-        aNewShare.nbShares = int(aLine[2])  # New format: shares at index 2
-        logging.debug(f"aNewShare.nbShares: {aNewShare.nbShares}")
-        aNewShare.sharePrice = float(aLine[3])  # New format: price at index 3
-        return aNewShare
-    except OptionDetectedException as e:
-        raise e
-    except Exception as e:
-        raise e
-
-
-def loadSharesCs(ioaShares, filename):
-    with open(filename, newline='') as csvfile:
-        spamreader = csv.reader(csvfile, delimiter=',', quotechar='"')
-        for row in spamreader:
-            try:    
-                aNewShare1 = parseLineCs2(row)
-                ioaShares.append(aNewShare1)
-            except OptionDetectedException as e:
-                logging.info(e)
-            except SingleStockDetectedException as e:
-                logging.info(e)
-            except EmptyLineException:
-                logging.debug("Skipping empty line")
-            except:
-                logging.error(f"Error in CS file with row: {row}")
+        with open_positions_source(filename) as csvfile:
+            spamreader = csv.reader(csvfile, delimiter=adapter.delimiter, quotechar=adapter.quotechar)
+            classify = adapter.classify
+            if classify is None:
+                # Columns given by header name: the rows up to the header are not counted
+                classify = adapter.bind_header(spamreader)
+                if classify is None:
+                    logging.error(f"No {adapter.label} header row with columns "
+                                  f"{', '.join(str(aColumn) for aColumn in adapter.columns.values())} in {source_label(filename)}")
+                    return
+            for row in spamreader:
+                aStatus, aNewShare = classify(row)
+                if aStatus == ROW_INVALID and adapter.is_layout_row(row, classify.indexes):
+                    aStatus = ROW_LAYOUT
+                aCounts[aStatus] += 1
+                if aStatus == ROW_POSITION:
+                    yield aNewShare
+                elif aStatus == ROW_INVALID:
+                    aReason = adapter.explain(row, classify.indexes)
+                    logging.error("Error in %s file with row: %s (%s)", adapter.label, row, aReason)
+                    if ioRowErrors is not None:
+                        ioRowErrors.append((spamreader.line_num, aReason, ','.join(row)))
+    finally:
+        report_row_counts(adapter.label, filename, aCounts, ioRowCounts)
+
+def iterSharesCs(filename, ioRowCounts=None, ioRowErrors=None):
+    """
+    Lazily yield the shares of a CS positions file, one row at a time.
+
+    Args:
+        filename: Path to the CS CSV file, or an open text buffer
+        ioRowCounts: Optional dictionary accumulating the number of rows per status name
+        ioRowErrors: Optional list accumulating the invalid rows (see iter_adapter_shares)
+
+    Yields:
+        aShare objects parsed with classifyLineCs2
+    """
+    return iter_adapter_shares(BROKER_ADAPTERS.get('cs'), filename, ioRowCounts, ioRowErrors)
+
+def loadSharesCs(ioaShares, filename, ioRowCounts=None):
+    ioaShares.extend(iterSharesCs(filename, ioRowCounts))
+
+def classifyLineIBKR(aLine):
+    """
+    Classify and parse an IBKR row (shares at index 1 and price at index 2) without raising.
+
+    An optional currency code at index 3 (e.g. "EUR") gives the currency of the price.
+
+    Returns:
+        Tuple (status, aShare or None) where status is one of the ROW_* codes
+    """
+    return BROKER_ADAPTERS.get('ibkr').classify(aLine)
 
 def parseLineIBKR(aLine):
-    # Ignore empty lines
-    if not aLine or all(not cell.strip() for cell in aLine):
-        raise EmptyLineException("Empty line")
-    
-    try:
-        aTicker = aLine[0].strip('\"')
-        logging.debug(f"Processing IBKR ticker: {aTicker}")
-        if isItOption(aTicker):
-            logging.debug(f"Skipping option: {aTicker}")
-            raise OptionDetectedException(f"Option detected: {aTicker}")
-        if isItASingleStock(aTicker):
-            logging.debug(f"Skipping single stock: {aTicker}")
-            raise SingleStockDetectedException(f"Single stock detected: {aTicker}")
-        if not isItProperSymbol(aTicker):
-            logging.debug(f"Invalid symbol: {aTicker}")
-            raise ValueError(f"Invalid symbol: {aTicker}")
-        
-        aNewShare = aShare(aTicker)
-        aNewShare.nbShares = int(aLine[1].strip('\"'))
-        # Some holdings are only on IBKR so if we don't get the price from there file we miss it in the final output
-        aIbkrSharePrice = float(aLine[2].strip('\"'))
-        aNewShare.sharePrice = aIbkrSharePrice
-        return aNewShare
-    except (OptionDetectedException, SingleStockDetectedException):
-        raise
-    except Exception as e:
-        raise e
-
-def loadSharesIBKR(ioaShares, filename):
-    with open(filename, newline='') as csvfile:
-        spamreader = csv.reader(csvfile, delimiter=',', quotechar='|')
-        for row in spamreader:
-            try:
-                aNewShare = parseLineIBKR(row)
-                ioaShares.append(aNewShare)
-            except OptionDetectedException as e:
-                logging.info(e)
-            except SingleStockDetectedException as e:
-                logging.info(e)
-            except EmptyLineException:
-                logging.debug("Skipping empty line")
-            except:
-                logging.error(f"Error in IBKR file with row: {row}")
+    aStatus, aNewShare = classifyLineIBKR(aLine)
+    if aStatus != ROW_POSITION:
+        raise_for_row_status(aStatus, aLine[0].strip('\"') if aLine else '')
+    return aNewShare
+
+def iterSharesIBKR(filename, ioRowCounts=None, ioRowErrors=None):
+    """
+    Lazily yield the shares of an IBKR positions file, one row at a time.
+
+    Args:
+        filename: Path to the IBKR CSV file, or an open text buffer
+        ioRowCounts: Optional dictionary accumulating the number of rows per status name
+        ioRowErrors: Optional list accumulating the invalid rows (see iter_adapter_shares)
+
+    Yields:
+        aShare objects parsed with classifyLineIBKR
+    """
+    return iter_adapter_shares(BROKER_ADAPTERS.get('ibkr'), filename, ioRowCounts, ioRowErrors)
+
+def loadSharesIBKR(ioaShares, filename, ioRowCounts=None):
+    ioaShares.extend(iterSharesIBKR(filename, ioRowCounts))
 
 def detect_file_type(filename):
     """
-    Detect if a CSV file is from CS or IBKR by examining its header or structure.
-    
+    Detect the broker format of a CSV file from its header.
+
+    The first bytes are read once and matched against the signatures of all the registered
+    adapters (see brokerAdapters.aAdapterRegistry.detect).
+
+    Args:
+        filename: Path to the CSV file, or an open seekable text buffer (rewound after detection)
+
+    Returns:
+        Name of the adapter, e.g. 'cs' for Charles Schwab files, 'ibkr' for Interactive Brokers files
+
+    Raises:
+        ValueError: If no adapter matches the header
+    """
+    logging.debug(f"Starting file type detection for: {source_label(filename)}")
+    if hasattr(filename, 'read'):
+        start = filename.tell()
+        aHeader = filename.read(HEADER_SNIFF_BYTES)
+        filename.seek(start)
+        if isinstance(aHeader, str):
+            aHeader = aHeader.encode('utf-8')
+    else:
+        with open(filename, 'rb') as f:
+            aHeader = f.read(HEADER_SNIFF_BYTES)
+    file_type = sniff_file_type(aHeader)
+    if file_type is None:
+        error_msg = f"Unable to detect file type for {source_label(filename)}. " + unknown_format_hint()
+        logging.error(error_msg)
+        raise ValueError(error_msg)
+    logging.debug(f"Detected {file_type} format")
+    return file_type
+
+def unknown_format_hint():
+    """Describe the expected headers in the error of an undetected file"""
+    return "File must start with one of: " + ", ".join(
+        f"'{adapter.signatures[0]}' ({adapter.name})" for adapter in BROKER_ADAPTERS.adapters.values() if adapter.signatures)
+
+def iter_shares_generic(filename, ioRowCounts=None):
+    """
+    Generic function returning a lazy share reader for a file, automatically detecting the format.
+
     Args:
         filename: Path to the CSV file
-        
+        ioRowCounts: Optional dictionary accumulating the number of rows per status name
+
     Returns:
-        'cs' for Charles Schwab files, 'ibkr' for Interactive Brokers files
+        Generator of aShare objects
     """
-    logging.debug(f"Starting file type detection for: {filename}")
-    
-    with open(filename, 'r', newline='') as csvfile:
-        # Read first line to detect format
-        first_line = csvfile.readline().strip()
-        logging.debug(f"First line: {first_line}")
-        
-        # Check if first line starts with "Positions for account Brokerage" (CS format)
-        if first_line.startswith("Positions for account") or first_line.startswith('"Positions for account'):
-            logging.debug(f"Detected CS format (first line starts with 'Positions for account')")
-            return 'cs'
-        
-        # Check if first line starts with "Symbol" (IBKR format)
-        if first_line.startswith('"Symbol"') or first_line.startswith('Symbol'):
-            logging.debug(f"Detected IBKR format (first line starts with 'Symbol')")
-            return 'ibkr'
-    
-    # Unable to detect file type - raise an error
-    error_msg = f"Unable to detect file type for {filename}. File must start with either 'Positions for account Brokerage' (CS) or '\"Symbol\"' (IBKR)"
-    logging.error(error_msg)
-    raise ValueError(error_msg)
+    file_type = detect_file_type(filename)
+    logging.info(f"Detected file type '{file_type}' for {filename}")
+    return iter_adapter_shares(file_type, filename, ioRowCounts)
 
-def load_shares_generic(ioaShares, filename):
+def load_shares_generic(ioaShares, filename, ioRowCounts=None):
     """
     Generic function to load shares from a file, automatically detecting the format.
     
     Args:
         ioaShares: List to append share objects to
         filename: Path to the CSV file
+        ioRowCounts: Optional dictionary accumulating the number of rows per status name
     """
-    file_type = detect_file_type(filename)
-    logging.info(f"Detected file type '{file_type}' for {filename}")
-    
-    if file_type == 'cs':
-        loadSharesCs(ioaShares, filename)
+    ioaShares.extend(iter_shares_generic(filename, ioRowCounts))
+
+# Memory-mapped ingestion: only the leading columns actually used are tokenized, straight from the mapping
+HEADER_SNIFF_BYTES = 256
+_CS_QUOTED_FIELD = rb'(?:"((?:[^"]|"")*)"|([^,"\r\n]*))'
+_IBKR_FIELD = rb'([^,\r\n]*)'
+# CS 2026 layout: ticker, description, quantity, price (csv quoting with '"')
+_CS_MAPPED_ROW = re.compile(_CS_QUOTED_FIELD + (rb',' + _CS_QUOTED_FIELD) * 3)
+# IBKR layout: ticker, quantity, price and optional currency (read like the csv reader with quotechar '|',
+# quotes are stripped)
+_IBKR_MAPPED_ROW = re.compile(_IBKR_FIELD + (rb',' + _IBKR_FIELD) * 2 + rb'(?:,' + _IBKR_FIELD + rb')?')
+_BLANK_ROW_BYTES = b' \t",\r\n'
+# Formats with a dedicated in-place row pattern; others are decoded and read with the csv module
+_MAPPED_ROW_PATTERNS = {'cs': _CS_MAPPED_ROW, 'ibkr': _IBKR_MAPPED_ROW}
+
+def sniff_file_type(aHeader):
+    """
+    Detect the format of an export from the bytes of its beginning (same rules as detect_file_type).
+
+    Returns:
+        Name of the matching adapter (e.g. 'cs', 'ibkr') or None
+    """
+    adapter = BROKER_ADAPTERS.detect(aHeader)
+    return adapter.name if adapter is not None else None
+
+@contextmanager
+def map_export(filename):
+    """Memory-map a file read-only (an empty file gives empty bytes, which cannot be mapped)"""
+    with open(filename, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            yield b''
+            return
+        aMap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            yield aMap
+        finally:
+            aMap.close()
+
+def iter_mapped_shares(aMap, file_type, filename, ioRowCounts=None, ioRowErrors=None):
+    """
+    Yield the shares of a memory-mapped export, tokenizing only the ticker, quantity and price.
+
+    Rows are matched in place in the mapping; a row with blank cells only counts as empty
+    and a row whose leading columns cannot be read counts as invalid.
+
+    Args:
+        aMap: mmap (or bytes) of the whole file
+        file_type: Name of the broker adapter ('cs', 'ibkr' or a custom format)
+        filename: File name used in log messages
+        ioRowCounts: Optional dictionary accumulating the number of rows per status name
+        ioRowErrors: Optional list accumulating the invalid rows (see iter_adapter_shares)
+
+    Yields:
+        aShare objects
+    """
+    aPattern = _MAPPED_ROW_PATTERNS.get(file_type)
+    if aPattern is None:
+        # Custom formats go through their adapter; the mapping is still read only once
+        yield from iter_adapter_shares(file_type, io.StringIO(bytes(aMap).decode('utf-8-sig'), newline=''),
+                                       ioRowCounts, ioRowErrors)
+        return
+    aLabel = file_type.upper()
+    adapter = BROKER_ADAPTERS.get(file_type)
+    aCounts = [0] * len(ROW_STATUS_NAMES)
+    aSize = len(aMap)
+    pos = 0
+    aLineNumber = 0
+    try:
+        while pos < aSize:
+            aLineStart = pos
+            aLineNumber += 1
+            aMatch = aPattern.match(aMap, pos)
+            aStatus = ROW_INVALID
+            aTicker = ''
+            if aMatch is not None:
+                if file_type == 'cs':
+                    aFields = [aQuoted.replace(b'""', b'"') if aQuoted is not None else aPlain
+                               for aQuoted, aPlain in zip(aMatch.groups()[0::2], aMatch.groups()[1::2])]
+                    aTickerBytes, aQuantity, aPrice = aFields[0], aFields[2], aFields[3]
+                else:
+                    aTickerBytes, aQuantity, aPrice, aCurrencyBytes = (
+                        aField.strip(b'" ') if aField is not None else None for aField in aMatch.groups())
+                aTicker = aTickerBytes.decode('utf-8', 'replace')
+                aStatus = classify_symbol(aTicker)
+                if aStatus == ROW_POSITION:
+                    try:
+                        aNewShare = aShare(aTicker)
+                        aNewShare.nbShares = int(aQuantity)
+                        aNewShare.sharePrice = float(aPrice)
+                    except ValueError:
+                        aStatus = ROW_INVALID
+                    else:
+                        if file_type == 'ibkr' and aCurrencyBytes:
+                            aCurrency = aCurrencyBytes.decode('ascii', 'replace')
+                            if is_currency_code(aCurrency):
+                                aNewShare.currency = aCurrency
+                pos = aMatch.end()
+            aEnd = aMap.find(b'\n', pos)
+            if aEnd < 0:
+                aEnd = aSize
+            if aStatus == ROW_INVALID and not aTicker:
+                # Only rows without a readable ticker pay for a copy of the line
+                aLine = aMap[aLineStart:aEnd]
+                if not aLine.strip(_BLANK_ROW_BYTES):
+                    aStatus = ROW_EMPTY
+                else:
+                    # Title rows such as '"Positions for account ..."' have a single cell
+                    aTicker = next(csv.reader([aLine.decode('utf-8-sig', 'replace')]), [''])[0]
+                    if adapter.is_layout_cell(aTicker):
+                        aStatus = ROW_LAYOUT
+            elif aStatus == ROW_INVALID and adapter.is_layout_cell(aTicker):
+                aStatus = ROW_LAYOUT
+            aCounts[aStatus] += 1
+            if aStatus == ROW_POSITION:
+                yield aNewShare
+            elif aStatus == ROW_INVALID:
+                if aMatch is None:
+                    aReason = "unreadable leading columns"
+                elif classify_symbol(aTicker) == ROW_INVALID:
+                    aReason = f"invalid symbol {aTicker!r}"
+                else:
+                    aReason = number_error(aQuantity.decode('utf-8', 'replace'), aPrice.decode('utf-8', 'replace'))
+                aRow = aMap[aLineStart:min(aEnd, aLineStart + 200)]
+                logging.error("Error in %s file with row at byte %d: %r (%s)", aLabel, aLineStart, aRow, aReason)
+                if ioRowErrors is not None:
+                    ioRowErrors.append((aLineNumber, aReason, aRow.rstrip(b'\r').decode('utf-8', 'replace')))
+            pos = aEnd + 1
+    finally:
+        report_row_counts(aLabel, filename, aCounts, ioRowCounts)
+
+def iter_shares_mapped(filename, ioRowCounts=None, file_type=None, ioRowErrors=None):
+    """
+    Memory-map an export once, sniff its format from the header bytes and yield its shares.
+
+    Args:
+        filename: Path to the CSV file
+        ioRowCounts: Optional dictionary accumulating the number of rows per status name
+        file_type: Adapter name ('cs', 'ibkr', ...) to skip the detection
+        ioRowErrors: Optional list accumulating the invalid rows (see iter_adapter_shares)
+
+    Yields:
+        aShare objects (raises ValueError on the first iteration if the format is unknown)
+    """
+    with map_export(filename) as aMap:
+        if file_type is None:
+            file_type = sniff_file_type(aMap[:HEADER_SNIFF_BYTES])
+            if file_type is None:
+                error_msg = f"Unable to detect file type for {filename}. " + unknown_format_hint()
+                logging.error(error_msg)
+                raise ValueError(error_msg)
+        yield from iter_mapped_shares(aMap, file_type, filename, ioRowCounts, ioRowErrors)
+
+def expand_batch_inputs(batch_input):
+    """
+    Expand a directory or a glob pattern into a sorted list of position files.
+
+    Args:
+        batch_input: Directory (all *.csv files in it are used) or glob pattern
+
+    Returns:
+        Sorted list of file paths
+    """
+    if os.path.isdir(batch_input):
+        batch_input = os.path.join(batch_input, '*.csv')
+    return sorted(aPath for aPath in glob.glob(batch_input) if os.path.isfile(aPath))
+
+def load_shares_cached(aCache, filename, file_type, ioRowCounts=None, ioRowErrors=None):
+    """
+    Load the shares of a file through the parse cache, parsing and storing it on a miss.
+
+    Args:
+        aCache: aParseCache
+        filename: Path to the CSV file
+        file_type: Adapter name ('cs', 'ibkr', ...)
+        ioRowCounts: Optional dictionary accumulating the number of rows per status name
+        ioRowErrors: Optional list accumulating the invalid rows (see iter_adapter_shares)
+
+    Returns:
+        List of aShare
+    """
+    # The parse result also depends on the excluded single stocks
+    variant = f"{file_type}:{BROKER_ADAPTERS.get(file_type).fingerprint()}:{single_stocks_fingerprint()}"
+    payload = aCache.lookup(filename, variant)
+    if payload is None:
+        # The key is taken first so that a file written while it is parsed is not cached
+        aKey = aCache.file_key(filename)
+        aFileRowCounts = {}
+        aFileRowErrors = []
+        aShares = list(iter_adapter_shares(file_type, filename, aFileRowCounts, aFileRowErrors))
+        # Invalid rows are kept so that cached files are reported like parsed ones
+        aCache.store(filename, variant, ([(s.symbol, s.nbShares, s.sharePrice, s.currency) for s in aShares],
+                                         aFileRowCounts, aFileRowErrors), aKey)
+    else:
+        aRows, aFileRowCounts, aFileRowErrors = payload
+        aShares = []
+        for aSymbol, nbShares, aSharePrice, aCurrency in aRows:
+            aNewShare = aShare(aSymbol)
+            aNewShare.nbShares = nbShares
+            aNewShare.sharePrice = aSharePrice
+            aNewShare.currency = aCurrency
+            aShares.append(aNewShare)
+    if ioRowCounts is not None:
+        for name, count in aFileRowCounts.items():
+            ioRowCounts[name] = ioRowCounts.get(name, 0) + count
+    if ioRowErrors is not None:
+        ioRowErrors.extend(aFileRowErrors)
+    return aShares
+
+def load_file_shares(filename, cache_dir=None, use_mmap=False):
+    """
+    Detect the format of a file and parse all its shares (unit of work of load_files_parallel).
+
+    Args:
+        filename: Path to the CSV file
+        cache_dir: Optional parse cache directory
+        use_mmap: Read the file through a single memory mapping (see iter_mapped_shares)
+
+    Returns:
+        Tuple (file_type, list of aShare, row counts by status name, invalid rows, stage timings
+        in seconds); file_type is None when the format could not be detected
+    """
+    aRowCounts = {}
+    aRowErrors = []
+    aShares = []
+    start = time.perf_counter()
+    if use_mmap and not cache_dir:
+        with map_export(filename) as aMap:
+            file_type = sniff_file_type(aMap[:HEADER_SNIFF_BYTES])
+            detected = time.perf_counter()
+            if file_type is None:
+                logging.error(f"Unable to detect file type for {filename}")
+                return None, aShares, aRowCounts, aRowErrors, {'detect': detected - start}
+            aShares = list(iter_mapped_shares(aMap, file_type, filename, aRowCounts, aRowErrors))
+        return file_type, aShares, aRowCounts, aRowErrors, {'detect': detected - start,
+                                                            'parse': time.perf_counter() - detected}
+
+    try:
+        file_type = detect_file_type(filename)
+    except ValueError:
+        return None, aShares, aRowCounts, aRowErrors, {'detect': time.perf_counter() - start}
+    detected = time.perf_counter()
+    if cache_dir:
+        aShares = load_shares_cached(aParseCache(cache_dir), filename, file_type, aRowCounts, aRowErrors)
+    else:
+        aShares = list(iter_adapter_shares(file_type, filename, aRowCounts, aRowErrors))
+    return file_type, aShares, aRowCounts, aRowErrors, {'detect': detected - start,
+                                                        'parse': time.perf_counter() - detected}
+
+def init_worker(single_stocks, adapter_specs=()):
+    """
+    Initialize a worker process with the state of the parent it may not inherit.
+
+    Args:
+        single_stocks: Single stocks in use (see symbolClassifier.get_single_stocks)
+        adapter_specs: Declarations of the broker adapters loaded from files (BROKER_ADAPTERS.custom_specs)
+    """
+    set_single_stocks(single_stocks)
+    for aSpec in adapter_specs:
+        BROKER_ADAPTERS.register_spec(aSpec, replace=True)
+
+def load_files_parallel(filenames, max_workers=None, cache_dir=None, use_mmap=False):
+    """
+    Load many position files in a process pool.
+
+    Results are returned in the order of filenames whatever the completion order of the
+    workers, so merging them gives the same portfolio on every run.
+
+    Args:
+        filenames: List of CSV file paths
+        max_workers: Number of worker processes (default: number of CPUs, 1 loads in-process)
+        cache_dir: Optional parse cache directory
+        use_mmap: Read the files through memory mappings
+
+    Returns:
+        List of (filename, file_type, list of aShare, row counts by status name, invalid rows, stage timings)
+    """
+    if max_workers == 1 or len(filenames) <= 1:
+        aResults = [load_file_shares(filename, cache_dir, use_mmap) for filename in filenames]
     else:
-        loadSharesIBKR(ioaShares, filename)
-
-# Custom merge function
-def merge_objects(iShare1, iShare2):
-    if iShare1 and iShare2:  # Both objects exist
-        aMergedShare = aShare(iShare1.symbol)
-        aMergedShare.nbShares = iShare1.nbShares + iShare2.nbShares  
-        #Verify if we have a price for both stock
-        if iShare1.sharePrice and iShare2.sharePrice:
-            if not prices_within_range(iShare1.sharePrice, iShare2.sharePrice):
-                logging.error(f"Prices for {iShare1.symbol} are not within range: {iShare1.sharePrice} vs {iShare2.sharePrice}")
-                raise ValueError(f"Prices for {iShare1.symbol} are not within range: {iShare1.sharePrice} vs {iShare2.sharePrice}")
+        # Workers get the single stocks and custom adapters in use explicitly since they may not inherit the parent state
+        with ProcessPoolExecutor(max_workers=max_workers, initializer=init_worker,
+                                 initargs=(get_single_stocks(), BROKER_ADAPTERS.custom_specs)) as executor:
+            aResults = list(executor.map(partial(load_file_shares, cache_dir=cache_dir, use_mmap=use_mmap), filenames))
+    return [(filename,) + aResult for filename, aResult in zip(filenames, aResults)]
+
+class aPortfolio:
+    """
+    Symbol-keyed accumulator consolidating positions from any number of accounts.
+
+    Each share is folded in place into a single consolidated aShare per symbol,
+    which also records the per-account share counts in nbSharesByAccount.
+
+    Prices that are not within range of the first quote of their symbol are all collected,
+    then resolved by the price policy once every account is folded in (resolve_prices), and
+    recorded in the validation report.
+    """
+    def __init__(self, price_policy=None, report=None, base_currency=DEFAULT_BASE_CURRENCY):
+        self.shares = {}
+        self.accounts = []
+        # Currency of the consolidated prices, positions in any other currency are rejected
+        self.base_currency = base_currency
+        # Account values are priced with each account's own quotes, as reported by the broker
+        self.valueByAccount = {}
+        self.price_policy = price_policy or aPricePolicy()
+        self.report = report if report is not None else aValidationReport()
+        # Later quotes of the symbols priced by more than one position, as (symbol, account, price);
+        # only scanned when there are conflicts
+        self.quote_log = []
+        # Symbols with quotes out of range, in the order they were found
+        self.conflicts = {}
+        # Account whose quote is the consolidated price of each symbol (its first non-zero quote)
+        self.priceAccountBySymbol = {}
+
+    def __len__(self):
+        return len(self.shares)
+
+    def __iter__(self):
+        return iter(self.shares.values())
+
+    def add_share(self, account, iShare):
+        aCurrency = iShare.currency or self.base_currency
+        if aCurrency != self.base_currency:
+            # Only happens for exports giving currencies when no FX conversion is configured
+            logging.error("[%s] Price of %s is in %s, not in %s", account.upper(), iShare.symbol, aCurrency,
+                          self.base_currency)
+            raise ValueError(f"Price of {iShare.symbol} in {account} is in {aCurrency}, not in {self.base_currency}. "
+                             f"Use --fx-rates to convert it.")
+        aTotalShare = self.shares.get(iShare.symbol)
+        if aTotalShare is None:
+            aTotalShare = aShare(iShare.symbol)
+            aTotalShare.sharePrice = iShare.sharePrice
+            aTotalShare.currency = self.base_currency
+            aTotalShare.nbSharesByAccount = {}
+            self.shares[iShare.symbol] = aTotalShare
+            self.priceAccountBySymbol[iShare.symbol] = account
+        elif iShare.sharePrice:
+            #Verify if the new price is consistent with the one we already have
+            if not aTotalShare.sharePrice:
+                aTotalShare.sharePrice = iShare.sharePrice
+                self.priceAccountBySymbol[iShare.symbol] = account
             else:
-                logging.info(f"Prices for {iShare1.symbol} are within range: {iShare1.sharePrice} vs {iShare2.sharePrice}")
-                aMergedShare.sharePrice = iShare1.sharePrice
-        return aMergedShare
-    elif iShare1:  # Only iShare1 exists
-        return iShare1
-    elif iShare2:  # Only iShare2 exists
-        return iShare2
-
-# Function to merge two lists with unmatched objects
-def merge_lists(list1, list2, merge_func):
-    # Create dictionaries for quick lookup by 'id'
-    dict1 = {obj.symbol: obj for obj in list1}
-    dict2 = {obj.symbol: obj for obj in list2}
-    
-    # Union of all keys from both lists
-    all_ids = set(dict1.keys()).union(dict2.keys())
-    
-    merged_list = []
-    for obj_id in all_ids:
-        merged_obj = merge_func(dict1.get(obj_id), dict2.get(obj_id))
-        if merged_obj:
-            merged_list.append(merged_obj)
-    
-    return merged_list
+                self.quote_log.append((iShare.symbol, account, iShare.sharePrice))
+                if not prices_within_range(aTotalShare.sharePrice, iShare.sharePrice):
+                    logging.error("Prices for %s are not within range: %s vs %s", iShare.symbol, aTotalShare.sharePrice, iShare.sharePrice)
+                    self.conflicts[iShare.symbol] = True
+                else:
+                    logging.info("Prices for %s are within range: %s vs %s", iShare.symbol, aTotalShare.sharePrice, iShare.sharePrice)
+        aTotalShare.nbShares += iShare.nbShares
+        aTotalShare.nbSharesByAccount[account] = aTotalShare.nbSharesByAccount.get(account, 0) + iShare.nbShares
+        self.valueByAccount[account] = self.valueByAccount.get(account, 0.0) + iShare.nbShares * iShare.sharePrice
+
+    def add_account(self, account, iShares):
+        """
+        Fold all shares of one account into the portfolio.
+
+        Args:
+            account: Account label (e.g. 'ibkr', 'cs', 'ira')
+            iShares: Iterable of aShare objects for this account
+        """
+        if account not in self.accounts:
+            self.accounts.append(account)
+        for aAccountShare in iShares:
+            self.add_share(account, aAccountShare)
+
+    def resolve_prices(self):
+        """
+        Choose the price of each symbol with conflicting quotes and record the conflicts in the report.
+
+        Raises:
+            PriceConflictException: Under the abort policy, once all the conflicts are recorded
+        """
+        if not self.conflicts:
+            return
+        # The first quote of a symbol is its consolidated price, from the account that gave it
+        quotes = {symbol: [(self.priceAccountBySymbol[symbol], self.shares[symbol].sharePrice)]
+                  for symbol in self.conflicts}
+        for symbol, account, price in self.quote_log:
+            if symbol in quotes:
+                quotes[symbol].append((account, price))
+        for symbol, aQuotes in quotes.items():
+            aPrice, aResolution = self.price_policy.resolve(aQuotes)
+            self.report.add('price_conflict', symbol, account=','.join(dict.fromkeys(account for account, _ in aQuotes)),
+                            detail=', '.join(f"{account}={price:g}" for account, price in aQuotes), resolution=aResolution)
+            if aPrice is not None:
+                logging.warning(f"Price of {symbol} set to {aPrice:g} ({aResolution})")
+                self.shares[symbol].sharePrice = aPrice
+        if self.price_policy.mode == 'abort':
+            symbols = list(self.conflicts)
+            raise PriceConflictException(
+                f"Prices of {len(symbols)} symbol(s) are not within range: {', '.join(symbols[:10])}"
+                + (", ..." if len(symbols) > 10 else "") + ". Use --price-policy to resolve them.", self.report)
+
+    def account_value(self, account):
+        return self.valueByAccount.get(account, 0.0)
+
+    def total_value(self):
+        return sum(s.nbShares * s.sharePrice for s in self.shares.values())
+
+def consolidate_positions(sources, price_policy=None, report=None, base_currency=DEFAULT_BASE_CURRENCY):
+    """
+    Consolidate any number of account sources into a single portfolio in one pass.
+
+    Shares are consumed as they are parsed, so with lazy sources (iterSharesCs, iterSharesIBKR)
+    memory holds one consolidated entry per symbol rather than the rows of the exports.
+
+    Args:
+        sources: Iterable of (account, shares) pairs where shares is an iterable of aShare
+        price_policy: validation.aPricePolicy applied to conflicting prices (default: abort)
+        report: Optional validation.aValidationReport to record the conflicts into
+        base_currency: Currency of the prices, once converted when there is an FX conversion
+
+    Returns:
+        aPortfolio holding one consolidated aShare per symbol
+
+    Raises:
+        PriceConflictException: If prices conflict under the abort policy
+        ValueError: If a position is priced in another currency than base_currency
+    """
+    aConsolidated = aPortfolio(price_policy, report, base_currency)
+    for account, aAccountShares in sources:
+        aConsolidated.add_account(account, aAccountShares)
+    aConsolidated.resolve_prices()
+    return aConsolidated
 
 def prices_within_range(price1, price2, percent_range=10):
     """
@@ -344,7 +900,46 @@ def load_fund_info(fund_info_file='fund_info.json'):
         logging.error(f"Error parsing fund info file: {e}")
         return {}
 
-def validate_targets_sum(targets, target_field='target', account_label='global'):
+def sum_target_field(targets, target_field):
+    """Return (total, error) for one target field; error is None unless a value is not a number"""
+    try:
+        # Convert all target values to float and sum them
+        return sum(float(value[target_field]) for value in targets.values() if value and target_field in value), None
+    except (ValueError, TypeError) as e:
+        return None, str(e)
+
+def compute_target_sums(targets):
+    """
+    Precompute the sum of every target field of a targets dictionary.
+
+    Args:
+        targets: Dictionary mapping stock symbols to target objects
+
+    Returns:
+        Dictionary mapping each target field to a tuple (total, error); error is None
+        unless a value of that field could not be converted to a number
+    """
+    target_fields = []
+    for value in targets.values():
+        for field in (value or {}):
+            if field.startswith('target') and field not in target_fields:
+                target_fields.append(field)
+
+    return {target_field: sum_target_field(targets, target_field) for target_field in target_fields}
+
+def compile_targets(targets_file):
+    """
+    Load a targets file together with its precomputed per-field sums (see compute_target_sums).
+
+    Returns:
+        Dictionary with 'targets' and 'sums', or an empty dictionary if no targets were loaded
+    """
+    targets = load_targets(targets_file)
+    if not targets:
+        return {}
+    return {'targets': targets, 'sums': compute_target_sums(targets)}
+
+def validate_targets_sum(targets, target_field='target', account_label='global', target_sums=None):
     """
     Validate that the sum of all target values does not exceed 100.
     
@@ -352,6 +947,7 @@ def validate_targets_sum(targets, target_field='target', account_label='global')
         targets: Dictionary mapping stock symbols to target objects
         target_field: The field name to use for the target value
         account_label: Human-readable label for the account (used in log messages)
+        target_sums: Optional precomputed sums from compute_target_sums
         
     Returns:
         Boolean indicating if targets are valid
@@ -360,165 +956,632 @@ def validate_targets_sum(targets, target_field='target', account_label='global')
         logging.warning(f"[{account_label}] No targets to validate")
         return True
     
-    try:
-        # Convert all target values to float and sum them
-        total = sum(float(value[target_field]) for value in targets.values() if value and target_field in value)
-        logging.info(f"[{account_label}] Total target allocation: {total}%")
-        
-        if total > 100:
-            logging.error(f"[{account_label}] Target allocation exceeds 100%: {total}%")
-            return False
-        elif total < 100:
-            logging.warning(f"[{account_label}] Target allocation is less than 100%: {total}%")
-        else:
-            logging.info(f"[{account_label}] Target allocation is exactly 100%")
-        
-        return True
-    except (ValueError, TypeError) as e:
-        logging.error(f"[{account_label}] Error validating targets: {e}")
+    if target_sums is not None and target_field in target_sums:
+        total, error = target_sums[target_field]
+    else:
+        total, error = sum_target_field(targets, target_field)
+    if error is not None:
+        logging.error(f"[{account_label}] Error validating targets: {error}")
         return False
+
+    logging.info(f"[{account_label}] Total target allocation: {total}%")
     
+    if total > 100:
+        logging.error(f"[{account_label}] Target allocation exceeds 100%: {total}%")
+        return False
+    elif total < 100:
+        logging.warning(f"[{account_label}] Target allocation is less than 100%: {total}%")
+    else:
+        logging.info(f"[{account_label}] Target allocation is exactly 100%")
+    
+    return True
+    
+# Columns of the holdings output
+HOLDINGS_FIELDS = [
+    "ticker", "description", "sec_yield_30d", "ttm_yield",
+    "nbShares", "nbShares_ibkr", "nbShares_cs", "nbShares_ira",
+    "price",
+    "currentAllocation", "currentAllocation_ibkr", "currentAllocation_cs", "currentAllocation_ira",
+    "target_global", "target_ibkr", "target_cs", "target_ira",
+    "sharesToTarget_ibkr", "sharesToTarget_cs", "sharesToTarget_ira"
+]
+
+class aHoldings:
+    """Consolidated holdings table: HOLDINGS_FIELDS columns, one row per symbol, plus portfolio totals"""
+    def __init__(self, rows, portfolio, valuation, target_field, row_counts):
+        self.fields = HOLDINGS_FIELDS
+        self.rows = rows
+        self.portfolio = portfolio
+        self.valuation = valuation
+        self.target_field = target_field
+        self.row_counts = row_counts
+        # Validation report of the merge (validation.aValidationReport)
+        self.report = portfolio.report
+        self.totalValue = valuation.totalValue
+        self.valueByAccount = {account: valuation.account_value(account) for account in valuation.columns.accounts}
+        self.metrics = None
+
+    def as_dicts(self):
+        return [dict(zip(self.fields, row)) for row in self.rows]
+
+def build_holdings_rows(iShares, valuation, targets, fund_info, report=None):
+    """
+    Build the holdings table rows (HOLDINGS_FIELDS columns) of a valued portfolio.
+
+    Args:
+        iShares: Consolidated aShare objects, in the symbol order of the valuation
+        valuation: aValuation of these shares
+        targets: Dictionary mapping stock symbols to target objects
+        fund_info: Dictionary mapping stock symbols to fund info objects
+        report: Optional validation.aValidationReport recording the symbols without a target
+
+    Returns:
+        List of rows
+    """
+    rows = []
+    for i, aTotalShare in enumerate(iShares):
+        target_obj = targets.get(aTotalShare.symbol, {})
+        fund_obj = fund_info.get(aTotalShare.symbol, {})
+        description_value = fund_obj.get('description', '') if fund_obj else ''
+        sec_yield_30d_value = (fund_obj.get('sec_yield_30d', '') or '').replace('%', '') if fund_obj else ''
+        ttm_yield_value = (fund_obj.get('ttm_yield', '') or '').replace('%', '') if fund_obj else ''
+
+        # Allocations and shares to target come from the batched valuation (same symbol order)
+        current_allocation = valuation.allocations[i]
+
+        # Per-account data
+        nb_by_acct = {}
+        alloc_by_acct = {}
+        shares_to_target_by_acct = {}
+        for a, account in enumerate(valuation.columns.accounts):
+            nb_by_acct[account] = aTotalShare.nbSharesByAccount.get(account, 0)
+            alloc_by_acct[account] = f"{valuation.allocationsByAccount[a][i]:.2f}"
+            shares_needed = valuation.sharesToTarget[a][i]
+            if shares_needed is None or shares_needed != shares_needed:  # None or NaN: no target
+                shares_to_target_by_acct[account] = ''
+            else:
+                shares_to_target_by_acct[account] = f"{shares_needed:.0f}"
+
+        target_global = target_obj.get('target_global', target_obj.get('target', '')) if target_obj else ''
+        target_ibkr   = target_obj.get('target_ibkr', '') if target_obj else ''
+        target_cs     = target_obj.get('target_cs', '') if target_obj else ''
+        target_ira    = target_obj.get('target_ira', '') if target_obj else ''
+
+        if target_global == '':
+            logging.error("Missing target for stock: %s", aTotalShare.symbol)
+            if report is not None:
+                report.add('missing_target', aTotalShare.symbol, detail="no target in the targets file")
+
+        rows.append([
+            aTotalShare.symbol, description_value, sec_yield_30d_value, ttm_yield_value,
+            aTotalShare.nbShares, nb_by_acct['ibkr'], nb_by_acct['cs'], nb_by_acct['ira'],
+            aTotalShare.sharePrice,
+            f"{current_allocation:.2f}", alloc_by_acct['ibkr'], alloc_by_acct['cs'], alloc_by_acct['ira'],
+            target_global, target_ibkr, target_cs, target_ira,
+            shares_to_target_by_acct['ibkr'], shares_to_target_by_acct['cs'], shares_to_target_by_acct['ira']
+        ])
+    return rows
+
+def load_fx_converter(fx_rates_file, base_currency=DEFAULT_BASE_CURRENCY, account_currencies=None, fx_date=None,
+                      reference_cache=None):
+    """
+    Load an FX rates file into a converter of account positions.
+
+    Args:
+        fx_rates_file: Rate table CSV file (see fxRates.compile_rate_table)
+        base_currency: Currency of the merged holdings
+        account_currencies: Dictionary mapping accounts to their currency (base currency by default)
+        fx_date: ISO date of the rates (default: the last date of the table)
+        reference_cache: Optional aReferenceCache of the compiled table
+
+    Returns:
+        aFxConverter
+    """
+    rate_table = aRateTable.from_file(fx_rates_file, base_currency.upper(), reference_cache)
+    return aFxConverter(rate_table, account_currencies, fx_date)
+
+class PortfolioMerger:
+    """
+    Reusable merger: loads targets and fund info once, then merges position sources on demand.
+
+    Sources can be file paths or in-memory text buffers (e.g. io.StringIO) holding the CSV
+    export, so a long-lived process (see mergerServer.py) pays the setup cost only once.
+    With an FX rates file, positions in other currencies are converted to the base currency
+    before they are consolidated (see fxRates.py). Prices that differ between accounts are
+    resolved by price_policy (see validation.py).
+    """
+    def __init__(self, targets_file='targets.json', fund_info_file='fund_info.json',
+                 single_stocks_file=None, cache_dir=None, workers=None, use_mmap=False, reference=None,
+                 fx_rates_file=None, base_currency=DEFAULT_BASE_CURRENCY, account_currencies=None, fx_date=None,
+                 price_policy=None):
+        if single_stocks_file:
+            load_single_stocks(single_stocks_file)
+        self.cache_dir = cache_dir
+        self.workers = workers
+        self.use_mmap = use_mmap
+        self.parse_cache = aParseCache(cache_dir) if cache_dir else None
+        self.reference_cache = aReferenceCache(cache_dir) if cache_dir else None
+        # Setup metrics (reference data loading), merge runs can record into the same object
+        self.metrics = aMetrics()
+        # FX conversion of the positions (aFxConverter), None when all accounts are in the base currency
+        self.fx = None
+        # Resolution of prices that differ between accounts (validation.aPricePolicy)
+        self.price_policy = price_policy or aPricePolicy()
+
+        if reference is not None:
+            # Reference data already loaded by the caller (e.g. asyncPipeline.py)
+            compiled_targets, self.fund_info = reference
+            self.targets = compiled_targets.get('targets', {})
+            self.target_sums = compiled_targets.get('sums', {})
+            return
+
+        # Load targets
+        logging.info(f"Using target file: {targets_file}")
+        with self.metrics.stage('target_load') as aStage:
+            compiled_targets = self.compile_targets_file(targets_file)
+            self.targets = compiled_targets.get('targets', {})
+            self.target_sums = compiled_targets.get('sums', {})
+            aStage.rows += len(self.targets)
+
+        # Load fund info (descriptions)
+        logging.info(f"Using fund info file: {fund_info_file}")
+        with self.metrics.stage('fund_info_load') as aStage:
+            self.fund_info = self.load_fund_info_file(fund_info_file)
+            aStage.rows += len(self.fund_info)
+
+        if fx_rates_file:
+            logging.info(f"Using FX rates file: {fx_rates_file} (base currency {base_currency})")
+            with self.metrics.stage('fx_rates_load') as aStage:
+                self.fx = load_fx_converter(fx_rates_file, base_currency, account_currencies, fx_date,
+                                            self.reference_cache)
+                aStage.rows += len(self.fx.rate_table.ratesByCurrency)
+
+    def compile_targets_file(self, targets_file):
+        """Load a targets file with its per-field sums, through the reference cache when enabled"""
+        if self.reference_cache:
+            return self.reference_cache.load(targets_file, 'targets', compile_targets)
+        return compile_targets(targets_file)
+
+    def load_fund_info_file(self, fund_info_file):
+        """Load a fund info file, through the reference cache when enabled"""
+        if self.reference_cache:
+            return self.reference_cache.load(fund_info_file, 'fund_info', load_fund_info)
+        return load_fund_info(fund_info_file)
+
+    def load_portfolio(self, ibkr=None, cs=None, ira=None, batch_files=(), ioRowCounts=None, metrics=None):
+        """
+        Consolidate the given account sources into a portfolio.
+
+        Args:
+            ibkr, cs, ira: Optional file path or text buffer of each named account
+            batch_files: File paths loaded in parallel and merged under their detected broker
+            ioRowCounts: Optional dictionary accumulating the number of rows per status name
+            metrics: Optional aMetrics recording the detect, parse and merge stages
+
+        Returns:
+            aPortfolio, with the validation report of the load in its report attribute
+
+        Raises:
+            PriceConflictException: If prices conflict under the abort price policy (the
+                exception carries the report)
+        """
+        if ioRowCounts is None:
+            ioRowCounts = {}
+        if metrics is None:
+            metrics = aMetrics()
+        report = aValidationReport()
+        # Row counts and invalid rows of each file, filled as the files are read
+        file_row_counts = []
+        file_row_errors = []
+        # Shares are streamed from each file straight into the consolidated portfolio
+        account_files = [
+            ('ibkr', ibkr, 'ibkr', iterSharesIBKR),
+            ('cs', cs, 'cs', iterSharesCs),
+            ('ira', ira, 'cs', iterSharesCs),
+        ]
+        sources = []
+        for account, filename, file_type, reader in account_files:
+            if filename is not None:
+                logging.info(f"Loading {account.upper()} file: {source_label(filename)}")
+                aFileRowCounts = {}
+                aFileRowErrors = []
+                file_row_counts.append((source_label(filename), aFileRowCounts))
+                file_row_errors.append((source_label(filename), account, aFileRowErrors))
+                if self.parse_cache and not hasattr(filename, 'read'):
+                    with metrics.stage('parse') as aStage:
+                        aFileShares = load_shares_cached(self.parse_cache, filename, file_type, aFileRowCounts,
+                                                         aFileRowErrors)
+                        aStage.rows += len(aFileShares)
+                    sources.append((account, aFileShares))
+                elif self.use_mmap and not hasattr(filename, 'read'):
+                    aReader = iter_shares_mapped(filename, aFileRowCounts, file_type, aFileRowErrors)
+                    sources.append((account, metrics.timed_iter(aReader, 'parse')))
+                else:
+                    sources.append((account, metrics.timed_iter(reader(filename, aFileRowCounts, aFileRowErrors),
+                                                                'parse')))
+
+        # Batch files are loaded in parallel and merged under the account of their detected broker format
+        if batch_files:
+            logging.info(f"Loading {len(batch_files)} batch file(s)")
+            for filename, file_type, aFileShares, aFileRowCounts, aFileRowErrors, timings in load_files_parallel(
+                    list(batch_files), self.workers, self.cache_dir, self.use_mmap):
+                metrics.add('detect', timings['detect'], rows=1)
+                if file_type is None:
+                    report.add('invalid_file', source=filename, detail="unknown format, file skipped")
+                    continue
+                metrics.add('parse', timings['parse'], rows=len(aFileShares))
+                account = BROKER_ADAPTERS.get(file_type).account
+                file_row_counts.append((filename, aFileRowCounts))
+                file_row_errors.append((filename, account, aFileRowErrors))
+                sources.append((account, aFileShares))
+
+        sources = self.convert_sources(sources, metrics)
+
+        # Parsing of the streamed files happens during the merge but is recorded as its own stage
+        try:
+            with metrics.stage('merge', exclude=('parse',)) as aStage:
+                aPortfolioShares = consolidate_positions(sources, self.price_policy, report, self.base_currency)
+                aStage.rows += len(aPortfolioShares)
+        finally:
+            # The streamed files are fully read once merged, also when the merge aborts on price conflicts
+            for filename, account, aFileRowErrors in file_row_errors:
+                report.add_row_errors(filename, account, aFileRowErrors)
+
+        for filename, aFileRowCounts in file_row_counts:
+            metrics.record_file(filename, aFileRowCounts)
+            for name, count in aFileRowCounts.items():
+                ioRowCounts[name] = ioRowCounts.get(name, 0) + count
+        logging.info(f"Total shares after merging {len(sources)} file(s): {len(aPortfolioShares)}")
+        logging.info(f"Symbol classification cache: {classify_cache_stats()}")
+        if self.parse_cache:
+            logging.info(f"Parse cache: {self.parse_cache.hits} hit(s), {self.parse_cache.misses} miss(es)")
+        logging.info("Rows by status: " + ", ".join(f"{name}={count}" for name, count in ioRowCounts.items()))
+        return aPortfolioShares
+
+    @property
+    def base_currency(self):
+        """Currency of the merged holdings"""
+        return self.fx.base_currency if self.fx else DEFAULT_BASE_CURRENCY
+
+    def convert_sources(self, sources, metrics):
+        """
+        Convert the prices of (account, shares) sources to the base currency.
+
+        Returns:
+            The sources, with their shares as lists, unchanged when there is no FX conversion
+        """
+        if self.fx is None:
+            return sources
+        # Streamed files are parsed here, which is recorded as the parse stage
+        with metrics.stage('fx', exclude=('parse',)) as aStage:
+            sources = [(account, self.fx.convert_shares(account, aShares)) for account, aShares in sources]
+            aStage.rows += sum(len(aShares) for _, aShares in sources)
+        return sources
+
+    def resolve_target_field(self, accounts):
+        """Return the target field to use for the given accounts, and validate the targets"""
+        # Determine which target field to use based on which accounts were provided
+        if len(accounts) == 1:
+            target_field = f'target_{accounts[0]}'
+        else:
+            target_field = 'target_global'
+        logging.info(f"Target field: {target_field}")
+
+        # Fall back to 'target' if the resolved field is not present in the file (old format)
+        sample = next(iter(self.targets.values()), {})
+        if target_field not in sample and 'target' in sample:
+            logging.info(f"Field '{target_field}' not found in targets file, falling back to 'target'")
+            target_field = 'target'
+        validate_targets_sum(self.targets, target_field, account_label='global', target_sums=self.target_sums)
+
+        # Validate per-account allocations
+        for account in ['ibkr', 'cs', 'ira']:
+            acct_field = f'target_{account}'
+            if acct_field in sample:
+                validate_targets_sum(self.targets, acct_field, account_label=account.upper(), target_sums=self.target_sums)
+        return target_field
+
+    def merge(self, ibkr=None, cs=None, ira=None, batch_files=(), metrics=None):
+        """
+        Merge the given account sources into the consolidated holdings table.
+
+        Args:
+            ibkr, cs, ira: Optional file path or text buffer of each named account
+            batch_files: File paths loaded in parallel and merged under their detected broker
+            metrics: Optional aMetrics to record the stages into (a new one by default)
+
+        Returns:
+            aHoldings, with the stage metrics of the run in its metrics attribute and the
+            validation report in its report attribute
+
+        Raises:
+            PriceConflictException: If prices conflict under the abort price policy
+        """
+        if metrics is None:
+            metrics = aMetrics()
+        row_counts = {}
+        aPortfolioShares = self.load_portfolio(ibkr, cs, ira, batch_files, row_counts, metrics)
+        return self.build_holdings(aPortfolioShares, row_counts, metrics)
+
+    def build_holdings(self, aPortfolioShares, row_counts, metrics):
+        """
+        Value a consolidated portfolio and build its holdings table.
+
+        Args:
+            aPortfolioShares: aPortfolio
+            row_counts: Row counts by status name of the files it was loaded from
+            metrics: aMetrics to record the valuation and holdings stages into
+
+        Returns:
+            aHoldings, with metrics in its metrics attribute
+        """
+        target_field = self.resolve_target_field(aPortfolioShares.accounts)
+
+        # Calculate total and per-account portfolio values
+        logging.info("Calculating portfolio values")
+        with metrics.stage('valuation') as aStage:
+            valuation = value_portfolio(aPortfolioShares, self.targets)
+            aStage.rows += len(aPortfolioShares)
+        with metrics.stage('holdings') as aStage:
+            rows = build_holdings_rows(aPortfolioShares, valuation, self.targets, self.fund_info, aPortfolioShares.report)
+            aStage.rows += len(rows)
+        holdings = aHoldings(rows, aPortfolioShares, valuation, target_field, row_counts)
+        holdings.metrics = metrics
+        return holdings
+
+    def run_scenarios(self, holdings, scenarios, metrics=None):
+        """
+        Value merged holdings under many what-if scenarios in one batch (see scenarios.value_scenarios).
+
+        Alternative targets files are loaded and validated once each.
+
+        Args:
+            holdings: aHoldings returned by merge
+            scenarios: List of scenarios.aScenario
+            metrics: Optional aMetrics to record the stage into
+
+        Returns:
+            aValuationBatch, one entry per scenario
+        """
+        if metrics is None:
+            metrics = holdings.metrics or aMetrics()
+        targets_by_file = {}
+        with metrics.stage('target_load') as aStage:
+            for aScenario in scenarios:
+                if not aScenario.targets_file or aScenario.targets_file in targets_by_file:
+                    continue
+                compiled_targets = self.compile_targets_file(aScenario.targets_file)
+                targets = compiled_targets.get('targets', {})
+                for field in compiled_targets.get('sums', {}):
+                    validate_targets_sum(targets, field, account_label=f"{aScenario.name}:{field}",
+                                         target_sums=compiled_targets['sums'])
+                targets_by_file[aScenario.targets_file] = targets
+                aStage.rows += len(targets)
+        with metrics.stage('scenarios') as aStage:
+            batch = value_scenarios(holdings.valuation, scenarios, targets_by_file)
+            aStage.rows += len(batch) * len(holdings.rows)
+        return batch
+
+    def rebalance(self, holdings, cashByAccount=None, min_trade_value=0.0, mode='greedy', metrics=None):
+        """
+        Compute the whole-share trade list bringing merged holdings to their targets (see rebalancer.rebalance).
+
+        Args:
+            holdings: aHoldings returned by merge
+            cashByAccount: Optional cash available to each account
+            min_trade_value: Smallest trade value allowed
+            mode: 'greedy' or 'exact'
+            metrics: Optional aMetrics to record the stage into
+
+        Returns:
+            aRebalancePlan
+        """
+        if metrics is None:
+            metrics = holdings.metrics or aMetrics()
+        with metrics.stage('rebalance') as aStage:
+            plan = rebalance(holdings.valuation, self.targets, cashByAccount, min_trade_value, mode,
+                             target_field=holdings.target_field)
+            aStage.rows += len(plan.trades)
+        return plan
+
 if __name__ == "__main__":
     args = parse_arguments()
 
     setup_logging(debug=args.debug)
     logging.info("Starting PortfolioMerger - Merging positions from CS and IBKR")
     
-    aTotalShares = []
-    shares_by_account = {'ibkr': {}, 'cs': {}, 'ira': {}}
+    load_single_stocks(args.single_stocks)
+    if args.adapters:
+        try:
+            BROKER_ADAPTERS.load_file(args.adapters)
+        except (ValueError, OSError) as e:
+            logging.error(f"Unable to load broker adapters: {e}")
+            exit(1)
+    fx_options = {}
+    if args.fx_rates:
+        try:
+            fx_options = {'fx_rates_file': args.fx_rates, 'base_currency': args.base_currency,
+                          'account_currencies': parse_account_currencies(args.account_currency), 'fx_date': args.fx_date}
+        except ValueError as e:
+            logging.error(str(e))
+            exit(1)
+    elif args.account_currency:
+        logging.error("--account-currency requires --fx-rates")
+        exit(1)
+    try:
+        price_policy = parse_price_policy(args.price_policy)
+    except ValueError as e:
+        logging.error(str(e))
+        exit(1)
+
+    # Server mode: keep the merger loaded and answer merge requests
+    if args.serve or args.serve_unix:
+        from mergerServer import serve_http, serve_unix
+        merger = PortfolioMerger(args.target, args.fund_info, cache_dir=args.cache_dir, workers=args.workers,
+                             use_mmap=args.mmap, price_policy=price_policy, **fx_options)
+        if args.serve_unix:
+            serve_unix(merger, args.serve_unix)
+        else:
+            host, _, port = args.serve.rpartition(':')
+            serve_http(merger, host or '127.0.0.1', int(port))
+        exit(0)
+
+    # Manifest mode: merge many households sharing the fund info and common targets
+    if args.manifest:
+        from households import load_manifest, run_households, write_summary_csv
+        try:
+            manifest = load_manifest(args.manifest, args.output_format)
+        except (ValueError, OSError) as e:
+            logging.error(f"Unable to load manifest: {e}")
+            exit(1)
+        fx = None
+        if fx_options:
+            try:
+                fx = load_fx_converter(reference_cache=aReferenceCache(args.cache_dir) if args.cache_dir else None,
+                                       **fx_options)
+            except (ValueError, OSError) as e:
+                logging.error(f"Unable to load FX rates: {e}")
+                exit(1)
+        metrics = aMetrics()
+        jobs = run_households(manifest, cache_dir=args.cache_dir, cpu_workers=args.workers,
+                              io_workers=args.io_workers, metrics=metrics, fx=fx, price_policy=price_policy)
+        for job in jobs:
+            if job.holdings is not None:
+                logging.warning(f"[{job.name}] Total Portfolio Value: ${job.holdings.totalValue:,.2f} "
+                                f"({job.report.summary()})")
+        summary_file = args.summary or manifest.summary_file
+        logging.info(f"Writing household summary to file: {summary_file}")
+        write_summary_csv(jobs, summary_file)
+        metrics.log_summary()
+        if args.metrics:
+            logging.info(f"Writing metrics to file: {args.metrics}")
+            if args.metrics_format == 'prometheus':
+                metrics.write_prometheus(args.metrics)
+            else:
+                metrics.write_json(args.metrics)
+        # The other households are written even when one fails
+        exit(1 if any(job.holdings is None for job in jobs) else 0)
 
     # Load share infos from named account files
-    if not any([args.ibkr, args.cs, args.ira]):
-        logging.error("No files provided. Use --ibkr, --cs, and/or --ira to specify input files.")
+    if not any([args.ibkr, args.cs, args.ira, args.batch]):
+        logging.error("No files provided. Use --ibkr, --cs, --ira and/or --batch to specify input files.")
         exit(1)
 
-    if args.ibkr:
-        logging.info(f"Loading IBKR file: {args.ibkr}")
-        aTempShares = []
-        loadSharesIBKR(aTempShares, args.ibkr)
-        shares_by_account['ibkr'] = {s.symbol: s for s in aTempShares}
-        aTotalShares = merge_lists(aTotalShares, aTempShares, merge_objects)
-        logging.info(f"Total shares after merging IBKR file: {len(aTotalShares)}")
-
-    if args.cs:
-        logging.info(f"Loading CS file: {args.cs}")
-        aTempShares = []
-        loadSharesCs(aTempShares, args.cs)
-        shares_by_account['cs'] = {s.symbol: s for s in aTempShares}
-        aTotalShares = merge_lists(aTotalShares, aTempShares, merge_objects)
-        logging.info(f"Total shares after merging CS file: {len(aTotalShares)}")
-
-    if args.ira:
-        logging.info(f"Loading IRA file: {args.ira}")
-        aTempShares = []
-        loadSharesCs(aTempShares, args.ira)
-        shares_by_account['ira'] = {s.symbol: s for s in aTempShares}
-        aTotalShares = merge_lists(aTotalShares, aTempShares, merge_objects)
-        logging.info(f"Total shares after merging IRA file: {len(aTotalShares)}")
-
-    # Determine which target field to use based on which accounts were provided
-    accounts_provided = [a for a in ['ibkr', 'cs', 'ira'] if getattr(args, a)]
-    if len(accounts_provided) == 1:
-        target_field = f'target_{accounts_provided[0]}'
-    else:
-        target_field = 'target_global'
-
-    # Load targets
-    logging.info(f"Using target file: {args.target}, target field: {target_field}")
-    targets = load_targets(args.target)
-    # Fall back to 'target' if the resolved field is not present in the file (old format)
-    sample = next(iter(targets.values()), {})
-    if target_field not in sample and 'target' in sample:
-        logging.info(f"Field '{target_field}' not found in targets file, falling back to 'target'")
-        target_field = 'target'
-    validate_targets_sum(targets, target_field, account_label='global')
-
-    # Validate per-account allocations
-    for account in ['ibkr', 'cs', 'ira']:
-        acct_field = f'target_{account}'
-        sample_acct = next(iter(targets.values()), {})
-        if acct_field in sample_acct:
-            validate_targets_sum(targets, acct_field, account_label=account.upper())
-
-    # Load fund info (descriptions)
-    logging.info(f"Using fund info file: {args.fund_info}")
-    fund_info = load_fund_info(args.fund_info)
-    
-    # Calculate total and per-account portfolio values
-    logging.info("Calculating portfolio values")
-    total_portfolio_value = 0.0
-    for aShare in aTotalShares:
-        total_portfolio_value += aShare.nbShares * aShare.sharePrice
+    batch_files = []
+    if args.batch:
+        batch_files = expand_batch_inputs(args.batch)
+        logging.info(f"Found {len(batch_files)} batch file(s) for: {args.batch}")
+        if not batch_files:
+            logging.error(f"No files found for batch input: {args.batch}")
+            exit(1)
 
-    portfolio_value_by_account = {}
-    for account in ['ibkr', 'cs', 'ira']:
-        portfolio_value_by_account[account] = sum(
-            s.nbShares * s.sharePrice for s in shares_by_account[account].values()
-        )
+    if args.async_pipeline:
+        # The holdings are written by the pipeline, overlapped with the other stages
+        from asyncPipeline import aPipelineJob, merge_async
+        sources = [(account, filename) for account, filename in (('ibkr', args.ibkr), ('cs', args.cs), ('ira', args.ira))
+                   if filename is not None] + [(None, filename) for filename in batch_files]
+        logging.info(f"Writing positions to file: {args.output}")
+        job = aPipelineJob('main', sources, args.output, args.output_format)
+        fx = None
+        if fx_options:
+            try:
+                fx = load_fx_converter(reference_cache=aReferenceCache(args.cache_dir) if args.cache_dir else None,
+                                       **fx_options)
+            except (ValueError, OSError) as e:
+                logging.error(f"Unable to load FX rates: {e}")
+                exit(1)
+        merge_async([job], targets_file=args.target, fund_info_file=args.fund_info, cache_dir=args.cache_dir,
+                    cpu_workers=args.workers, io_workers=args.io_workers, fx=fx, price_policy=price_policy)
+        if job.holdings is None:
+            report_validation(job.report, args.validation_report)
+            exit(1)
+        merger, holdings = job.merger, job.holdings
+    else:
+        try:
+            merger = PortfolioMerger(args.target, args.fund_info, cache_dir=args.cache_dir, workers=args.workers,
+                                     use_mmap=args.mmap, price_policy=price_policy, **fx_options)
+            holdings = merger.merge(ibkr=args.ibkr, cs=args.cs, ira=args.ira, batch_files=batch_files,
+                                    metrics=merger.metrics)
+        except PriceConflictException as e:
+            # All the conflicts are reported at once, instead of only the first one
+            logging.error(str(e))
+            report_validation(e.report, args.validation_report)
+            exit(1)
+        except (ValueError, OSError) as e:
+            # Currencies that cannot be compared or converted, unreadable files, ...
+            logging.error(f"Merge failed: {e}")
+            exit(1)
+    report_validation(holdings.report, args.validation_report)
 
-    logging.warning(f"Total Portfolio Value: ${total_portfolio_value:,.2f}")
+    logging.warning(f"Total Portfolio Value: ${holdings.totalValue:,.2f}")
     for account in ['ibkr', 'cs', 'ira']:
-        logging.warning(f"  {account.upper()} Portfolio Value: ${portfolio_value_by_account[account]:,.2f}")
+        logging.warning(f"  {account.upper()} Portfolio Value: ${holdings.valueByAccount[account]:,.2f}")
 
     # Write positions to file with allocation percentages
-    logging.info(f"Writing positions to file: {args.output}")
-    with open(args.output, 'w', newline='') as file2:
-        writer = csv.writer(file2)
-        field = [
-            "ticker", "description", "sec_yield_30d", "ttm_yield",
-            "nbShares", "nbShares_ibkr", "nbShares_cs", "nbShares_ira",
-            "price",
-            "currentAllocation", "currentAllocation_ibkr", "currentAllocation_cs", "currentAllocation_ira",
-            "target_global", "target_ibkr", "target_cs", "target_ira",
-            "sharesToTarget_ibkr", "sharesToTarget_cs", "sharesToTarget_ira"
-        ]
+    if not args.async_pipeline:
+        logging.info(f"Writing positions to file: {args.output}")
+        with merger.metrics.stage('write') as aStage:
+            write_holdings(holdings, args.output, args.output_format)
+            aStage.rows += len(holdings.rows)
 
-        writer.writerow(field)
-        for aShare in aTotalShares:
-            target_obj = targets.get(aShare.symbol, {})
-            fund_obj = fund_info.get(aShare.symbol, {})
-            description_value = fund_obj.get('description', '') if fund_obj else ''
-            sec_yield_30d_value = (fund_obj.get('sec_yield_30d', '') or '').replace('%', '') if fund_obj else ''
-            ttm_yield_value = (fund_obj.get('ttm_yield', '') or '').replace('%', '') if fund_obj else ''
-
-            # Total allocation
-            holding_value = aShare.nbShares * aShare.sharePrice
-            current_allocation = (holding_value / total_portfolio_value * 100) if total_portfolio_value > 0 else 0
-
-            # Per-account data
-            nb_by_acct = {}
-            alloc_by_acct = {}
-            shares_to_target_by_acct = {}
-            for account in ['ibkr', 'cs', 'ira']:
-                acct_share = shares_by_account[account].get(aShare.symbol)
-                nb = acct_share.nbShares if acct_share else 0
-                nb_by_acct[account] = nb
-                acct_value = nb * aShare.sharePrice
-                acct_total = portfolio_value_by_account[account]
-                alloc_by_acct[account] = f"{(acct_value / acct_total * 100):.2f}" if acct_total > 0 else '0.00'
-                acct_target = target_obj.get(f'target_{account}', '') if target_obj else ''
-                if acct_target != '' and aShare.sharePrice > 0:
-                    target_dollars = (float(acct_target) / 100) * acct_total
-                    shares_needed = (target_dollars - acct_value) / aShare.sharePrice
-                    shares_to_target_by_acct[account] = f"{shares_needed:.0f}"
-                else:
-                    shares_to_target_by_acct[account] = ''
-
-            target_global = target_obj.get('target_global', target_obj.get('target', '')) if target_obj else ''
-            target_ibkr   = target_obj.get('target_ibkr', '') if target_obj else ''
-            target_cs     = target_obj.get('target_cs', '') if target_obj else ''
-            target_ira    = target_obj.get('target_ira', '') if target_obj else ''
-
-            if target_global == '':
-                logging.error(f"Missing target for stock: {aShare.symbol}")
-
-            writer.writerow([
-                aShare.symbol, description_value, sec_yield_30d_value, ttm_yield_value,
-                aShare.nbShares, nb_by_acct['ibkr'], nb_by_acct['cs'], nb_by_acct['ira'],
-                aShare.sharePrice,
-                f"{current_allocation:.2f}", alloc_by_acct['ibkr'], alloc_by_acct['cs'], alloc_by_acct['ira'],
-                target_global, target_ibkr, target_cs, target_ira,
-                shares_to_target_by_acct['ibkr'], shares_to_target_by_acct['cs'], shares_to_target_by_acct['ira']
-            ])
+    if args.snapshot_db:
+        from snapshotStore import aSnapshotStore
+        with merger.metrics.stage('snapshot') as aStage, aSnapshotStore(args.snapshot_db) as store:
+            store.record(holdings, merger.targets, args.snapshot_date, args.snapshot_label)
+            aStage.rows += len(holdings.rows)
+
+    if args.scenarios:
+        try:
+            scenarios = load_scenarios(args.scenarios)
+        except (ValueError, OSError) as e:
+            logging.error(f"Unable to load scenarios: {e}")
+            exit(1)
+        if scenarios:
+            batch = merger.run_scenarios(holdings, scenarios)
+            for s, aScenario in enumerate(scenarios):
+                logging.info(f"  Scenario {aScenario.name}: Total Portfolio Value ${batch.totalValue[s]:,.2f}")
+            logging.info(f"Writing {len(scenarios)} scenario(s) to file: {args.scenarios_output}")
+            write_scenarios_csv(batch, scenarios, args.scenarios_output)
+        else:
+            logging.error(f"No scenario found in {args.scenarios}")
+
+    if args.tax_lots:
+        from taxLots import load_lots_csv, load_specific_lots, holdings_sales, realize_sales, write_tax_csv
+        try:
+            with merger.metrics.stage('tax_lots') as aStage:
+                store = load_lots_csv(args.tax_lots)
+                specific_lots = load_specific_lots(args.specific_lots) if args.specific_lots else None
+                realizations = realize_sales(store, holdings_sales(holdings), args.tax_date, args.lot_method,
+                                             specific_lots)
+                aStage.rows += len(store)
+        except (ValueError, OSError) as e:
+            logging.error(f"Computing the tax impact failed: {e}")
+            exit(1)
+        logging.warning(f"Realized gain of the {len(realizations)} sale(s) to target ({args.lot_method}): "
+                        f"${sum(aResult.realizedGain for aResult in realizations):,.2f}")
+        logging.info(f"Writing tax impact to file: {args.tax_output}")
+        write_tax_csv(realizations, args.tax_output)
+
+    if args.rebalance:
+        try:
+            cashByAccount = parse_cash(args.cash)
+        except ValueError as e:
+            logging.error(f"Invalid --cash option: {e}")
+            exit(1)
+        plan = merger.rebalance(holdings, cashByAccount, args.min_trade, args.rebalance)
+        logging.warning(f"Rebalancing ({plan.mode}): {len(plan.trades)} trade(s), squared tracking error "
+                        f"{plan.objectiveBefore:.6f} -> {plan.objectiveAfter:.6f}")
+        for account, cash in plan.cashByAccount.items():
+            logging.info(f"  {account.upper()} cash left after trades: ${cash:,.2f}")
+        logging.info(f"Writing trade list to file: {args.rebalance_output}")
+        write_rebalance_csv(plan, args.rebalance_output)
+
+    merger.metrics.log_summary()
+    if args.metrics:
+        logging.info(f"Writing metrics to file: {args.metrics}")
+        if args.metrics_format == 'prometheus':
+            merger.metrics.write_prometheus(args.metrics)
+        else:
+            merger.metrics.write_json(args.metrics)
     
-    print(f"\nTotal Portfolio Value: ${total_portfolio_value:,.2f}")
+    print(f"\nTotal Portfolio Value: ${holdings.totalValue:,.2f}")
@@ -0,0 +1,417 @@
+import os
+import csv
+import math
+import heapq
+import logging
+import argparse
+from contextlib import closing
+from datetime import datetime
+from mainBrokers import setup_logging, load_single_stocks
+from brokerAdapters import isItEmptyLine, ROW_OPTION, ROW_SINGLE_STOCK, ROW_EMPTY, ROW_INVALID, ROW_LAYOUT
+from symbolClassifier import classify_symbol, SYMBOL_PROPER, SYMBOL_INVALID
+
+# Trade row status codes, shared with the position row codes of brokerAdapters.py
+ROW_TRADE = SYMBOL_PROPER
+# Rows outside the trades of the export (section headers, totals, other record types)
+ROW_OTHER = ROW_LAYOUT
+ROW_STATUS_NAMES = ('trade', 'option', 'single_stock', 'empty', 'invalid', 'other')
+
+# Schwab actions counted as trades, with their direction; other actions (dividends,
+# interest, journals, ...) are counted as 'other'
+CS_BUY_ACTIONS = frozenset(['buy', 'reinvest shares', 'buy to open', 'buy to close'])
+CS_SELL_ACTIONS = frozenset(['sell', 'sell short', 'sell to open', 'sell to close'])
+
+# Candidate header names of each IBKR field (activity statement and flex query exports)
+IBKR_COLUMNS = {
+    'symbol': ('Symbol',),
+    'date': ('Date/Time', 'DateTime', 'TradeDate', 'Trade Date', 'Date'),
+    'quantity': ('Quantity',),
+    'price': ('T. Price', 'TradePrice', 'Trade Price', 'Price'),
+    'fees': ('Comm/Fee', 'IBCommission', 'Commission', 'Comm in USD'),
+    'asset': ('Asset Category', 'AssetClass'),
+    'discriminator': ('DataDiscriminator',),
+}
+
+CS_COLUMNS = {
+    'date': ('Date',),
+    'action': ('Action',),
+    'symbol': ('Symbol',),
+    'quantity': ('Quantity',),
+    'price': ('Price',),
+    'fees': ('Fees & Comm',),
+}
+
+TRADE_FIELDS = ["date", "broker", "source", "symbol", "action", "quantity", "price", "fees", "amount"]
+SUMMARY_FIELDS = ["symbol", "position", "avgCost", "costBasis", "realizedPnL", "fees", "nbTrades",
+                  "firstTrade", "lastTrade"]
+
+_DATE_FORMATS = ('%Y-%m-%d, %H:%M:%S', '%Y-%m-%d %H:%M:%S', '%Y%m%d;%H%M%S', '%Y-%m-%d', '%Y%m%d',
+                 '%m/%d/%Y', '%m/%d/%Y %H:%M:%S')
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Merge trade histories from multiple brokers.')
+    parser.add_argument('--ibkr-file', nargs='+', default=[],
+                      help='Interactive Brokers trades CSV file(s), sorted by date')
+    parser.add_argument('--cs-file', nargs='+', default=[],
+                      help='Charles Schwab transactions CSV file(s), sorted by date (newest first or oldest first)')
+    parser.add_argument('--output', default='all_trades.csv',
+                      help='Merged trades output file (default: all_trades.csv)')
+    parser.add_argument('--summary', default='trades_summary.csv',
+                      help='Per-symbol position, cost basis and realized P&L output file (default: trades_summary.csv)')
+    parser.add_argument('--single-stocks', type=str, default='single_stocks.json',
+                      help='JSON list of single stocks excluded from the merge (default: single_stocks.json)')
+    parser.add_argument('--debug', action='store_true',
+                      help='Enable debug logging level')
+    return parser.parse_args()
+
+class aTrade:
+    """One fill: signed quantity (positive buys, negative sells), unit price and fees (positive)"""
+    __slots__ = ('date', 'broker', 'source', 'symbol', 'quantity', 'price', 'fees')
+
+    def __init__(self, date, broker, source, symbol, quantity, price, fees):
+        self.date = date
+        self.broker = broker
+        self.source = source
+        self.symbol = symbol
+        self.quantity = quantity
+        self.price = price
+        self.fees = fees
+
+    @property
+    def action(self):
+        return 'BUY' if self.quantity > 0 else 'SELL'
+
+    @property
+    def amount(self):
+        """Cash flow of the fill: negative for buys, positive for sells, net of fees"""
+        return -self.quantity * self.price - self.fees
+
+    def as_row(self):
+        return [self.date, self.broker, self.source, self.symbol, self.action, f"{abs(self.quantity):g}",
+                self.price, self.fees, f"{self.amount:.2f}"]
+
+def parse_trade_date(aText):
+    """
+    Normalize a broker date to a sortable ISO string ('YYYY-MM-DD' or 'YYYY-MM-DD HH:MM:SS').
+
+    Schwab dates such as '01/05/2026 as of 01/02/2026' use the first date.
+
+    Raises:
+        ValueError: If the text is not a known date format
+    """
+    aText = aText.strip().strip('"').split(' as of ')[0].strip()
+    for aFormat in _DATE_FORMATS:
+        try:
+            aDate = datetime.strptime(aText, aFormat)
+        except ValueError:
+            continue
+        return aDate.strftime('%Y-%m-%d %H:%M:%S' if '%H' in aFormat else '%Y-%m-%d')
+    raise ValueError(f"Unknown date format: {aText}")
+
+def parse_amount(aText):
+    """Parse a broker amount such as '$1,103.00', '-$5.00' or '(5.00)'; empty text is 0"""
+    aText = aText.strip().replace('$', '').replace(',', '')
+    if aText.startswith('(') and aText.endswith(')'):
+        aText = '-' + aText[1:-1]
+    return float(aText) if aText not in ('', '--') else 0.0
+
+def _column_indexes(header, columns):
+    """Map each field of columns to the index of its first candidate name present in header"""
+    aNames = [name.strip() for name in header]
+    indexes = {}
+    for field, candidates in columns.items():
+        for candidate in candidates:
+            if candidate in aNames:
+                indexes[field] = aNames.index(candidate)
+                break
+    return indexes
+
+def _symbol_status(aSymbol):
+    aStatus = classify_symbol(aSymbol)
+    # Option tickers of other formats (e.g. IBKR "SPY 20JAN26 550 P") are not proper symbols either
+    return ROW_OPTION if aStatus == SYMBOL_INVALID and ' ' in aSymbol.strip() else aStatus
+
+def classifyTradeCs(aLine, indexes):
+    """
+    Classify and parse a Schwab transaction row without raising.
+
+    Returns:
+        Tuple (status, (date, symbol, signed quantity, price, fees) or None)
+    """
+    if isItEmptyLine(aLine):
+        return ROW_EMPTY, None
+    try:
+        aAction = aLine[indexes['action']].strip().lower()
+        if aAction not in CS_BUY_ACTIONS and aAction not in CS_SELL_ACTIONS:
+            return ROW_OTHER, None
+        aSymbol = aLine[indexes['symbol']].strip()
+        aStatus = _symbol_status(aSymbol)
+        if aStatus != ROW_TRADE:
+            return aStatus, None
+        aQuantity = abs(parse_amount(aLine[indexes['quantity']]))
+        if aAction in CS_SELL_ACTIONS:
+            aQuantity = -aQuantity
+        aFees = abs(parse_amount(aLine[indexes['fees']])) if 'fees' in indexes else 0.0
+        return ROW_TRADE, (parse_trade_date(aLine[indexes['date']]), aSymbol, aQuantity,
+                           parse_amount(aLine[indexes['price']]), aFees)
+    except (IndexError, KeyError, ValueError):
+        return ROW_INVALID, None
+
+def classifyTradeIBKR(aLine, indexes):
+    """
+    Classify and parse an IBKR trade row (activity statement rows without their
+    'Trades,Data' prefix) without raising.
+
+    Returns:
+        Tuple (status, (date, symbol, signed quantity, price, fees) or None)
+    """
+    if isItEmptyLine(aLine):
+        return ROW_EMPTY, None
+    try:
+        if 'discriminator' in indexes and aLine[indexes['discriminator']].strip() not in ('Order', 'Trade'):
+            return ROW_OTHER, None
+        if 'asset' in indexes and 'option' in aLine[indexes['asset']].lower():
+            return ROW_OPTION, None
+        aSymbol = aLine[indexes['symbol']].strip()
+        aStatus = _symbol_status(aSymbol)
+        if aStatus != ROW_TRADE:
+            return aStatus, None
+        aFees = abs(parse_amount(aLine[indexes['fees']])) if 'fees' in indexes else 0.0
+        return ROW_TRADE, (parse_trade_date(aLine[indexes['date']]), aSymbol,
+                           parse_amount(aLine[indexes['quantity']]), parse_amount(aLine[indexes['price']]), aFees)
+    except (IndexError, KeyError, ValueError):
+        return ROW_INVALID, None
+
+def _read_header(f, columns, is_header):
+    """Read rows until the header, returning (header row, its column indexes, offset after it)"""
+    while True:
+        aLine = f.readline()
+        if not aLine:
+            raise ValueError(f"No trade header found in {f.name}")
+        row = next(csv.reader([aLine]), [])
+        if is_header(row):
+            return row, _column_indexes(row, columns), f.tell()
+
+def iter_lines_reversed(filename, start_offset=0, chunk_size=1 << 16):
+    """
+    Yield the lines of a file from the last one back to start_offset, reading fixed-size
+    chunks from the end so the file is never loaded at once.
+    """
+    with open(filename, 'rb') as f:
+        position = f.seek(0, os.SEEK_END)
+        aRemainder = b''
+        while position > start_offset:
+            size = min(chunk_size, position - start_offset)
+            position -= size
+            f.seek(position)
+            aLines = (f.read(size) + aRemainder).split(b'\n')
+            aRemainder = aLines.pop(0)
+            for aLine in reversed(aLines):
+                if aLine.strip():
+                    yield aLine.decode('utf-8-sig').rstrip('\r')
+        if aRemainder.strip():
+            yield aRemainder.decode('utf-8-sig').rstrip('\r')
+
+class aTradeSource:
+    """
+    A broker trade file read as a stream of aTrade in ascending date order.
+
+    Files sorted newest first (Schwab exports) are detected from their first and last trades
+    and read backwards.
+    """
+    def __init__(self, filename, broker):
+        self.filename = filename
+        self.broker = broker
+        if broker == 'cs':
+            self.columns, self.classify = CS_COLUMNS, classifyTradeCs
+            self.is_header = lambda row: 'Action' in row and 'Symbol' in row and 'Date' in row
+        else:
+            self.columns, self.classify = IBKR_COLUMNS, classifyTradeIBKR
+            self.is_header = lambda row: 'Symbol' in row and 'Quantity' in row
+        self.counts = [0] * len(ROW_STATUS_NAMES)
+        # True for activity statements, whose rows start with their section name
+        self.sectioned = False
+
+    @staticmethod
+    def _strip_section(row):
+        # Activity statements prefix every row with the section name and row kind
+        return row[2:] if len(row) > 2 and row[0] == 'Trades' and row[1] in ('Header', 'Data') else row
+
+    def _is_trade_header(self, row):
+        # Other sections of an activity statement (Open Positions, ...) also have Symbol and Quantity columns
+        if len(row) > 2 and row[1] == 'Header' and row[0] != 'Trades':
+            return False
+        return self.is_header(self._strip_section(row))
+
+    def _rows(self, lines, indexes):
+        for row in csv.reader(lines):
+            if self.sectioned and row and row[0] != 'Trades':
+                yield ROW_OTHER, None
+            else:
+                yield self.classify(self._strip_section(row), indexes)
+
+    def _first_date(self, lines, indexes):
+        for aStatus, aFill in self._rows(lines, indexes):
+            if aStatus == ROW_TRADE:
+                return aFill[0]
+        return None
+
+    def __iter__(self):
+        source = os.path.basename(self.filename)
+        with open(self.filename, 'r', newline='', encoding='utf-8-sig') as f:
+            header, _, data_offset = _read_header(f, self.columns, self._is_trade_header)
+            self.sectioned = header[0] == 'Trades'
+            indexes = _column_indexes(self._strip_section(header), self.columns)
+            first = self._first_date(f, indexes)
+            # The backward reader stops at the first trade, its file is closed right away
+            with closing(iter_lines_reversed(self.filename, data_offset)) as aLines:
+                last = self._first_date(aLines, indexes)
+            if first is not None and last is not None and first > last:
+                logging.info(f"{self.filename} is sorted newest first, reading it backwards")
+                lines = iter_lines_reversed(self.filename, data_offset)
+            else:
+                f.seek(data_offset)
+                lines = f
+            previous = ''
+            for aStatus, aFill in self._rows(lines, indexes):
+                self.counts[aStatus] += 1
+                if aStatus == ROW_INVALID:
+                    logging.error("Invalid trade row in %s", self.filename)
+                if aStatus != ROW_TRADE:
+                    continue
+                if aFill[0] < previous:
+                    raise ValueError(f"{self.filename} is not sorted by date ({aFill[0]} after {previous})")
+                previous = aFill[0]
+                yield aTrade(aFill[0], self.broker, source, *aFill[1:])
+        logging.info("%s trades file %s: %s", self.broker.upper(), self.filename, ", ".join(
+            f"{aCount} {ROW_STATUS_NAMES[aStatus]}" for aStatus, aCount in enumerate(self.counts)))
+
+def merge_trade_sources(sources):
+    """
+    K-way merge of date-sorted trade streams into one date-sorted stream.
+
+    Only one pending trade per source is held in memory; trades of the same date keep the
+    order of the sources.
+
+    Args:
+        sources: Iterables of aTrade sorted by date (e.g. aTradeSource)
+
+    Yields:
+        aTrade objects in ascending date order
+    """
+    return heapq.merge(*sources, key=lambda aTrade: aTrade.date)
+
+class aSymbolBook:
+    """Running position, cost basis (average cost) and realized P&L of one symbol"""
+    __slots__ = ('symbol', 'position', 'costBasis', 'realizedPnL', 'fees', 'nbTrades', 'firstTrade', 'lastTrade')
+
+    def __init__(self, symbol):
+        self.symbol = symbol
+        self.position = 0.0
+        # Signed cost of the open position: positive when long, negative when short
+        self.costBasis = 0.0
+        self.realizedPnL = 0.0
+        self.fees = 0.0
+        self.nbTrades = 0
+        self.firstTrade = None
+        self.lastTrade = None
+
+    @property
+    def avgCost(self):
+        return self.costBasis / self.position if self.position else 0.0
+
+    def add_trade(self, aTrade):
+        """
+        Apply a fill. The part closing the open position realizes its gain against the
+        average cost; the rest opens (or extends) a position, fees being split pro rata.
+        """
+        quantity = aTrade.quantity
+        if not quantity:
+            return
+        self.nbTrades += 1
+        self.fees += aTrade.fees
+        self.firstTrade = self.firstTrade or aTrade.date
+        self.lastTrade = aTrade.date
+        closing = 0.0
+        if self.position and (self.position > 0) != (quantity > 0):
+            closing = math.copysign(min(abs(self.position), abs(quantity)), quantity)
+        opening = quantity - closing
+        closingFees = aTrade.fees * closing / quantity
+        if closing:
+            avgCost = self.avgCost
+            self.realizedPnL += -closing * (aTrade.price - avgCost) - closingFees
+            self.costBasis += closing * avgCost
+            self.position += closing
+        if opening:
+            self.position += opening
+            self.costBasis += opening * aTrade.price + (aTrade.fees - closingFees)
+        if abs(self.position) < 1e-9:
+            self.position = 0.0
+            self.costBasis = 0.0
+
+    def as_row(self):
+        return [self.symbol, f"{self.position:g}", f"{self.avgCost:.4f}", f"{self.costBasis:.2f}",
+                f"{self.realizedPnL:.2f}", f"{self.fees:.2f}", self.nbTrades, self.firstTrade, self.lastTrade]
+
+def process_trades(iTrades, books=None, writer=None):
+    """
+    Aggregate a stream of trades per symbol, optionally writing each trade as it passes.
+
+    Args:
+        iTrades: Iterable of aTrade in date order
+        books: Optional dictionary of symbol to aSymbolBook to update
+        writer: Optional csv writer receiving one TRADE_FIELDS row per trade
+
+    Returns:
+        Dictionary mapping symbol to aSymbolBook
+    """
+    if books is None:
+        books = {}
+    for aTrade in iTrades:
+        aBook = books.get(aTrade.symbol)
+        if aBook is None:
+            aBook = aSymbolBook(aTrade.symbol)
+            books[aTrade.symbol] = aBook
+        aBook.add_trade(aTrade)
+        if writer is not None:
+            writer.writerow(aTrade.as_row())
+    return books
+
+def write_summary_csv(books, output_file):
+    """Write the per-symbol position, cost basis and realized P&L to a CSV file"""
+    with open(output_file, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(SUMMARY_FIELDS)
+        writer.writerows(books[aSymbol].as_row() for aSymbol in sorted(books))
+
+if __name__ == "__main__":
+    args = parse_arguments()
+
+    setup_logging(debug=args.debug)
+    logging.info("Starting mainTrades - Merging trades from CS and IBKR")
+
+    load_single_stocks(args.single_stocks)
+
+    if not args.ibkr_file and not args.cs_file:
+        logging.error("No files provided. Use --ibkr-file and/or --cs-file to specify input files.")
+        exit(1)
+
+    sources = [aTradeSource(filename, 'ibkr') for filename in args.ibkr_file]
+    sources += [aTradeSource(filename, 'cs') for filename in args.cs_file]
+
+    logging.info(f"Writing merged trades to file: {args.output}")
+    try:
+        with open(args.output, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(TRADE_FIELDS)
+            books = process_trades(merge_trade_sources(sources), writer=writer)
+    except (ValueError, OSError) as e:
+        logging.error(f"Unable to merge trades: {e}")
+        exit(1)
+
+    logging.info(f"Writing trade summary to file: {args.summary}")
+    write_summary_csv(books, args.summary)
+
+    totalRealized = sum(aBook.realizedPnL for aBook in books.values())
+    print(f"\nMerged {sum(aBook.nbTrades for aBook in books.values())} trades on {len(books)} symbols")
+    print(f"Total Realized P&L: ${totalRealized:,.2f}")
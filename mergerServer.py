@@ -0,0 +1,125 @@
+import io
+import os
+import json
+import logging
+import socketserver
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from validation import PriceConflictException
+
+# Request fields: each account accepts a file path ("ibkr") or the CSV content itself ("ibkr_csv")
+ACCOUNT_FIELDS = ('ibkr', 'cs', 'ira')
+
+def parse_merge_request(request):
+    """
+    Check a merge request body and extract its sources.
+
+    Returns:
+        Tuple (sources by account, batch files)
+
+    Raises:
+        ValueError: If the body is not an object, a field has the wrong type or there is no position
+    """
+    if not isinstance(request, dict):
+        raise ValueError("The request body must be a JSON object")
+    sources = {}
+    for account in ACCOUNT_FIELDS:
+        for field in (f'{account}_csv', account):
+            if request.get(field) is not None and not isinstance(request[field], str):
+                raise ValueError(f"Field {field} must be a string")
+        if request.get(f'{account}_csv') is not None:
+            sources[account] = io.StringIO(request[f'{account}_csv'], newline='')
+        elif request.get(account) is not None:
+            sources[account] = request[account]
+    batch_files = request.get('batch_files') or []
+    if not isinstance(batch_files, list) or not all(isinstance(filename, str) for filename in batch_files):
+        raise ValueError("Field batch_files must be a list of file paths")
+    if not sources and not batch_files:
+        raise ValueError("No positions provided")
+    return sources, batch_files
+
+class MergerRequestHandler(BaseHTTPRequestHandler):
+    """
+    HTTP interface of a PortfolioMerger.
+
+    GET  /health  -> {"status": "ok"}
+    POST /merge   -> body {"ibkr": path, "cs_csv": "...", "batch_files": [...]}, answers the
+                     holdings table as {"fields", "rows", "totalValue", "valueByAccount", "validation"}
+    """
+    def address_string(self):
+        # Unix socket clients have no address
+        return self.client_address[0] if self.client_address else 'unix'
+
+    def log_message(self, format, *args):
+        logging.info("%s - %s", self.address_string(), format % args)
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == '/health':
+            self._send_json(200, {'status': 'ok'})
+        else:
+            self._send_json(404, {'error': f"Unknown path: {self.path}"})
+
+    def do_POST(self):
+        if self.path != '/merge':
+            self._send_json(404, {'error': f"Unknown path: {self.path}"})
+            return
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            sources, batch_files = parse_merge_request(json.loads(self.rfile.read(length) or b'{}'))
+            holdings = self.server.merger.merge(batch_files=batch_files, **sources)
+        except (ValueError, OSError) as e:
+            logging.error(f"Merge request failed: {e}")
+            aResponse = {'error': str(e)}
+            if isinstance(e, PriceConflictException):
+                aResponse['validation'] = e.report.as_dicts()
+            self._send_json(400, aResponse)
+            return
+        except Exception as e:
+            # Answer anyway, the client would otherwise only see a closed connection
+            logging.exception("Merge request failed")
+            self._send_json(500, {'error': f"Internal error: {e}"})
+            return
+        self._send_json(200, {
+            'fields': holdings.fields,
+            'rows': holdings.rows,
+            'totalValue': holdings.totalValue,
+            'valueByAccount': holdings.valueByAccount,
+            'validation': holdings.report.as_dicts(),
+        })
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+def serve_http(merger, host='127.0.0.1', port=8765):
+    """Serve merge requests over HTTP until interrupted"""
+    server = ThreadingHTTPServer((host, port), MergerRequestHandler)
+    server.merger = merger
+    logging.warning(f"PortfolioMerger server listening on http://{host}:{server.server_address[1]}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+def serve_unix(merger, socket_path):
+    """Serve merge requests over HTTP on a Unix socket until interrupted"""
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+    server = ThreadingUnixHTTPServer(socket_path, MergerRequestHandler)
+    server.merger = merger
+    logging.warning(f"PortfolioMerger server listening on unix socket {socket_path}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.remove(socket_path)
@@ -0,0 +1,252 @@
+import logging
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional, the pure Python path gives the same results
+    np = None
+
+ACCOUNTS = ('ibkr', 'cs', 'ira')
+
+def has_numpy():
+    return np is not None
+
+def _target_value(target_obj, field):
+    aValue = target_obj.get(field, '') if target_obj else ''
+    return None if aValue == '' else float(aValue)
+
+class aValuationColumns:
+    """
+    Columnar view of a consolidated portfolio aligned on a symbol index.
+
+    Holds shares, prices, per-account quantities and per-account targets as NumPy arrays
+    (plain lists when NumPy is not installed) so allocations can be recomputed in batch.
+    """
+    def __init__(self, symbols, nbShares, prices, nbSharesByAccount, targetsByAccount, accounts=ACCOUNTS):
+        self.symbols = symbols
+        self.index = {aSymbol: i for i, aSymbol in enumerate(symbols)}
+        self.accounts = tuple(accounts)
+        self.nbShares = nbShares
+        self.prices = prices
+        # One row per account, one column per symbol
+        self.nbSharesByAccount = nbSharesByAccount
+        # Target percentage per account and symbol, NaN (None without NumPy) when there is no target
+        self.targetsByAccount = targetsByAccount
+
+def build_valuation_columns(iShares, targets, accounts=ACCOUNTS):
+    """
+    Build the valuation columns of a list of consolidated shares.
+
+    Args:
+        iShares: Iterable of consolidated aShare objects (with nbSharesByAccount)
+        targets: Dictionary mapping stock symbols to target objects
+        accounts: Account labels, in column order
+
+    Returns:
+        aValuationColumns
+    """
+    iShares = list(iShares)
+    symbols = [s.symbol for s in iShares]
+    nbShares = [s.nbShares for s in iShares]
+    prices = [s.sharePrice for s in iShares]
+    nbSharesByAccount = [[s.nbSharesByAccount.get(account, 0) for s in iShares] for account in accounts]
+    targetsByAccount = build_target_columns(symbols, targets, accounts)
+    if np is not None:
+        nbShares = np.array(nbShares, dtype=np.float64)
+        prices = np.array(prices, dtype=np.float64)
+        nbSharesByAccount = np.array(nbSharesByAccount, dtype=np.float64).reshape(len(accounts), len(symbols))
+    return aValuationColumns(symbols, nbShares, prices, nbSharesByAccount, targetsByAccount, accounts)
+
+def build_target_columns(symbols, targets, accounts=ACCOUNTS):
+    """
+    Build the per-account target columns of a set of targets aligned on a symbol list.
+
+    Returns:
+        One row per account, one column per symbol: NumPy array with NaN for missing targets
+        (list of lists with None without NumPy)
+    """
+    targetsByAccount = [[_target_value(targets.get(aSymbol, {}), f'target_{account}') for aSymbol in symbols]
+                        for account in accounts]
+    if np is not None:
+        targetsByAccount = np.array(targetsByAccount, dtype=np.float64).reshape(len(accounts), len(symbols))
+    return targetsByAccount
+
+class aValuation:
+    """
+    Result of a valuation: totals, allocations and shares-to-target aligned on the symbol index.
+
+    sharesToTarget holds NaN (None without NumPy) where there is no target or no price.
+    """
+    def __init__(self, columns, totalValue, accountValues, holdingValues, allocations,
+                 allocationsByAccount, sharesToTarget):
+        self.columns = columns
+        self.totalValue = totalValue
+        self.accountValues = accountValues
+        self.holdingValues = holdingValues
+        self.allocations = allocations
+        self.allocationsByAccount = allocationsByAccount
+        self.sharesToTarget = sharesToTarget
+
+    def account_value(self, account):
+        return self.accountValues[self.columns.accounts.index(account)]
+
+def _value_columns_numpy(columns, prices, accountValues, targetsByAccount):
+    holdingValues = columns.nbShares * prices
+    totalValue = float(holdingValues.sum())
+    accountHoldingValues = columns.nbSharesByAccount * prices
+    if accountValues is None:
+        accountValues = accountHoldingValues.sum(axis=1)
+    accountValues = np.asarray(accountValues, dtype=np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        if totalValue > 0:
+            allocations = holdingValues / totalValue * 100
+        else:
+            allocations = np.zeros_like(holdingValues)
+        accountTotals = accountValues[:, None]
+        allocationsByAccount = np.where(accountTotals > 0, accountHoldingValues / accountTotals * 100, 0.0)
+        targetDollars = (targetsByAccount / 100) * accountTotals
+        sharesNeeded = (targetDollars - accountHoldingValues) / prices
+        sharesToTarget = np.where(~np.isnan(targetsByAccount) & (prices > 0), sharesNeeded, np.nan)
+    return totalValue, accountValues, holdingValues, allocations, allocationsByAccount, sharesToTarget
+
+def _value_columns_python(columns, prices, accountValues, targetsByAccount):
+    holdingValues = [nb * price for nb, price in zip(columns.nbShares, prices)]
+    totalValue = sum(holdingValues)
+    accountHoldingValues = [[nb * price for nb, price in zip(row, prices)] for row in columns.nbSharesByAccount]
+    if accountValues is None:
+        accountValues = [sum(row) for row in accountHoldingValues]
+    accountValues = list(accountValues)
+    allocations = [(value / totalValue * 100) if totalValue > 0 else 0 for value in holdingValues]
+    allocationsByAccount = []
+    sharesToTarget = []
+    for accountTotal, row, targetRow in zip(accountValues, accountHoldingValues, targetsByAccount):
+        allocationsByAccount.append([(value / accountTotal * 100) if accountTotal > 0 else 0.0 for value in row])
+        sharesToTarget.append([
+            ((target / 100) * accountTotal - value) / price if target is not None and price > 0 else None
+            for value, target, price in zip(row, targetRow, prices)
+        ])
+    return totalValue, accountValues, holdingValues, allocations, allocationsByAccount, sharesToTarget
+
+def value_columns(columns, prices=None, accountValues=None):
+    """
+    Compute totals, allocations and shares-to-target for all symbols in batch.
+
+    The columns can be valued many times with different prices (what-if runs) without
+    being rebuilt.
+
+    Args:
+        columns: aValuationColumns
+        prices: Optional price column overriding columns.prices
+        accountValues: Optional value per account (in columns.accounts order); computed
+            from the quantities and prices when not given
+
+    Returns:
+        aValuation
+    """
+    if prices is None:
+        prices = columns.prices
+    if np is not None:
+        prices = np.asarray(prices, dtype=np.float64)
+        aResult = _value_columns_numpy(columns, prices, accountValues, columns.targetsByAccount)
+    else:
+        aResult = _value_columns_python(columns, list(prices), accountValues, columns.targetsByAccount)
+    return aValuation(columns, *aResult)
+
+class aValuationBatch:
+    """
+    Valuations of the same columns under many price and target sets.
+
+    Every result has a leading scenario axis: totalValue[s], accountValues[s][a],
+    allocations[s][i], allocationsByAccount[s][a][i], sharesToTarget[s][a][i].
+    """
+    def __init__(self, columns, prices, totalValue, accountValues, holdingValues, allocations,
+                 allocationsByAccount, sharesToTarget):
+        self.columns = columns
+        self.prices = prices
+        self.totalValue = totalValue
+        self.accountValues = accountValues
+        self.holdingValues = holdingValues
+        self.allocations = allocations
+        self.allocationsByAccount = allocationsByAccount
+        self.sharesToTarget = sharesToTarget
+
+    def __len__(self):
+        return len(self.totalValue)
+
+    def scenario(self, s):
+        """aValuation of one scenario"""
+        return aValuation(self.columns, self.totalValue[s], self.accountValues[s], self.holdingValues[s],
+                          self.allocations[s], self.allocationsByAccount[s], self.sharesToTarget[s])
+
+def _value_batch_numpy(columns, prices, accountValues, targetsByAccount):
+    holdingValues = prices * columns.nbShares                                # (S, N)
+    totalValue = holdingValues.sum(axis=1)                                   # (S,)
+    accountHoldingValues = prices[:, None, :] * columns.nbSharesByAccount    # (S, A, N)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        allocations = np.where(totalValue[:, None] > 0, holdingValues / totalValue[:, None] * 100, 0.0)
+        accountTotals = accountValues[:, :, None]
+        allocationsByAccount = np.where(accountTotals > 0, accountHoldingValues / accountTotals * 100, 0.0)
+        sharesNeeded = ((targetsByAccount / 100) * accountTotals - accountHoldingValues) / prices[:, None, :]
+        sharesToTarget = np.where(~np.isnan(targetsByAccount) & (prices[:, None, :] > 0), sharesNeeded, np.nan)
+    return totalValue, accountValues, holdingValues, allocations, allocationsByAccount, sharesToTarget
+
+def value_columns_batch(columns, pricesBatch, targetsBatch=None, baseAccountValues=None):
+    """
+    Compute totals, allocations and shares-to-target of many scenarios in one batched computation.
+
+    Args:
+        columns: aValuationColumns
+        pricesBatch: One price column per scenario (scenarios x symbols)
+        targetsBatch: Optional targets per scenario (scenarios x accounts x symbols, see
+            build_target_columns); columns.targetsByAccount for every scenario when not given
+        baseAccountValues: Optional value per account at columns.prices; each scenario's account
+            values are this value moved by the price changes of the account's holdings. Computed
+            from the quantities and prices when not given
+
+    Returns:
+        aValuationBatch
+    """
+    nbScenarios = len(pricesBatch)
+    if nbScenarios == 0:
+        raise ValueError("No scenario to value")
+    if np is not None:
+        prices = np.asarray(pricesBatch, dtype=np.float64).reshape(nbScenarios, len(columns.symbols))
+        if targetsBatch is None:
+            targetsByAccount = np.broadcast_to(columns.targetsByAccount,
+                                               (nbScenarios,) + np.shape(columns.targetsByAccount))
+        else:
+            targetsByAccount = np.asarray(targetsBatch, dtype=np.float64).reshape(
+                nbScenarios, len(columns.accounts), len(columns.symbols))
+        if baseAccountValues is None:
+            accountValues = prices @ columns.nbSharesByAccount.T
+        else:
+            accountValues = (np.asarray(baseAccountValues, dtype=np.float64)[None, :]
+                             + (prices - columns.prices[None, :]) @ columns.nbSharesByAccount.T)
+        aResult = _value_batch_numpy(columns, prices, accountValues, targetsByAccount)
+        return aValuationBatch(columns, prices, *aResult)
+
+    aResults = []
+    for s, prices in enumerate(pricesBatch):
+        prices = list(prices)
+        accountValues = None
+        if baseAccountValues is not None:
+            accountValues = [base + sum(nb * (price - before) for nb, price, before in zip(row, prices, columns.prices))
+                             for base, row in zip(baseAccountValues, columns.nbSharesByAccount)]
+        targetsByAccount = columns.targetsByAccount if targetsBatch is None else targetsBatch[s]
+        aResults.append(_value_columns_python(columns, prices, accountValues, targetsByAccount))
+    return aValuationBatch(columns, [list(p) for p in pricesBatch], *[list(field) for field in zip(*aResults)])
+
+def value_portfolio(iPortfolio, targets, accounts=ACCOUNTS):
+    """
+    Value a consolidated portfolio, using each account's own value as reported by its broker.
+
+    Args:
+        iPortfolio: aPortfolio
+        targets: Dictionary mapping stock symbols to target objects
+        accounts: Account labels, in column order
+
+    Returns:
+        aValuation
+    """
+    columns = build_valuation_columns(iPortfolio, targets, accounts)
+    logging.info(f"Valuing {len(columns.symbols)} symbols ({'numpy' if np is not None else 'pure python'})")
+    return value_columns(columns, accountValues=[iPortfolio.account_value(account) for account in accounts])
@@ -0,0 +1,404 @@
+import csv
+import math
+import logging
+from itertools import product
+from portfolioValuation import ACCOUNTS
+
+REBALANCE_MODES = ('greedy', 'exact')
+
+class aTrade:
+    """Whole-share trade of one symbol in one account (positive nbShares buys, negative sells)"""
+    __slots__ = ('account', 'symbol', 'nbShares', 'price')
+
+    def __init__(self, account, symbol, nbShares, price):
+        self.account = account
+        self.symbol = symbol
+        self.nbShares = nbShares
+        self.price = price
+
+    @property
+    def action(self):
+        return 'BUY' if self.nbShares > 0 else 'SELL'
+
+    @property
+    def value(self):
+        return self.nbShares * self.price
+
+    def __repr__(self):
+        return f"{self.action} {abs(self.nbShares)} {self.symbol} @ {self.price} ({self.account})"
+
+class aRebalancePlan:
+    """
+    Trade list of a rebalancing run.
+
+    objectiveBefore/objectiveAfter are the squared tracking error (sum of squared allocation
+    gaps, as fractions) to the per-account targets and the global target, without and with
+    the trades. optimal is False when the exact search stopped at its node limit.
+    """
+    def __init__(self, trades, cashByAccount, objectiveBefore, objectiveAfter, mode, optimal=True):
+        self.trades = trades
+        self.cashByAccount = cashByAccount
+        self.objectiveBefore = objectiveBefore
+        self.objectiveAfter = objectiveAfter
+        self.mode = mode
+        self.optimal = optimal
+
+    def as_rows(self):
+        return [[t.account, t.symbol, t.action, abs(t.nbShares), t.price, f"{abs(t.value):.2f}"] for t in self.trades]
+
+REBALANCE_FIELDS = ["account", "ticker", "action", "nbShares", "price", "value"]
+
+def _fraction(value):
+    """Target percentage as a fraction, None when missing (None or NaN)"""
+    if value is None or value == '':
+        return None
+    value = float(value)
+    return None if value != value else value / 100
+
+class _aSymbolProblem:
+    """Objective terms of one symbol: one term per account holding a target for it, plus the global term"""
+    __slots__ = ('symbol', 'price', 'accounts', 'held', 'values', 'targets', 'minShares',
+                 'otherValue', 'globalTarget', 'ideal')
+
+    def objective(self, problem, shares):
+        """Squared tracking error of this symbol given the traded shares of each of its accounts"""
+        total = self.otherValue
+        aObjective = 0.0
+        for a, account in enumerate(self.accounts):
+            value = self.values[a] + shares[a] * self.price
+            total += value
+            gap = value / problem.accountTotals[account] - self.targets[a]
+            aObjective += gap * gap
+        if self.globalTarget is not None:
+            gap = total / problem.total - self.globalTarget
+            aObjective += problem.globalWeight * gap * gap
+        return aObjective
+
+class _aRebalanceProblem:
+    def __init__(self, symbols, accountTotals, cashByAccount, total, globalWeight):
+        self.symbols = symbols
+        self.accountTotals = accountTotals
+        self.cashByAccount = cashByAccount
+        self.total = total
+        self.globalWeight = globalWeight
+
+def build_rebalance_problem(valuation, targets, cashByAccount=None, min_trade_value=0.0,
+                            target_field='target_global', global_weight=1.0):
+    """
+    Collect the objective terms and constraints of a rebalancing from a valuation.
+
+    An account with no per-account target at all follows the global target; otherwise a
+    symbol without a target in an account is left untouched in that account.
+
+    Args:
+        valuation: aValuation of the consolidated portfolio
+        targets: Dictionary mapping stock symbols to target objects
+        cashByAccount: Optional cash available to each account (default: none, buys are
+            funded by sells)
+        min_trade_value: Smallest trade value allowed, smaller trades are not made
+        target_field: Field of the global target
+        global_weight: Weight of the global target term against the per-account terms
+
+    Returns:
+        _aRebalanceProblem
+    """
+    columns = valuation.columns
+    cashByAccount = {account: float((cashByAccount or {}).get(account, 0.0)) for account in columns.accounts}
+    accountTotals = {account: float(valuation.account_value(account)) + cashByAccount[account]
+                     for account in columns.accounts}
+    total = sum(accountTotals.values())
+    accountTargets = {account: [_fraction(t) for t in columns.targetsByAccount[a]]
+                      for a, account in enumerate(columns.accounts)}
+    problem = _aRebalanceProblem([], accountTotals, cashByAccount, total, global_weight)
+
+    for i, aSymbol in enumerate(columns.symbols):
+        price = float(columns.prices[i])
+        globalTarget = _fraction(targets.get(aSymbol, {}).get(target_field, ''))
+        aProblem = _aSymbolProblem()
+        aProblem.symbol = aSymbol
+        aProblem.price = price
+        aProblem.accounts, aProblem.held, aProblem.values, aProblem.targets = [], [], [], []
+        aProblem.otherValue = 0.0
+        for a, account in enumerate(columns.accounts):
+            held = int(columns.nbSharesByAccount[a][i])
+            target = accountTargets[account][i]
+            if all(t is None for t in accountTargets[account]):
+                target = globalTarget
+            if target is None or price <= 0 or accountTotals[account] <= 0:
+                aProblem.otherValue += held * price
+                continue
+            aProblem.accounts.append(account)
+            aProblem.held.append(held)
+            aProblem.values.append(held * price)
+            aProblem.targets.append(target)
+        if not aProblem.accounts:
+            continue
+        aProblem.globalTarget = globalTarget if total > 0 else None
+        aProblem.minShares = max(1, math.ceil(min_trade_value / price - 1e-9)) if min_trade_value > 0 else 1
+        aProblem.ideal = _continuous_trades(problem, aProblem)
+        problem.symbols.append(aProblem)
+    return problem
+
+def _continuous_trades(problem, aProblem):
+    """
+    Fractional trades minimizing the objective of a symbol, ignoring cash and rounding.
+
+    Setting the gradient to zero gives y_a = r_a - w * A_a^2 * z / T, where y_a is the traded
+    value, r_a the value needed to reach the account target, A_a the account total and z the
+    global allocation gap after the trades, solved in closed form through their sum.
+    """
+    totals = [problem.accountTotals[account] for account in aProblem.accounts]
+    needed = [A * t - v for A, t, v in zip(totals, aProblem.targets, aProblem.values)]
+    if aProblem.globalTarget is None:
+        aTrades = needed
+    else:
+        T = problem.total
+        w = problem.globalWeight
+        Q = sum(A * A for A in totals)
+        current = (aProblem.otherValue + sum(aProblem.values)) / T
+        S = (sum(needed) - w * Q / T * (current - aProblem.globalTarget)) / (1 + w * Q / (T * T))
+        z = current + S / T - aProblem.globalTarget
+        aTrades = [r - w * A * A * z / T for r, A in zip(needed, totals)]
+    return [max(y / aProblem.price, -held) for y, held in zip(aTrades, aProblem.held)]
+
+def _allowed(shares, held, minShares):
+    """Whether a trade size respects the no-short and min trade size constraints"""
+    return shares == 0 or (abs(shares) >= minShares and shares >= -held)
+
+def _step(shares, direction, held, minShares):
+    """Next allowed trade size from shares in direction (+1 or -1), None when there is none"""
+    aNext = shares + direction
+    if aNext != 0 and abs(aNext) < minShares:
+        aNext = 0 if shares != 0 else direction * minShares
+    return aNext if _allowed(aNext, held, minShares) else None
+
+def _nearest_allowed(shares, held, minShares):
+    aRounded = max(round(shares), -held)
+    if _allowed(aRounded, held, minShares):
+        return aRounded
+    aEdge = int(math.copysign(minShares, aRounded))
+    # Round to the closer of no trade and the smallest allowed trade
+    return aEdge if abs(shares - aEdge) < abs(shares) and _allowed(aEdge, held, minShares) else 0
+
+def _spend_by_account(problem, shares):
+    aSpend = {account: 0.0 for account in problem.accountTotals}
+    for aProblem, aShares in zip(problem.symbols, shares):
+        for account, nb in zip(aProblem.accounts, aShares):
+            aSpend[account] += nb * aProblem.price
+    return aSpend
+
+def _greedy(problem, max_iterations=100000):
+    """
+    Round the continuous trades, repair cash, then apply the best single-share move until
+    no move lowers the objective.
+    """
+    shares = [[_nearest_allowed(x, held, aProblem.minShares) for x, held in zip(aProblem.ideal, aProblem.held)]
+              for aProblem in problem.symbols]
+    objectives = [aProblem.objective(problem, s) for aProblem, s in zip(problem.symbols, shares)]
+    spend = _spend_by_account(problem, shares)
+
+    def moves(account_filter=None, direction_filter=None):
+        for k, aProblem in enumerate(problem.symbols):
+            for a, account in enumerate(aProblem.accounts):
+                if account_filter is not None and account != account_filter:
+                    continue
+                for direction in (1, -1):
+                    if direction_filter is not None and direction != direction_filter:
+                        continue
+                    aNext = _step(shares[k][a], direction, aProblem.held[a], aProblem.minShares)
+                    if aNext is None:
+                        continue
+                    aShares = list(shares[k])
+                    aShares[a] = aNext
+                    yield k, a, aShares, aProblem.objective(problem, aShares) - objectives[k], \
+                        (aNext - shares[k][a]) * aProblem.price
+
+    def apply(k, a, aShares, delta, cost):
+        spend[problem.symbols[k].accounts[a]] += cost
+        shares[k] = aShares
+        objectives[k] += delta
+
+    # Cash repair: free cash at the lowest objective cost per dollar
+    for account in problem.accountTotals:
+        while spend[account] > problem.cashByAccount[account] + 1e-9:
+            aBest = min(moves(account, -1), key=lambda m: m[3] / -m[4], default=None)
+            if aBest is None:
+                logging.warning(f"[{account.upper()}] Unable to fund the trades with the available cash")
+                break
+            apply(*aBest)
+
+    for _ in range(max_iterations):
+        aBest = None
+        for aMove in moves():
+            k, a, aShares, delta, cost = aMove
+            account = problem.symbols[k].accounts[a]
+            if delta < -1e-15 and spend[account] + cost <= problem.cashByAccount[account] + 1e-9:
+                if aBest is None or delta < aBest[3]:
+                    aBest = aMove
+        if aBest is None:
+            break
+        apply(*aBest)
+    return shares
+
+def _candidates(problem, aProblem, radius):
+    """All allowed share combinations of a symbol around its continuous trades, without dominated ones"""
+    perAccount = []
+    for x, held in zip(aProblem.ideal, aProblem.held):
+        aValues = {0}
+        for aShares in range(math.floor(x) - radius, math.ceil(x) + radius + 1):
+            if _allowed(aShares, held, aProblem.minShares):
+                aValues.add(aShares)
+        perAccount.append(sorted(aValues))
+    aCandidates = sorted(
+        (aProblem.objective(problem, combo), tuple(nb * aProblem.price for nb in combo), combo)
+        for combo in product(*perAccount))
+    # Keep a candidate only if it spends less in some account than every better candidate
+    kept = []
+    for aCandidate in aCandidates:
+        if all(any(s < o for s, o in zip(aCandidate[1], other[1])) for other in kept):
+            kept.append(aCandidate)
+    return kept
+
+def _exact(problem, radius=2, max_nodes=1000000, initial=None):
+    """
+    Branch and bound over the whole-share trades within radius of the continuous optimum.
+
+    Symbols are decided one at a time; a branch is cut when its objective plus the best
+    objective of the remaining symbols cannot beat the best plan found, or when the remaining
+    symbols cannot free enough cash for an account.
+
+    Returns:
+        Tuple (shares, optimal)
+    """
+    accounts = list(problem.accountTotals)
+    symbols = problem.symbols
+    candidates = [_candidates(problem, aProblem, radius) for aProblem in symbols]
+    spendIndex = [[accounts.index(account) for account in aProblem.accounts] for aProblem in symbols]
+    # Decide the symbols with the widest objective range first
+    order = sorted(range(len(symbols)), key=lambda k: candidates[k][0][0] - candidates[k][-1][0])
+    minObjective = [0.0] * (len(order) + 1)
+    minSpend = [[0.0] * len(accounts) for _ in range(len(order) + 1)]
+    for depth in range(len(order) - 1, -1, -1):
+        k = order[depth]
+        minObjective[depth] = minObjective[depth + 1] + candidates[k][0][0]
+        minSpend[depth] = list(minSpend[depth + 1])
+        for a, index in enumerate(spendIndex[k]):
+            minSpend[depth][index] += min(c[1][a] for c in candidates[k])
+    cash = [problem.cashByAccount[account] + 1e-9 for account in accounts]
+
+    best = [math.inf, None]
+    if initial is not None:
+        spend = _spend_by_account(problem, initial)
+        if all(spend[account] <= cash[i] for i, account in enumerate(accounts)):
+            best = [sum(p.objective(problem, s) for p, s in zip(symbols, initial)), list(initial)]
+    chosen = [None] * len(symbols)
+    spend = [0.0] * len(accounts)
+    nodes = [0]
+
+    def search(depth, objective):
+        if depth == len(order):
+            if objective < best[0]:
+                best[0], best[1] = objective, list(chosen)
+            return True
+        k = order[depth]
+        for aObjective, aSpend, combo in candidates[k]:
+            if objective + aObjective + minObjective[depth + 1] >= best[0]:
+                break  # candidates are sorted by objective
+            nodes[0] += 1
+            if nodes[0] > max_nodes:
+                return False
+            for a, index in enumerate(spendIndex[k]):
+                spend[index] += aSpend[a]
+            if all(spend[i] + minSpend[depth + 1][i] <= cash[i] for i in range(len(accounts))):
+                chosen[k] = list(combo)
+                if not search(depth + 1, objective + aObjective):
+                    return False
+            for a, index in enumerate(spendIndex[k]):
+                spend[index] -= aSpend[a]
+        return True
+
+    optimal = search(0, 0.0)
+    if not optimal:
+        logging.warning(f"Exact rebalancing stopped after {max_nodes} nodes, returning the best plan found")
+    if best[1] is None:
+        logging.warning("No trade list satisfies the cash constraints, no trade proposed")
+        best[1] = [[0] * len(aProblem.accounts) for aProblem in symbols]
+    return best[1], optimal
+
+def rebalance(valuation, targets, cashByAccount=None, min_trade_value=0.0, mode='greedy',
+              target_field='target_global', global_weight=1.0, radius=2, max_nodes=1000000):
+    """
+    Compute a whole-share trade list bringing the accounts to their targets.
+
+    Minimizes the squared tracking error to the per-account targets and the global target,
+    under the cash of each account (trades of an account are funded by its own sells and
+    cash), no short sales and a minimum trade value.
+
+    Args:
+        valuation: aValuation of the consolidated portfolio
+        targets: Dictionary mapping stock symbols to target objects
+        cashByAccount: Optional cash available to each account
+        min_trade_value: Smallest trade value allowed
+        mode: 'greedy' (rounding plus single-share moves) or 'exact' (branch and bound
+            within radius shares of the continuous optimum, seeded with the greedy plan)
+        target_field: Field of the global target
+        global_weight: Weight of the global target term against the per-account terms
+        radius: Search radius of the exact mode, in shares
+        max_nodes: Node limit of the exact mode
+
+    Returns:
+        aRebalancePlan
+    """
+    if mode not in REBALANCE_MODES:
+        raise ValueError(f"Unknown rebalancing mode: {mode}")
+    problem = build_rebalance_problem(valuation, targets, cashByAccount, min_trade_value,
+                                      target_field, global_weight)
+    logging.info(f"Rebalancing {len(problem.symbols)} symbols ({mode})")
+    shares = _greedy(problem)
+    optimal = True
+    if mode == 'exact':
+        shares, optimal = _exact(problem, radius, max_nodes, initial=shares)
+
+    trades = []
+    for aProblem, aShares in zip(problem.symbols, shares):
+        for account, nb in zip(aProblem.accounts, aShares):
+            if nb:
+                trades.append(aTrade(account, aProblem.symbol, nb, aProblem.price))
+    trades.sort(key=lambda t: (t.account, t.nbShares > 0, t.symbol))
+    spend = _spend_by_account(problem, shares)
+    cashLeft = {account: problem.cashByAccount[account] - spend[account] for account in problem.accountTotals}
+    noTrades = [[0] * len(aProblem.accounts) for aProblem in problem.symbols]
+    objectiveBefore = sum(p.objective(problem, s) for p, s in zip(problem.symbols, noTrades))
+    objectiveAfter = sum(p.objective(problem, s) for p, s in zip(problem.symbols, shares))
+    return aRebalancePlan(trades, cashLeft, objectiveBefore, objectiveAfter, mode, optimal)
+
+def parse_cash(aText):
+    """
+    Parse a cash specification such as 'ibkr=1000,cs=250.5' into a dictionary.
+
+    Raises:
+        ValueError: If an entry is not account=amount, its account is unknown or its amount is not a number
+    """
+    cashByAccount = {}
+    for aItem in filter(None, (part.strip() for part in (aText or '').split(','))):
+        account, sep, amount = aItem.partition('=')
+        account = account.strip().lower()
+        if not sep:
+            raise ValueError(f"Invalid cash entry (expected account=amount): {aItem}")
+        if account not in ACCOUNTS:
+            raise ValueError(f"Unknown account in cash entry {aItem} (expected one of {', '.join(ACCOUNTS)})")
+        try:
+            cash = float(amount)
+        except ValueError:
+            raise ValueError(f"Invalid cash amount in entry {aItem}") from None
+        if not math.isfinite(cash):
+            raise ValueError(f"Invalid cash amount in entry {aItem}")
+        cashByAccount[account] = cash
+    return cashByAccount
+
+def write_rebalance_csv(plan, output_file):
+    """Write the trade list of a rebalancing plan to a CSV file"""
+    with open(output_file, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(REBALANCE_FIELDS)
+        writer.writerows(plan.as_rows())
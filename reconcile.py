@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+"""
+Reconciliation of trade history against position snapshots.
+
+Starts from the per-account positions of a prior merged snapshot (snapshot database or
+holdings CSV), replays the trades made since then and compares the expected quantities
+with the positions of the new broker exports.
+"""
+
+import csv
+import sys
+import logging
+import argparse
+from mainBrokers import setup_logging, loadSharesCs, loadSharesIBKR, load_single_stocks, iso_date
+from mainTrades import aTradeSource, merge_trade_sources
+from brokerAdapters import ACCOUNT_BROKERS
+
+# Quantities closer than this are considered equal (fractional shares)
+QUANTITY_TOLERANCE = 1e-6
+
+RECONCILIATION_FIELDS = ["account", "ticker", "snapshotShares", "tradedShares", "expectedShares",
+                         "actualShares", "difference", "nbTrades", "status"]
+
+class aReconciliationLine:
+    """Expected and actual quantity of one symbol in one account"""
+    __slots__ = ('account', 'symbol', 'snapshotShares', 'tradedShares', 'actualShares', 'nbTrades')
+
+    def __init__(self, account, symbol):
+        self.account = account
+        self.symbol = symbol
+        self.snapshotShares = 0.0
+        self.tradedShares = 0.0
+        self.actualShares = 0.0
+        self.nbTrades = 0
+
+    @property
+    def expectedShares(self):
+        return self.snapshotShares + self.tradedShares
+
+    @property
+    def difference(self):
+        return self.actualShares - self.expectedShares
+
+    @property
+    def is_break(self):
+        return abs(self.difference) > QUANTITY_TOLERANCE
+
+    def as_row(self):
+        return [self.account, self.symbol, f"{self.snapshotShares:g}", f"{self.tradedShares:g}",
+                f"{self.expectedShares:g}", f"{self.actualShares:g}", f"{self.difference:g}", self.nbTrades,
+                'break' if self.is_break else 'ok']
+
+class aReconciliation:
+    """
+    Reconciliation lines indexed by (account, symbol), so each snapshot position, trade and
+    new position is applied in constant time.
+    """
+    def __init__(self):
+        self.lines = {}
+        self.nbTradesReplayed = 0
+        self.nbTradesSkipped = 0
+
+    def line(self, account, symbol):
+        aKey = (account, symbol)
+        aLine = self.lines.get(aKey)
+        if aLine is None:
+            aLine = aReconciliationLine(account, symbol)
+            self.lines[aKey] = aLine
+        return aLine
+
+    def add_snapshot(self, positions):
+        """Add the quantities of the prior snapshot ({(account, symbol): nbShares})"""
+        for (account, symbol), nbShares in positions.items():
+            self.line(account, symbol).snapshotShares += nbShares
+
+    def replay(self, account, iTrades, since=None, until=None):
+        """
+        Apply the trades of an account made after the snapshot date (and up to until).
+
+        Dates are compared on their day: trades of the snapshot day are part of the snapshot.
+        """
+        for aTrade in iTrades:
+            aDay = aTrade.date[:10]
+            if (since and aDay <= since[:10]) or (until and aDay > until[:10]):
+                self.nbTradesSkipped += 1
+                continue
+            aLine = self.line(account, aTrade.symbol)
+            aLine.tradedShares += aTrade.quantity
+            aLine.nbTrades += 1
+            self.nbTradesReplayed += 1
+
+    def add_positions(self, account, iShares):
+        """Add the new positions of an account (aShare objects)"""
+        for aShare in iShares:
+            self.line(account, aShare.symbol).actualShares += aShare.nbShares
+
+    def breaks(self):
+        return [aLine for aLine in self.lines.values() if aLine.is_break]
+
+    def sorted_lines(self):
+        return [self.lines[aKey] for aKey in sorted(self.lines)]
+
+def load_holdings_positions(holdings_file, accounts=tuple(ACCOUNT_BROKERS)):
+    """
+    Per-account quantities of a holdings CSV written by mainBrokers.py (nbShares_<account> columns).
+
+    Returns:
+        Dictionary mapping (account, symbol) to the number of shares
+    """
+    positions = {}
+    with open(holdings_file, 'r', newline='') as f:
+        for row in csv.DictReader(f):
+            for account in accounts:
+                nbShares = float(row.get(f'nbShares_{account}') or 0)
+                if nbShares:
+                    positions[(account, row['ticker'])] = nbShares
+    return positions
+
+def load_snapshot(snapshot_db, snapshot_date=None, label=None):
+    """
+    Per-account quantities of the last snapshot taken on or before a date.
+
+    Returns:
+        Tuple (positions, snapshot date)
+
+    Raises:
+        ValueError: If there is no such snapshot
+    """
+    from snapshotStore import aSnapshotStore
+    with aSnapshotStore(snapshot_db) as store:
+        snapshot = store.latest_snapshot(snapshot_date, label)
+        if snapshot is None:
+            raise ValueError(f"No snapshot found in {snapshot_db}" + (f" on or before {snapshot_date}" if snapshot_date else ''))
+        logging.info(f"Reconciling from snapshot {snapshot['id']} taken at {snapshot['taken_at']}")
+        return store.snapshot_positions(snapshot['id']), snapshot['taken_at']
+
+def reconcile(snapshot_positions, trade_files, position_files, since=None, until=None):
+    """
+    Replay the trades since a snapshot and compare the result with new positions.
+
+    Args:
+        snapshot_positions: Dictionary mapping (account, symbol) to the snapshot quantity
+        trade_files: Dictionary mapping each account to its list of trade files
+        position_files: Dictionary mapping each account to its new positions file
+        since: Snapshot date, trades on or before it are already in the snapshot
+        until: Optional last trade date included (date of the new positions)
+
+    Returns:
+        aReconciliation
+    """
+    aResult = aReconciliation()
+    aResult.add_snapshot(snapshot_positions)
+    for account, filenames in trade_files.items():
+        sources = [aTradeSource(filename, ACCOUNT_BROKERS[account]) for filename in filenames]
+        aResult.replay(account, merge_trade_sources(sources), since, until)
+    for account, filename in position_files.items():
+        aShares = []
+        if ACCOUNT_BROKERS[account] == 'ibkr':
+            loadSharesIBKR(aShares, filename)
+        else:
+            loadSharesCs(aShares, filename)
+        aResult.add_positions(account, aShares)
+    return aResult
+
+def write_reconciliation_csv(aResult, output_file):
+    """Write every reconciliation line (status 'ok' or 'break') to a CSV file"""
+    with open(output_file, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(RECONCILIATION_FIELDS)
+        writer.writerows(aLine.as_row() for aLine in aResult.sorted_lines())
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Reconcile trade history against position snapshots.')
+    parser.add_argument('--snapshot-db', type=str, default=None,
+                      help='Snapshot database written by mainBrokers.py --snapshot-db (prior positions)')
+    parser.add_argument('--snapshot-date', type=iso_date, default=None,
+                      help='Use the last snapshot taken on or before this date (default: the last one)')
+    parser.add_argument('--snapshot-label', type=str, default=None,
+                      help='Only use snapshots with this label (required when the database holds several labels)')
+    parser.add_argument('--holdings', type=str, default=None,
+                      help='Prior holdings CSV written by mainBrokers.py, instead of --snapshot-db (requires --since)')
+    parser.add_argument('--since', type=iso_date, default=None,
+                      help='Date of the prior positions; later trades are replayed (default: the snapshot date)')
+    parser.add_argument('--until', type=iso_date, default=None,
+                      help='Date of the new positions; later trades are ignored (optional)')
+    for account in ACCOUNT_BROKERS:
+        parser.add_argument(f'--{account}', type=str, default=None,
+                          help=f'New {account.upper()} positions CSV file')
+        parser.add_argument(f'--{account}-trades', nargs='+', default=[],
+                          help=f'{account.upper()} trades CSV file(s) since the snapshot')
+    parser.add_argument('--output', default='reconciliation.csv',
+                      help='Reconciliation output file (default: reconciliation.csv)')
+    parser.add_argument('--single-stocks', type=str, default='single_stocks.json',
+                      help='JSON list of single stocks excluded from the merge (default: single_stocks.json)')
+    parser.add_argument('--debug', action='store_true',
+                      help='Enable debug logging level')
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_arguments()
+
+    setup_logging(debug=args.debug)
+    load_single_stocks(args.single_stocks)
+
+    try:
+        if args.holdings:
+            if not args.since:
+                raise ValueError("--holdings requires --since (date of the prior positions)")
+            snapshot_positions, since = load_holdings_positions(args.holdings), args.since
+        elif args.snapshot_db:
+            snapshot_positions, since = load_snapshot(args.snapshot_db, args.snapshot_date, args.snapshot_label)
+            since = args.since or since
+        else:
+            raise ValueError("No prior positions. Use --snapshot-db or --holdings.")
+
+        position_files = {account: getattr(args, account) for account in ACCOUNT_BROKERS if getattr(args, account)}
+        trade_files = {account: getattr(args, f'{account}_trades') for account in ACCOUNT_BROKERS
+                       if getattr(args, f'{account}_trades')}
+        # Accounts without new positions cannot be checked
+        for account in list(trade_files):
+            if account not in position_files:
+                logging.warning(f"Ignoring the {account.upper()} trades, no new {account.upper()} positions given")
+                del trade_files[account]
+        snapshot_positions = {aKey: nbShares for aKey, nbShares in snapshot_positions.items()
+                              if aKey[0] in position_files}
+        result = reconcile(snapshot_positions, trade_files, position_files, since, args.until)
+    except (ValueError, OSError) as e:
+        logging.error(f"Reconciliation failed: {e}")
+        sys.exit(2)
+
+    write_reconciliation_csv(result, args.output)
+    breaks = result.breaks()
+    for aLine in breaks:
+        logging.error(f"[{aLine.account.upper()}] {aLine.symbol}: expected {aLine.expectedShares:g} shares "
+                      f"({aLine.snapshotShares:g} + {aLine.tradedShares:g} traded), found {aLine.actualShares:g}")
+    print(f"\nReplayed {result.nbTradesReplayed} trades, {len(result.lines)} positions checked, {len(breaks)} break(s)")
+    sys.exit(1 if breaks else 0)
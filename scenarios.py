@@ -0,0 +1,141 @@
+import os
+import csv
+import json
+import logging
+from portfolioValuation import np, build_target_columns, value_columns_batch
+
+# Shock applied to every symbol without a shock of its own
+DEFAULT_SHOCK_KEY = '*'
+
+SCENARIO_FIELDS = [
+    "scenario", "ticker", "price", "totalValue",
+    "currentAllocation", "currentAllocation_ibkr", "currentAllocation_cs", "currentAllocation_ira",
+    "sharesToTarget_ibkr", "sharesToTarget_cs", "sharesToTarget_ira"
+]
+
+class aScenario:
+    """
+    What-if scenario: relative price shocks (-0.2 for -20%) and/or absolute prices by symbol,
+    and an optional alternative targets file.
+    """
+    def __init__(self, name, shocks=None, prices=None, targets_file=None):
+        self.name = name
+        self.shocks = shocks or {}
+        self.prices = prices or {}
+        self.targets_file = targets_file
+
+    def price_column(self, columns):
+        """Prices of the scenario aligned on the symbol index of columns, from their base prices"""
+        default = 1 + float(self.shocks.get(DEFAULT_SHOCK_KEY, 0.0))
+        prices = columns.prices * default if np is not None else [price * default for price in columns.prices]
+        # Only the symbols named by the scenario are visited
+        for aSymbol, shock in self.shocks.items():
+            i = columns.index.get(aSymbol)
+            if i is not None:
+                prices[i] = columns.prices[i] * (1 + float(shock))
+        for aSymbol, price in self.prices.items():
+            i = columns.index.get(aSymbol)
+            if i is not None:
+                prices[i] = float(price)
+        return prices
+
+def _numbers(aValues, kind, aWhere):
+    """Convert the shocks or prices of a scenario to floats, skipping empty cells"""
+    aNumbers = {}
+    for aSymbol, value in aValues.items():
+        if value in (None, ''):
+            continue
+        try:
+            aNumbers[aSymbol] = float(value)
+        except (TypeError, ValueError):
+            raise ValueError(f"Invalid {kind} {value!r} for {aSymbol} at {aWhere}") from None
+    return aNumbers
+
+def load_scenarios(scenarios_file):
+    """
+    Load the scenarios of a JSON file or a CSV shock matrix.
+
+    JSON: {"scenarios": [{"name": ..., "shocks": {"VTI": -0.2, "*": -0.05}, "prices": {...},
+    "targets": "targets_alt.json"}, ...]}, target paths being relative to the file.
+    CSV: one row per scenario, a 'scenario' column then one column of relative shocks per
+    symbol ('*' for all other symbols) and an optional 'targets' column.
+
+    Returns:
+        List of aScenario
+
+    Raises:
+        ValueError: On a CSV row with more cells than the header, or a shock or price that is not a number
+    """
+    base_dir = os.path.dirname(os.path.abspath(scenarios_file))
+    def resolve(path):
+        return os.path.join(base_dir, path) if path else None
+
+    with open(scenarios_file, 'r', newline='') as f:
+        if scenarios_file.lower().endswith('.csv'):
+            scenarios = []
+            reader = csv.DictReader(f)
+            for i, row in enumerate(reader):
+                name = row.pop('scenario', '') or f"scenario_{i + 1}"
+                aWhere = f"line {reader.line_num} of {scenarios_file} (scenario {name})"
+                if None in row:
+                    raise ValueError(f"More cells than header columns at {aWhere}")
+                targets_file = resolve(row.pop('targets', ''))
+                shocks = _numbers(row, 'shock', aWhere)
+                scenarios.append(aScenario(name, shocks, targets_file=targets_file))
+        else:
+            aSpec = json.load(f)
+            aEntries = aSpec.get('scenarios', []) if isinstance(aSpec, dict) else aSpec
+            scenarios = []
+            for i, entry in enumerate(aEntries):
+                name = entry.get('name') or f"scenario_{i + 1}"
+                aWhere = f"scenario {name} of {scenarios_file}"
+                scenarios.append(aScenario(name, _numbers(entry.get('shocks') or {}, 'shock', aWhere),
+                                           _numbers(entry.get('prices') or {}, 'price', aWhere),
+                                           resolve(entry.get('targets'))))
+    logging.info(f"Loaded {len(scenarios)} scenario(s) from {scenarios_file}")
+    return scenarios
+
+def value_scenarios(valuation, scenarios, targets_by_file=None):
+    """
+    Value all scenarios of a portfolio in one batched computation.
+
+    Args:
+        valuation: Base aValuation (its columns and account values are reused)
+        scenarios: List of aScenario
+        targets_by_file: Dictionary mapping the alternative targets files of the scenarios to
+            their loaded targets
+
+    Returns:
+        aValuationBatch, one scenario per entry of scenarios
+    """
+    columns = valuation.columns
+    pricesBatch = [aScenario.price_column(columns) for aScenario in scenarios]
+    targetsBatch = None
+    if any(aScenario.targets_file for aScenario in scenarios):
+        # Build the target columns once per distinct file
+        aColumnsByFile = {None: columns.targetsByAccount}
+        for aScenario in scenarios:
+            if aScenario.targets_file not in aColumnsByFile:
+                aColumnsByFile[aScenario.targets_file] = build_target_columns(
+                    columns.symbols, (targets_by_file or {}).get(aScenario.targets_file, {}), columns.accounts)
+        targetsBatch = [aColumnsByFile[aScenario.targets_file] for aScenario in scenarios]
+    return value_columns_batch(columns, pricesBatch, targetsBatch, baseAccountValues=valuation.accountValues)
+
+def _format_shares(value):
+    return '' if value is None or value != value else f"{value:.0f}"
+
+def write_scenarios_csv(batch, scenarios, output_file):
+    """Write the allocations and shares to target of every scenario and symbol to a CSV file"""
+    accounts = batch.columns.accounts
+    aBuffer = []
+    for s, aScenario in enumerate(scenarios):
+        totalValue = f"{batch.totalValue[s]:.2f}"
+        for i, aSymbol in enumerate(batch.columns.symbols):
+            aBuffer.append([aScenario.name, aSymbol, f"{batch.prices[s][i]:.4f}", totalValue,
+                            f"{batch.allocations[s][i]:.2f}"]
+                           + [f"{batch.allocationsByAccount[s][a][i]:.2f}" for a in range(len(accounts))]
+                           + [_format_shares(batch.sharesToTarget[s][a][i]) for a in range(len(accounts))])
+    with open(output_file, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(SCENARIO_FIELDS)
+        writer.writerows(aBuffer)
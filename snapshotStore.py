@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+"""
+Append-only history of merged portfolios.
+
+Every merge can be recorded as a snapshot (date, optional label such as a household name)
+holding the quantity, price, value, allocation and target of each symbol, per account and
+for the consolidated portfolio (account '*'). Queries read the indexes only, so the
+history of a symbol over years of snapshots comes back without re-running any merge.
+"""
+
+import csv
+import sys
+import sqlite3
+import logging
+import argparse
+from datetime import date
+
+# Account label of the consolidated portfolio rows
+PORTFOLIO_ACCOUNT = '*'
+
+SCHEMA_VERSION = 1
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS snapshots (
+    id INTEGER PRIMARY KEY,
+    taken_at TEXT NOT NULL,
+    label TEXT NOT NULL DEFAULT '',
+    target_field TEXT NOT NULL DEFAULT '',
+    total_value REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_snapshots_label_date ON snapshots (label, taken_at);
+CREATE INDEX IF NOT EXISTS idx_snapshots_date ON snapshots (taken_at);
+
+CREATE TABLE IF NOT EXISTS account_values (
+    snapshot_id INTEGER NOT NULL REFERENCES snapshots (id),
+    account TEXT NOT NULL,
+    value REAL NOT NULL,
+    PRIMARY KEY (snapshot_id, account)
+) WITHOUT ROWID;
+
+-- Clustered by symbol so the history of one symbol is a contiguous range
+CREATE TABLE IF NOT EXISTS positions (
+    symbol TEXT NOT NULL,
+    account TEXT NOT NULL,
+    snapshot_id INTEGER NOT NULL REFERENCES snapshots (id),
+    nbShares REAL NOT NULL,
+    price REAL NOT NULL,
+    value REAL NOT NULL,
+    allocation REAL NOT NULL,
+    target REAL,
+    PRIMARY KEY (symbol, account, snapshot_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_positions_snapshot ON positions (snapshot_id, account);
+"""
+
+def _number(value):
+    """Target or valuation value as a float, None when missing (None, '' or NaN)"""
+    if value is None or value == '':
+        return None
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+    return None if value != value else value
+
+class aSnapshotStore:
+    """
+    SQLite store of portfolio snapshots.
+
+    Snapshots are only ever appended; the query methods return lists of dictionaries
+    ordered by date.
+    """
+    def __init__(self, db_file):
+        self.db_file = db_file
+        self.connection = sqlite3.connect(db_file)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.executescript(_SCHEMA)
+        self.connection.execute(f"PRAGMA user_version={SCHEMA_VERSION}")
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def record(self, holdings, targets=None, taken_at=None, label=''):
+        """
+        Append the merged holdings as a new snapshot.
+
+        Args:
+            holdings: aHoldings returned by PortfolioMerger.merge
+            targets: Optional dictionary mapping stock symbols to target objects, stored with
+                each position (target_<account>, and holdings.target_field for the portfolio)
+            taken_at: Snapshot date (ISO format, default: today)
+            label: Optional label of the portfolio (e.g. household name)
+
+        Returns:
+            Id of the new snapshot
+        """
+        taken_at = str(taken_at or date.today().isoformat())
+        targets = targets or {}
+        valuation = holdings.valuation
+        columns = valuation.columns
+        rows = []
+        for i, aSymbol in enumerate(columns.symbols):
+            target_obj = targets.get(aSymbol) or {}
+            price = float(columns.prices[i])
+            nbShares = float(columns.nbShares[i])
+            rows.append((aSymbol, PORTFOLIO_ACCOUNT, nbShares, price, nbShares * price,
+                         float(valuation.allocations[i]), _number(target_obj.get(holdings.target_field))))
+            for a, account in enumerate(columns.accounts):
+                nbAccountShares = float(columns.nbSharesByAccount[a][i])
+                if nbAccountShares:
+                    rows.append((aSymbol, account, nbAccountShares, price, nbAccountShares * price,
+                                 float(valuation.allocationsByAccount[a][i]),
+                                 _number(target_obj.get(f'target_{account}'))))
+
+        with self.connection:
+            cursor = self.connection.execute(
+                "INSERT INTO snapshots (taken_at, label, target_field, total_value) VALUES (?, ?, ?, ?)",
+                (taken_at, label, holdings.target_field, float(valuation.totalValue)))
+            snapshot_id = cursor.lastrowid
+            self.connection.executemany(
+                "INSERT INTO account_values (snapshot_id, account, value) VALUES (?, ?, ?)",
+                [(snapshot_id, account, float(valuation.account_value(account))) for account in columns.accounts])
+            self.connection.executemany(
+                "INSERT INTO positions (symbol, account, snapshot_id, nbShares, price, value, allocation, target) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [(aSymbol, account, snapshot_id, *values) for aSymbol, account, *values in rows])
+        logging.info(f"Recorded snapshot {snapshot_id} ({taken_at}{', ' + label if label else ''}) "
+                     f"with {len(rows)} positions in {self.db_file}")
+        return snapshot_id
+
+    def _query(self, sql, params):
+        return [dict(row) for row in self.connection.execute(sql, params)]
+
+    @staticmethod
+    def _period_filter(start, end, label, params):
+        """SQL conditions on the snapshots table (alias s), appending their parameters"""
+        conditions = []
+        if start:
+            conditions.append("s.taken_at >= ?")
+            params.append(str(start))
+        if end:
+            # Dates compare as text, so an end date includes all its timestamps
+            conditions.append("s.taken_at <= ?")
+            params.append(f"{end}\uffff")
+        if label is not None:
+            conditions.append("s.label = ?")
+            params.append(label)
+        return ''.join(f" AND {condition}" for condition in conditions)
+
+    def snapshots(self, start=None, end=None, label=None):
+        """List the snapshots (id, taken_at, label, target_field, total_value) of a period"""
+        params = []
+        where = self._period_filter(start, end, label, params)
+        return self._query(f"SELECT s.* FROM snapshots s WHERE 1 = 1{where} ORDER BY s.taken_at, s.id", params)
+
+    def symbol_history(self, symbol, account=PORTFOLIO_ACCOUNT, start=None, end=None, label=None):
+        """
+        History of one symbol in one account (the consolidated portfolio by default, every
+        account and the portfolio when account is None).
+
+        Returns:
+            List of {snapshot_id, taken_at, label, account, nbShares, price, value, allocation, target}
+        """
+        params = [symbol]
+        account_filter = ''
+        if account is not None:
+            account_filter = " AND p.account = ?"
+            params.append(account)
+        where = self._period_filter(start, end, label, params)
+        return self._query(
+            "SELECT p.snapshot_id, s.taken_at, s.label, p.account, p.nbShares, p.price, p.value, p.allocation, p.target "
+            "FROM positions p JOIN snapshots s ON s.id = p.snapshot_id "
+            f"WHERE p.symbol = ?{account_filter}{where} ORDER BY s.taken_at, s.id, p.account", params)
+
+    def allocation_drift(self, symbol, account=PORTFOLIO_ACCOUNT, start=None, end=None, label=None):
+        """
+        Allocation of a symbol against its target over time.
+
+        Returns:
+            List of {taken_at, label, account, allocation, target, drift}; drift is allocation minus
+            target in percentage points, None when there was no target
+        """
+        history = self.symbol_history(symbol, account, start, end, label)
+        return [{
+            'taken_at': row['taken_at'],
+            'label': row['label'],
+            'account': row['account'],
+            'allocation': row['allocation'],
+            'target': row['target'],
+            'drift': None if row['target'] is None else row['allocation'] - row['target'],
+        } for row in history]
+
+    def labels(self):
+        """Distinct labels of the recorded snapshots, sorted"""
+        return [row[0] for row in self.connection.execute("SELECT DISTINCT label FROM snapshots ORDER BY label")]
+
+    def _single_label(self, label):
+        """
+        Label of the snapshots to compare: label, or the only label of the database when None.
+
+        Raises:
+            ValueError: If label is None and the database holds several labels (e.g. households)
+        """
+        if label is not None:
+            return label
+        labels = self.labels()
+        if len(labels) > 1:
+            raise ValueError(f"{self.db_file} holds snapshots of {len(labels)} labels "
+                             f"({', '.join(repr(aLabel) for aLabel in labels)}), give the label to use")
+        return labels[0] if labels else ''
+
+    def latest_snapshot(self, on_or_before=None, label=None):
+        """
+        The last snapshot taken on or before a date (the last one overall by default), or None.
+
+        Raises:
+            ValueError: If label is None and the database holds several labels
+        """
+        label = self._single_label(label)
+        params = []
+        where = self._period_filter(None, on_or_before, label, params)
+        rows = self._query(f"SELECT s.* FROM snapshots s WHERE 1 = 1{where} ORDER BY s.taken_at DESC, s.id DESC LIMIT 1",
+                           params)
+        return rows[0] if rows else None
+
+    def snapshot_positions(self, snapshot_id):
+        """
+        Per-account quantities of a snapshot (without the consolidated portfolio rows).
+
+        Returns:
+            Dictionary mapping (account, symbol) to the number of shares
+        """
+        return {(row['account'], row['symbol']): row['nbShares'] for row in self.connection.execute(
+            "SELECT account, symbol, nbShares FROM positions WHERE snapshot_id = ? AND account != ?",
+            (snapshot_id, PORTFOLIO_ACCOUNT))}
+
+    def period_deltas(self, start, end, account=PORTFOLIO_ACCOUNT, label=None):
+        """
+        Change of every symbol between the last snapshots on or before two dates.
+
+        Returns:
+            List of {symbol, nbShares_before, nbShares_after, delta_nbShares, value_before,
+            value_after, delta_value, allocation_before, allocation_after, delta_allocation},
+            symbols held at only one of the two dates counting as 0 at the other
+
+        Raises:
+            ValueError: If label is None and the database holds several labels
+        """
+        label = self._single_label(label)
+        before = self.latest_snapshot(start, label)
+        after = self.latest_snapshot(end, label)
+        if before is None or after is None:
+            return []
+        positions = {}
+        for key, snapshot in (('before', before), ('after', after)):
+            for row in self.connection.execute(
+                    "SELECT symbol, nbShares, value, allocation FROM positions WHERE snapshot_id = ? AND account = ?",
+                    (snapshot['id'], account)):
+                positions.setdefault(row['symbol'], {})[key] = row
+        deltas = []
+        for aSymbol in sorted(positions):
+            aDelta = {'symbol': aSymbol}
+            for field in ('nbShares', 'value', 'allocation'):
+                value_before = positions[aSymbol]['before'][field] if 'before' in positions[aSymbol] else 0.0
+                value_after = positions[aSymbol]['after'][field] if 'after' in positions[aSymbol] else 0.0
+                aDelta[f'{field}_before'] = value_before
+                aDelta[f'{field}_after'] = value_after
+                aDelta[f'delta_{field}'] = value_after - value_before
+            deltas.append(aDelta)
+        return deltas
+
+def _write_rows(rows, output):
+    if not rows:
+        return
+    writer = csv.DictWriter(output, fieldnames=list(rows[0]))
+    writer.writeheader()
+    writer.writerows(rows)
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Query the snapshot history recorded by mainBrokers.py --snapshot-db.')
+    parser.add_argument('db', help='Snapshot database file')
+    parser.add_argument('--symbol', type=str, default=None, help='Print the history of this symbol')
+    parser.add_argument('--drift', action='store_true', help='With --symbol, print the allocation drift to target')
+    parser.add_argument('--deltas', nargs=2, metavar=('START', 'END'), default=None,
+                        help='Print the change of every symbol between two dates')
+    parser.add_argument('--account', type=str, default=PORTFOLIO_ACCOUNT,
+                        help="Account to query (default: '*', the consolidated portfolio; 'all' for every account)")
+    parser.add_argument('--label', type=str, default=None,
+                        help='Only use snapshots with this label (required by --deltas when there are several labels)')
+    parser.add_argument('--start', type=str, default=None, help='First date of the period (ISO format)')
+    parser.add_argument('--end', type=str, default=None, help='Last date of the period (ISO format)')
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_arguments()
+    account = None if args.account == 'all' else args.account
+    with aSnapshotStore(args.db) as store:
+        if args.deltas:
+            try:
+                rows = store.period_deltas(args.deltas[0], args.deltas[1], account or PORTFOLIO_ACCOUNT, args.label)
+            except ValueError as e:
+                logging.error(str(e))
+                sys.exit(1)
+        elif args.symbol and args.drift:
+            rows = store.allocation_drift(args.symbol, account, args.start, args.end, args.label)
+        elif args.symbol:
+            rows = store.symbol_history(args.symbol, account, args.start, args.end, args.label)
+        else:
+            rows = store.snapshots(args.start, args.end, args.label)
+        _write_rows(rows, sys.stdout)
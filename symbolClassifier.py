@@ -0,0 +1,113 @@
+import re
+import json
+import hashlib
+import logging
+from functools import lru_cache
+
+# Symbol classification codes (values match the ROW_* status codes of brokerAdapters.py)
+SYMBOL_PROPER = 0
+SYMBOL_OPTION = 1
+SYMBOL_SINGLE_STOCK = 2
+SYMBOL_INVALID = 4
+
+# Size of the per-ticker classification cache
+CLASSIFY_CACHE_SIZE = 4096
+
+# Single stocks are excluded from the merge (default list, can be overridden from a JSON file)
+DEFAULT_SINGLE_STOCKS = frozenset([
+    'MSFT', 'SBIT', 'IBM', 'BILI', 'VEOEY', 'VEEV', 'NOW', 'AMZN', 'AMC', 'SPIP',
+    'BRK/B', 'GOOGL', 'CLSK', 'GOOG', 'DOCS', 'ADSK', 'WDAY', 'CRM'
+])
+
+_PROPER_SYMBOL_PATTERN = re.compile(r"[A-Za-z]{2,5}|\w+\/\w+")
+# Matches option format: "SPY 12/19/2025 550.00 P"
+_OPTION_PATTERN = re.compile(r"[A-Z]+\s+\d{1,2}/\d{1,2}/\d{4}\s+\d+\.\d{2}\s+[PC]")
+# Both formats in a single pass; they cannot overlap since only options contain spaces
+_SYMBOL_PATTERN = re.compile(
+    r"(?P<option>[A-Z]+\s+\d{1,2}/\d{1,2}/\d{4}\s+\d+\.\d{2}\s+[PC])|(?P<proper>[A-Za-z]{2,5}|\w+\/\w+)"
+)
+
+_single_stocks = DEFAULT_SINGLE_STOCKS
+
+def isItProperSymbol(aSymbol):
+    return _PROPER_SYMBOL_PATTERN.fullmatch(aSymbol) is not None
+
+def isItOption(aSymbol):
+    return _OPTION_PATTERN.fullmatch(aSymbol) is not None
+
+def isItASingleStock(aSymbol):
+    return aSymbol.upper() in _single_stocks
+
+@lru_cache(maxsize=CLASSIFY_CACHE_SIZE)
+def classify_symbol(aSymbol):
+    """
+    Classify a ticker, memoized per distinct ticker string.
+
+    Args:
+        aSymbol: Ticker as read from the broker file
+
+    Returns:
+        SYMBOL_OPTION, SYMBOL_SINGLE_STOCK, SYMBOL_PROPER or SYMBOL_INVALID
+    """
+    aMatch = _SYMBOL_PATTERN.fullmatch(aSymbol)
+    if aMatch is not None and aMatch.lastgroup == 'option':
+        return SYMBOL_OPTION
+    if aSymbol.upper() in _single_stocks:
+        return SYMBOL_SINGLE_STOCK
+    if aMatch is None:
+        return SYMBOL_INVALID
+    return SYMBOL_PROPER
+
+def get_single_stocks():
+    return _single_stocks
+
+def set_single_stocks(iSymbols):
+    """
+    Replace the set of excluded single stocks and invalidate the classification cache.
+
+    Args:
+        iSymbols: Iterable of ticker symbols
+    """
+    global _single_stocks
+    _single_stocks = frozenset(aSymbol.upper() for aSymbol in iSymbols)
+    classify_symbol.cache_clear()
+
+def load_single_stocks(single_stocks_file='single_stocks.json'):
+    """
+    Load the excluded single stocks from a JSON file containing a list of tickers.
+
+    Falls back to DEFAULT_SINGLE_STOCKS when the file does not exist or cannot be parsed.
+
+    Args:
+        single_stocks_file: Path to the single stocks JSON file
+
+    Returns:
+        Frozenset of the excluded tickers now in use
+    """
+    try:
+        with open(single_stocks_file, 'r') as f:
+            aSymbols = json.load(f)
+        set_single_stocks(aSymbols)
+        logging.info(f"Loaded {len(_single_stocks)} single stocks from {single_stocks_file}")
+    except FileNotFoundError:
+        logging.info(f"Single stocks file '{single_stocks_file}' not found. Using the default list.")
+        set_single_stocks(DEFAULT_SINGLE_STOCKS)
+    except (json.JSONDecodeError, TypeError, AttributeError) as e:
+        logging.error(f"Error parsing single stocks file: {e}. Using the default list.")
+        set_single_stocks(DEFAULT_SINGLE_STOCKS)
+    return _single_stocks
+
+def classify_cache_stats():
+    """Return the classification cache statistics as a dictionary (hits, misses, size, hit_rate)"""
+    aInfo = classify_symbol.cache_info()
+    aLookups = aInfo.hits + aInfo.misses
+    return {
+        'hits': aInfo.hits,
+        'misses': aInfo.misses,
+        'size': aInfo.currsize,
+        'hit_rate': (aInfo.hits / aLookups) if aLookups else 0.0,
+    }
+
+def single_stocks_fingerprint():
+    """Return a short stable identifier of the single stocks in use (e.g. for cache keys)"""
+    return hashlib.sha256(','.join(sorted(_single_stocks)).encode('utf-8')).hexdigest()[:16]
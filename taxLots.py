@@ -0,0 +1,404 @@
+#!/usr/bin/env python3
+"""
+Per-account tax-lot store with FIFO, HIFO and specific-lot selection.
+
+Lots (acquisition date, quantity, unit cost) are built from the broker trade histories or
+loaded from a lots CSV file. mainBrokers.py --tax-lots uses them to compute the realized
+gains of the sales proposed by the sharesToTarget_* columns.
+"""
+
+import csv
+import sys
+import json
+import math
+import logging
+import argparse
+from bisect import bisect_left
+from datetime import date
+from mainBrokers import setup_logging, load_single_stocks
+from mainTrades import aTradeSource, merge_trade_sources
+from brokerAdapters import ACCOUNT_BROKERS
+
+LOT_METHODS = ('fifo', 'hifo', 'specific')
+
+# A lot held more than this many days gives a long-term gain
+LONG_TERM_DAYS = 365
+
+# Quantities below this are considered zero (fractional shares)
+QUANTITY_TOLERANCE = 1e-9
+
+LOT_FIELDS = ["lot_id", "account", "symbol", "acquired", "quantity", "cost"]
+TAX_FIELDS = ["account", "ticker", "sharesToSell", "price", "proceeds", "costBasis", "realizedGain",
+              "shortTermGain", "longTermGain", "nbLots", "unmatchedShares"]
+
+class aLot:
+    """Open quantity of one purchase: acquisition date (ISO), quantity and unit cost basis"""
+    __slots__ = ('lot_id', 'account', 'symbol', 'acquired', 'quantity', 'cost', 'seq')
+
+    def __init__(self, lot_id, account, symbol, acquired, quantity, cost, seq=0):
+        self.lot_id = lot_id
+        self.account = account
+        self.symbol = symbol
+        self.acquired = acquired
+        self.quantity = quantity
+        self.cost = cost
+        # Insertion order, breaks ties between lots of the same date
+        self.seq = seq
+
+    def date_key(self):
+        return (self.acquired, self.seq, self.lot_id)
+
+    def cost_key(self):
+        return (-self.cost, self.acquired, self.seq, self.lot_id)
+
+    def as_row(self):
+        return [self.lot_id, self.account, self.symbol, self.acquired, f"{self.quantity:g}", f"{self.cost:.6g}"]
+
+class aLotBook:
+    """
+    Open lots of one symbol in one account.
+
+    Lots are indexed by id and kept in two sorted orders, by acquisition date (FIFO) and by
+    decreasing cost (HIFO). A selection walks only the lots it uses and an exhausted lot is
+    removed by bisection, so books with tens of thousands of lots stay fast. Lots added in
+    bulk are sorted once, on the first selection.
+    """
+    def __init__(self, account, symbol):
+        self.account = account
+        self.symbol = symbol
+        self.lots = {}
+        self.quantity = 0.0
+        self._byDate = []
+        self._byCost = []
+        self._sorted = True
+
+    def __len__(self):
+        return len(self.lots)
+
+    def add(self, aNewLot):
+        if aNewLot.lot_id in self.lots:
+            raise ValueError(f"Duplicate lot id {aNewLot.lot_id}")
+        self.lots[aNewLot.lot_id] = aNewLot
+        self.quantity += aNewLot.quantity
+        self._byDate.append(aNewLot.date_key())
+        self._byCost.append(aNewLot.cost_key())
+        self._sorted = False
+
+    def _ensure_sorted(self):
+        if not self._sorted:
+            self._byDate.sort()
+            self._byCost.sort()
+            self._sorted = True
+
+    def _ordered_lots(self, method, lot_ids=()):
+        """Yield the open lots in selection order (specific lots first, then FIFO)"""
+        self._ensure_sorted()
+        if method == 'specific':
+            for lot_id in lot_ids:
+                iLot = self.lots.get(lot_id)
+                if iLot is None:
+                    logging.warning(f"[{self.account.upper()}] Unknown or closed lot {lot_id} of {self.symbol}")
+                    continue
+                yield iLot
+            lot_ids = set(lot_ids)
+            for aKey in self._byDate:
+                if aKey[-1] not in lot_ids:
+                    yield self.lots[aKey[-1]]
+            return
+        for aKey in (self._byCost if method == 'hifo' else self._byDate):
+            yield self.lots[aKey[-1]]
+
+    def select(self, quantity, method='fifo', lot_ids=()):
+        """
+        Choose the lots a sale of quantity shares would close, without changing the book.
+
+        Args:
+            quantity: Number of shares sold (positive)
+            method: 'fifo' (oldest first), 'hifo' (highest cost first) or 'specific'
+                (lot_ids in order, then oldest first)
+            lot_ids: Lot ids of a specific selection
+
+        Returns:
+            Tuple (list of (aLot, quantity taken), quantity not covered by any lot)
+        """
+        if method not in LOT_METHODS:
+            raise ValueError(f"Unknown lot selection method '{method}', expected one of {', '.join(LOT_METHODS)}")
+        selection = []
+        remaining = quantity
+        for iLot in self._ordered_lots(method, lot_ids):
+            if remaining <= QUANTITY_TOLERANCE:
+                break
+            taken = min(iLot.quantity, remaining)
+            selection.append((iLot, taken))
+            remaining -= taken
+        return selection, max(remaining, 0.0)
+
+    def _remove(self, iLot):
+        self._ensure_sorted()
+        for aIndex, aKey in ((self._byDate, iLot.date_key()), (self._byCost, iLot.cost_key())):
+            del aIndex[bisect_left(aIndex, aKey)]
+        del self.lots[iLot.lot_id]
+
+    def close(self, selection):
+        """Take the quantities of a selection out of their lots, removing the exhausted lots"""
+        for iLot, taken in selection:
+            iLot.quantity -= taken
+            self.quantity -= taken
+            if iLot.quantity <= QUANTITY_TOLERANCE:
+                self._remove(iLot)
+
+class aRealization:
+    """Realized gain of one sale, split by lot and by holding period"""
+    def __init__(self, account, symbol, quantity, price, on_date):
+        self.account = account
+        self.symbol = symbol
+        self.quantity = quantity
+        self.price = price
+        self.on_date = on_date
+        # (lot_id, acquired, quantity, unit cost, gain, long term)
+        self.lots = []
+        self.unmatched = 0.0
+        self.costBasis = 0.0
+        self.shortTermGain = 0.0
+        self.longTermGain = 0.0
+
+    @property
+    def proceeds(self):
+        return (self.quantity - self.unmatched) * self.price
+
+    @property
+    def realizedGain(self):
+        return self.shortTermGain + self.longTermGain
+
+    def add_lot(self, iLot, taken):
+        gain = taken * (self.price - iLot.cost)
+        long_term = (date.fromisoformat(self.on_date[:10]) - date.fromisoformat(iLot.acquired[:10])).days > LONG_TERM_DAYS
+        self.lots.append((iLot.lot_id, iLot.acquired, taken, iLot.cost, gain, long_term))
+        self.costBasis += taken * iLot.cost
+        if long_term:
+            self.longTermGain += gain
+        else:
+            self.shortTermGain += gain
+
+    def as_row(self):
+        return [self.account, self.symbol, f"{self.quantity:g}", f"{self.price:.4f}", f"{self.proceeds:.2f}",
+                f"{self.costBasis:.2f}", f"{self.realizedGain:.2f}", f"{self.shortTermGain:.2f}",
+                f"{self.longTermGain:.2f}", len(self.lots), f"{self.unmatched:g}"]
+
+class aTaxLotStore:
+    """Lot books indexed by (account, symbol)"""
+    def __init__(self):
+        self.books = {}
+        self._seq = 0
+
+    def __len__(self):
+        return sum(len(aBook) for aBook in self.books.values())
+
+    def book(self, account, symbol, create=False):
+        aKey = (account, symbol)
+        aBook = self.books.get(aKey)
+        if aBook is None and create:
+            aBook = aLotBook(account, symbol)
+            self.books[aKey] = aBook
+        return aBook
+
+    def add_lot(self, account, symbol, acquired, quantity, cost, lot_id=None):
+        """Open a lot (lot_id defaults to '<account>-<sequence number>')"""
+        self._seq += 1
+        aNewLot = aLot(lot_id or f"{account}-{self._seq}", account, symbol, acquired, quantity, cost, self._seq)
+        self.book(account, symbol, create=True).add(aNewLot)
+        return aNewLot
+
+    def realize(self, account, symbol, quantity, price, on_date=None, method='fifo', lot_ids=(), close=False):
+        """
+        Realized gain of selling shares of a symbol in an account.
+
+        Args:
+            account, symbol: Position sold
+            quantity: Number of shares sold (positive)
+            price: Sale price per share
+            on_date: ISO sale date, for the holding periods (default: today)
+            method: Lot selection method (see aLotBook.select)
+            lot_ids: Lot ids of a specific selection
+            close: Also take the sold quantities out of the lots
+
+        Returns:
+            aRealization; shares not covered by open lots are reported as unmatched
+        """
+        on_date = str(on_date or date.today().isoformat())
+        aResult = aRealization(account, symbol, quantity, price, on_date)
+        aBook = self.book(account, symbol)
+        if aBook is None:
+            aResult.unmatched = quantity
+            return aResult
+        selection, aResult.unmatched = aBook.select(quantity, method, lot_ids)
+        for iLot, taken in selection:
+            aResult.add_lot(iLot, taken)
+        if close:
+            aBook.close(selection)
+        return aResult
+
+    def apply_trades(self, account, iTrades, method='fifo'):
+        """
+        Replay date-sorted trades of an account: buys open lots (fees added to their cost),
+        sells close lots with the selection method.
+
+        Returns:
+            Number of shares sold without an open lot (short sales are not tracked as lots)
+        """
+        unmatched = 0.0
+        for aTrade in iTrades:
+            if aTrade.quantity > 0:
+                self.add_lot(account, aTrade.symbol, aTrade.date[:10], aTrade.quantity,
+                             aTrade.price + aTrade.fees / aTrade.quantity)
+            elif aTrade.quantity < 0:
+                aResult = self.realize(account, aTrade.symbol, -aTrade.quantity, aTrade.price, aTrade.date, method,
+                                       close=True)
+                if aResult.unmatched > QUANTITY_TOLERANCE:
+                    logging.warning(f"[{account.upper()}] {aResult.unmatched:g} {aTrade.symbol} shares sold on "
+                                    f"{aTrade.date} without an open lot")
+                    unmatched += aResult.unmatched
+        return unmatched
+
+    def lots(self):
+        """All open lots, by account, symbol and acquisition order"""
+        aLots = []
+        for aKey in sorted(self.books):
+            aBook = self.books[aKey]
+            aBook._ensure_sorted()
+            aLots.extend(aBook.lots[aKey[-1]] for aKey in aBook._byDate)
+        return aLots
+
+def load_lots_csv(lots_file, store=None):
+    """
+    Load the lots of a CSV file (LOT_FIELDS columns, lot_id optional) into a store.
+
+    Raises:
+        ValueError: On a row with a missing or invalid field, a quantity that is not positive
+            or a negative cost
+    """
+    store = store or aTaxLotStore()
+    with open(lots_file, 'r', newline='') as f:
+        for n, row in enumerate(csv.DictReader(f), start=2):
+            try:
+                acquired = date.fromisoformat(row['acquired'].strip()[:10]).isoformat()
+                quantity = float(row['quantity'])
+                cost = float(row['cost'])
+                if not (math.isfinite(quantity) and quantity > 0):
+                    raise ValueError(f"quantity must be positive, got {row['quantity']!r}")
+                if not (math.isfinite(cost) and cost >= 0):
+                    raise ValueError(f"cost must not be negative, got {row['cost']!r}")
+                store.add_lot(row['account'].strip().lower(), row['symbol'].strip(), acquired,
+                              quantity, cost, (row.get('lot_id') or '').strip() or None)
+            except (KeyError, AttributeError, ValueError) as e:
+                raise ValueError(f"Invalid lot at line {n} of {lots_file}: {e}") from e
+    logging.info(f"Loaded {len(store)} lots in {len(store.books)} books from {lots_file}")
+    return store
+
+def write_lots_csv(store, output_file):
+    with open(output_file, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(LOT_FIELDS)
+        writer.writerows(iLot.as_row() for iLot in store.lots())
+
+def load_specific_lots(specific_file):
+    """
+    Load a specific-lot selection: {"<account>": {"<symbol>": ["<lot_id>", ...]}}
+
+    Raises:
+        ValueError: If the selection is not in that form, or lists a lot id twice for a symbol
+    """
+    with open(specific_file, 'r') as f:
+        aSelection = json.load(f)
+    if not isinstance(aSelection, dict) or not all(isinstance(aLots, dict) for aLots in aSelection.values()):
+        raise ValueError(f"Invalid specific lots in {specific_file}, expected {{account: {{symbol: [lot ids]}}}}")
+    for account, aLots in aSelection.items():
+        for aSymbol, lot_ids in aLots.items():
+            if not isinstance(lot_ids, list) or not all(isinstance(lot_id, str) for lot_id in lot_ids):
+                raise ValueError(f"Invalid specific lots of {aSymbol} in {account} in {specific_file}, "
+                                 f"expected a list of lot ids")
+            if len(set(lot_ids)) != len(lot_ids):
+                raise ValueError(f"Specific lots of {aSymbol} in {account} in {specific_file} list a lot id twice")
+    return aSelection
+
+def holdings_sales(holdings):
+    """
+    Sales proposed by the sharesToTarget_* columns of merged holdings.
+
+    Returns:
+        List of (account, symbol, number of shares sold, price), in holdings order
+    """
+    valuation = holdings.valuation
+    columns = valuation.columns
+    sales = []
+    for a, account in enumerate(columns.accounts):
+        for i, aSymbol in enumerate(columns.symbols):
+            shares_needed = valuation.sharesToTarget[a][i]
+            if shares_needed is None or shares_needed != shares_needed:  # None or NaN: no target
+                continue
+            nbShares = round(float(shares_needed))
+            if nbShares < 0:
+                sales.append((account, aSymbol, -nbShares, float(columns.prices[i])))
+    return sales
+
+def realize_sales(store, sales, on_date=None, method='fifo', specific_lots=None):
+    """
+    Realized gains of a list of sales, leaving the lots open.
+
+    Args:
+        store: aTaxLotStore
+        sales: Iterable of (account, symbol, number of shares, price), e.g. holdings_sales(holdings)
+        on_date: ISO sale date (default: today)
+        method: Lot selection method
+        specific_lots: Lot ids by account and symbol, for the specific method
+
+    Returns:
+        List of aRealization
+    """
+    specific_lots = specific_lots or {}
+    return [store.realize(account, symbol, nbShares, price, on_date, method,
+                          specific_lots.get(account, {}).get(symbol, ()))
+            for account, symbol, nbShares, price in sales]
+
+def write_tax_csv(realizations, output_file):
+    with open(output_file, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(TAX_FIELDS)
+        writer.writerows(aResult.as_row() for aResult in realizations)
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Build tax lots from the broker trade histories.')
+    for account in ACCOUNT_BROKERS:
+        parser.add_argument(f'--{account}-trades', nargs='+', default=[],
+                          help=f'{account.upper()} trades CSV file(s)')
+    parser.add_argument('--lots', type=str, default=None,
+                      help='Existing lots CSV file the trades are applied to (e.g. lots before the trade history)')
+    parser.add_argument('--method', choices=('fifo', 'hifo'), default='fifo',
+                      help='Lot selection method of the past sales (default: fifo)')
+    parser.add_argument('--output', default='lots.csv',
+                      help='Open lots output file (default: lots.csv)')
+    parser.add_argument('--single-stocks', type=str, default='single_stocks.json',
+                      help='JSON list of single stocks excluded from the merge (default: single_stocks.json)')
+    parser.add_argument('--debug', action='store_true',
+                      help='Enable debug logging level')
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_arguments()
+
+    setup_logging(debug=args.debug)
+    load_single_stocks(args.single_stocks)
+
+    try:
+        store = load_lots_csv(args.lots) if args.lots else aTaxLotStore()
+        for account in ACCOUNT_BROKERS:
+            filenames = getattr(args, f'{account}_trades')
+            if filenames:
+                sources = [aTradeSource(filename, ACCOUNT_BROKERS[account]) for filename in filenames]
+                store.apply_trades(account, merge_trade_sources(sources), args.method)
+    except (ValueError, OSError) as e:
+        logging.error(f"Building the lots failed: {e}")
+        sys.exit(1)
+
+    write_lots_csv(store, args.output)
+    print(f"\n{len(store)} open lot(s) in {len(store.books)} position(s) written to {args.output}")
@@ -0,0 +1,148 @@
+import csv
+import logging
+from statistics import median
+
+# Price conflict policies: stop the merge, use the price of preferred accounts, or the median of all quotes
+PRICE_POLICIES = ('abort', 'prefer', 'median')
+
+ISSUE_KINDS = ('price_conflict', 'invalid_file', 'invalid_row', 'missing_target')
+
+VALIDATION_FIELDS = ["kind", "symbol", "account", "source", "line", "detail", "resolution"]
+
+class PriceConflictException(ValueError):
+    """Raised by the abort policy once all the price conflicts of a merge are in the report"""
+    def __init__(self, message, report):
+        super().__init__(message)
+        self.report = report
+
+class aValidationIssue:
+    """One problem found while loading or merging positions"""
+    __slots__ = ('kind', 'symbol', 'account', 'source', 'line', 'detail', 'resolution')
+
+    def __init__(self, kind, symbol='', account='', source='', line='', detail='', resolution=''):
+        self.kind = kind
+        self.symbol = symbol
+        self.account = account
+        self.source = source
+        self.line = line
+        self.detail = detail
+        self.resolution = resolution
+
+    def as_row(self):
+        return [self.kind, self.symbol, self.account, self.source, self.line, self.detail, self.resolution]
+
+class aValidationReport:
+    """
+    Issues of a merge, collected instead of stopping at the first one: price conflicts
+    between accounts, files of unknown format, rows that could not be read and symbols
+    without a target.
+    """
+    def __init__(self):
+        self.issues = []
+
+    def __len__(self):
+        return len(self.issues)
+
+    def add(self, kind, symbol='', account='', source='', line='', detail='', resolution=''):
+        self.issues.append(aValidationIssue(kind, symbol, account, source, line, detail, resolution))
+
+    def add_row_errors(self, source, account, iRowErrors):
+        """Add the invalid rows of a file, given as (line number, reason, row text) tuples"""
+        for line, reason, text in iRowErrors:
+            self.add('invalid_row', account=account, source=source, line=line, detail=f"{reason}: {text}")
+
+    def by_kind(self, kind):
+        return [aIssue for aIssue in self.issues if aIssue.kind == kind]
+
+    def counts(self):
+        """Number of issues per kind, in ISSUE_KINDS order (kinds without issues are left out)"""
+        aCounts = {}
+        for aIssue in self.issues:
+            aCounts[aIssue.kind] = aCounts.get(aIssue.kind, 0) + 1
+        return {kind: aCounts[kind] for kind in ISSUE_KINDS if kind in aCounts}
+
+    def summary(self):
+        if not self.issues:
+            return "no issue"
+        return ", ".join(f"{count} {kind}" for kind, count in self.counts().items())
+
+    def as_dicts(self):
+        return [dict(zip(VALIDATION_FIELDS, aIssue.as_row())) for aIssue in self.sorted_issues()]
+
+    def sorted_issues(self):
+        """Issues grouped by kind (ISSUE_KINDS order), in the order they were found within a kind"""
+        return sorted(self.issues, key=lambda aIssue: ISSUE_KINDS.index(aIssue.kind))
+
+class aPricePolicy:
+    """
+    How the consolidated price of a symbol is chosen when the quotes of its positions are
+    not within range of each other.
+
+    Args:
+        mode: One of PRICE_POLICIES
+        preferred_accounts: Accounts whose quote is used by the prefer mode, in order of preference
+    """
+    def __init__(self, mode='abort', preferred_accounts=()):
+        if mode not in PRICE_POLICIES:
+            raise ValueError(f"Unknown price policy '{mode}', expected one of {', '.join(PRICE_POLICIES)}")
+        if mode == 'prefer' and not preferred_accounts:
+            raise ValueError("The prefer price policy needs at least one account (e.g. prefer:ibkr)")
+        self.mode = mode
+        self.preferred_accounts = list(preferred_accounts)
+
+    def __str__(self):
+        if self.mode == 'prefer':
+            return f"prefer:{','.join(self.preferred_accounts)}"
+        return self.mode
+
+    def resolve(self, quotes):
+        """
+        Choose the price of a symbol from its conflicting quotes.
+
+        Args:
+            quotes: List of (account, price) in the order the positions were merged
+
+        Returns:
+            Tuple (price, description of the choice); price is None under the abort policy
+        """
+        if self.mode == 'abort':
+            return None, 'aborted'
+        if self.mode == 'prefer':
+            for account in self.preferred_accounts:
+                for aAccount, aPrice in quotes:
+                    if aAccount == account:
+                        return aPrice, f"{account} price"
+        # The prefer policy falls back on the median when no preferred account quotes the symbol
+        aPrice = median(aPrice for _, aPrice in quotes)
+        return aPrice, f"median of {len(quotes)} quotes"
+
+def parse_price_policy(aSpec):
+    """
+    Parse a price policy such as 'abort', 'median' or 'prefer:ibkr,cs'.
+
+    Returns:
+        aPricePolicy
+
+    Raises:
+        ValueError: On an unknown policy or a prefer policy without accounts
+    """
+    mode, _, accounts = (aSpec or 'abort').partition(':')
+    return aPricePolicy(mode.strip().lower(),
+                        [account.strip().lower() for account in accounts.split(',') if account.strip()])
+
+def report_validation(report, output_file=None):
+    """Log the issue counts of a report (a warning when there are issues) and write it to an optional CSV file"""
+    if report.issues:
+        logging.warning(f"Validation: {report.summary()}")
+    else:
+        logging.info("Validation: no issue")
+    if output_file:
+        logging.info(f"Writing validation report to file: {output_file}")
+        write_validation_csv(report, output_file)
+
+def write_validation_csv(report, output_file):
+    """Write every issue of a validation report to a CSV file"""
+    with open(output_file, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(VALIDATION_FIELDS)
+        writer.writerows(aIssue.as_row() for aIssue in report.sorted_issues())